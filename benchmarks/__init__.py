@@ -0,0 +1,3 @@
+"""
+Benchmarks for Telegram Medical Bot
+"""
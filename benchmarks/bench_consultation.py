@@ -0,0 +1,265 @@
+"""
+Сквозной бенчмарк консультации: настоящие роутеры и middleware из main.py,
+синтетические обновления, заглушки Telegram и Groq, база в памяти (DB_BACKEND=memory)
+
+Запуск (из корня проекта):
+    python -m benchmarks.bench_consultation [--users 200] [--concurrency 50]
+        [--llm-latency uniform:0.15:0.45] [--llm-429 0.05] [--api-latency 0.02]
+        [--json results.json]
+
+Каждый пользователь проходит полный сценарий Consultation: новая консультация,
+симптомы, подтверждение, давность, выбор дополнительных симптомов, финальное
+подтверждение. Показывает обновления/сек, p50/p95/p99 по обработчикам и число
+вызовов Bot API на консультацию; --json сохраняет результаты для сравнения
+между релизами.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import os
+import platform
+import time
+
+# Заглушки вместо настоящих ключей: config.py требует их при импорте
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARKBENCHMARKBENCHMARKBENCHMARK")
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("DB_BACKEND", "memory")
+# Кэш LLM исказил бы замер: одинаковые симптомы отвечались бы из кэша
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+
+from aiogram import Bot
+
+from benchmarks.groq_server import GroqStubServer
+from benchmarks.stubs import FakeSession
+
+
+SYMPTOMS = [
+    "Болит голова уже третий день, особенно в висках, иногда тошнит",
+    "температура 38.5, кашель сухой, слабость и ломота в теле",
+    "Сыпь на руках и зуд, появилась после нового крема",
+    "Боль в пояснице, отдаёт в ногу, усиливается при наклоне",
+    "насморк, заложенность носа, болит горло при глотании",
+    "Часто мочусь, постоянная жажда и сухость во рту",
+]
+
+DURATION_BUTTONS = ["⏱ Меньше 24 часов", "📅 1-3 дня", "📅 3-7 дней", "📆 Больше недели"]
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Driver:
+    """Генерирует обновления пользователя и подаёт их в диспетчер"""
+
+    def __init__(self, dp, bot: Bot, session: FakeSession):
+        self.dp = dp
+        self.bot = bot
+        self.session = session
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.updates = 0
+
+    async def _feed(self, update: dict):
+        self.updates += 1
+        await self.dp.feed_raw_update(self.bot, update)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": "Bench"}
+
+    async def text(self, user_id: int, text: str):
+        await self._feed({
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text
+            }
+        })
+
+    async def callback(self, user_id: int, data: str):
+        message = self.session.inline_messages[user_id]
+        await self._feed({
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": message.model_dump(mode="json", by_alias=True, exclude_none=True)
+            }
+        })
+
+    async def consultation(self, user_id: int, picks: int):
+        """Полный сценарий консультации одного пользователя"""
+        await self.text(user_id, "🩺 Новая консультация")
+        await self.text(user_id, SYMPTOMS[user_id % len(SYMPTOMS)])
+        await self.text(user_id, "✅ Подтвердить")
+        await self.text(user_id, DURATION_BUTTONS[user_id % len(DURATION_BUTTONS)])
+        for index in range(picks):
+            await self.callback(user_id, f"sym_{index}")
+        await self.callback(user_id, "done_additional")
+        await self.text(user_id, "✅ Подтвердить")
+
+
+async def run(args) -> dict:
+    llm = GroqStubServer(
+        latency=args.llm_latency, rate_429=args.llm_429, rate_timeout=args.llm_timeout,
+        rate_malformed=args.llm_malformed
+    )
+    os.environ["GROQ_BASE_URL"] = await llm.start()
+
+    # Импорт после запуска заглушки: AIService читает GROQ_BASE_URL при создании
+    import main as app
+    from bot.edit_coalescer import edit_coalescer
+    from bot.handlers import consultation
+    from bot.middlewares import BotApiTimingMiddleware
+    from services.metrics import metrics
+    from database.connection import get_supabase_client
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    db = await get_supabase_client()
+    first_user = 100_000
+    await db.table("user_profiles").insert([
+        {"user_id": user_id, "gender": "female", "birthdate": "1995-05-15"}
+        for user_id in range(first_user, first_user + args.users)
+    ]).execute()
+    db.query_count = 0
+
+    session = FakeSession(latency=args.api_latency)
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    session.middleware(BotApiTimingMiddleware())
+    if args.telegram_limits:
+        session.middleware(app.outbound)
+
+    driver = Driver(app.dp, bot, session)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    consultation_times = []
+    errors = 0
+
+    async def one(user_id: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await driver.consultation(user_id, args.picks)
+            except Exception as e:
+                errors += 1
+                print(f"Consultation error ({user_id}): {e}")
+            consultation_times.append(time.perf_counter() - started)
+
+    # Обработчики много печатают (DEBUG) - это мешает замеру
+    output = open(os.devnull, "w") if not args.verbose else None
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+        await asyncio.gather(*(one(user_id) for user_id in range(first_user, first_user + args.users)))
+        # Отложенные правки клавиатур и фоновые задачи
+        while edit_coalescer.stats()["pending"]:
+            await asyncio.sleep(0.05)
+    wall = time.perf_counter() - started
+    if output:
+        output.close()
+
+    await consultation.ai_service.close()
+    await llm.stop()
+
+    consultation_times.sort()
+    completed = args.users - errors
+    # Время обработчиков - из встроенных метрик (services.metrics)
+    handlers = {}
+    for (name, state), stats in sorted(metrics.handlers.items()):
+        handlers[name] = {
+            "state": state,
+            "count": stats.wall.count,
+            "errors": stats.errors,
+            "p50_ms": round(stats.wall.percentile(0.5) * 1000, 3),
+            "p95_ms": round(stats.wall.percentile(0.95) * 1000, 3),
+            "p99_ms": round(stats.wall.percentile(0.99) * 1000, 3),
+            **{f"{dependency}_mean_ms": round(hist.total / max(hist.count, 1) * 1000, 3)
+               for dependency, hist in stats.waits.items()}
+        }
+
+    return {
+        "benchmark": "consultation",
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "params": {
+            "users": args.users, "concurrency": args.concurrency, "picks": args.picks,
+            "llm_latency": args.llm_latency, "llm_429": args.llm_429, "llm_timeout": args.llm_timeout,
+            "llm_malformed": args.llm_malformed, "api_latency": args.api_latency,
+            "telegram_limits": args.telegram_limits
+        },
+        "wall_s": round(wall, 3),
+        "updates": driver.updates,
+        "updates_per_s": round(driver.updates / wall, 1),
+        "consultations": completed,
+        "errors": errors,
+        "consultations_per_s": round(completed / wall, 2),
+        "consultation_p50_s": round(percentile(consultation_times, 0.5), 3),
+        "consultation_p99_s": round(percentile(consultation_times, 0.99), 3),
+        "handlers": handlers,
+        "bot_api": {
+            "calls_per_consultation": round(session.total() / max(completed, 1), 2),
+            "by_method": {
+                method: round(count / max(completed, 1), 2) for method, count in session.calls.most_common()
+            }
+        },
+        "llm_requests_per_consultation": round(llm.requests / max(completed, 1), 2),
+        "llm": llm.stats(),
+        "db_queries_per_consultation": round(db.query_count / max(completed, 1), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="Сколько консультаций провести")
+    parser.add_argument("--concurrency", type=int, default=50, help="Сколько пользователей одновременно")
+    parser.add_argument("--picks", type=int, default=3, help="Сколько дополнительных симптомов отмечать")
+    parser.add_argument("--llm-latency", default="uniform:0.15:0.45",
+                        help="Распределение задержки LLM (формат benchmarks.groq_server)")
+    parser.add_argument("--llm-429", type=float, default=0.0, help="Доля ответов LLM 429")
+    parser.add_argument("--llm-timeout", type=float, default=0.0, help="Доля зависающих запросов LLM")
+    parser.add_argument("--llm-malformed", type=float, default=0.0, help="Доля некорректных ответов LLM")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Задержка Bot API (сек)")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="Пропускать запросы через лимитер исходящих сообщений")
+    parser.add_argument("--json", help="Сохранить результаты в файл JSON")
+    parser.add_argument("--verbose", action="store_true", help="Не скрывать вывод обработчиков")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    print("=== Консультация: сквозной бенчмарк ===")
+    print(f"Консультаций: {results['consultations']} (ошибок: {results['errors']}), "
+          f"одновременно: {args.concurrency}, задержка LLM: {args.llm_latency}")
+    print(f"Время: {results['wall_s']:.2f} с, обновлений: {results['updates']}")
+    print(f"Пропускная способность: {results['updates_per_s']:,.0f} обновлений/сек, "
+          f"{results['consultations_per_s']:,.1f} консультаций/сек")
+    print(f"Длительность консультации: p50 {results['consultation_p50_s']:.2f} с, "
+          f"p99 {results['consultation_p99_s']:.2f} с")
+    print(f"На консультацию: Bot API {results['bot_api']['calls_per_consultation']}, "
+          f"LLM {results['llm_requests_per_consultation']}, БД {results['db_queries_per_consultation']}")
+    print("\nBot API по методам (на консультацию):")
+    for method, count in results["bot_api"]["by_method"].items():
+        print(f"  {method:<28} {count}")
+    print("\nОбработчики (мс; llm/db/bot - среднее ожидание):")
+    print(f"  {'обработчик':<32} {'вызовов':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'llm':>8} {'db':>7} {'bot':>7}")
+    for name, row in results["handlers"].items():
+        print(f"  {name:<32} {row['count']:>8} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} "
+              f"{row['llm_mean_ms']:>8.2f} {row['db_mean_ms']:>7.2f} {row['bot_mean_ms']:>7.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
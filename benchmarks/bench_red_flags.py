@@ -0,0 +1,91 @@
+"""
+Бенчмарк детектора красных флагов
+
+Запуск (из корня проекта):
+    python -m benchmarks.bench_red_flags [--messages 200000] [--rate 50]
+
+Показывает стоимость проверки одного сообщения и долю одного ядра,
+которую детектор занимает при заданном потоке сообщений в секунду.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from services.red_flags import RedFlagDetector, stem
+
+
+SAMPLE_MESSAGES = [
+    "Болит голова уже третий день, особенно в висках, иногда тошнит",
+    "температура 38.5, кашель сухой, слабость и ломота в теле",
+    "Сильная давящая боль в груди, отдаёт в левую руку",
+    "жывот болит справо внизу когда хожу",
+    "у меня как бы голова болит и типа в висках стреляет уже 2 день",
+    "Сыпь на руках и зуд, появилась после нового крема",
+    "нет боли в груди, просто кашель по утрам",
+    "у мамы перекосило лицо и она не может говорить",
+    "Боль в пояснице, отдаёт в ногу, усиливается при наклоне",
+    "насморк, заложенность носа, болит горло при глотании",
+    "Задыхаюсь ночью, не хватает воздуха",
+    "Часто мочусь, постоянная жажда и сухость во рту",
+]
+
+
+def make_messages(count: int) -> list[str]:
+    """Сообщения с небольшими вариациями (чтобы не мерить только кэш стемминга)"""
+    rng = random.Random(42)
+    messages = []
+    for i in range(count):
+        text = rng.choice(SAMPLE_MESSAGES)
+        if i % 3 == 0:
+            text += f" уже {rng.randint(1, 30)} дней"
+        messages.append(text)
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200_000, help="Сколько сообщений проверить")
+    parser.add_argument("--rate", type=float, default=50, help="Сообщений в секунду в продакшене")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    detector = RedFlagDetector()
+    build_ms = (time.perf_counter() - started) * 1000
+
+    messages = make_messages(args.messages)
+
+    # Холодный проход: пустые кэши стемминга и поиска опечаток
+    stem.cache_clear()
+    cold_started = time.perf_counter()
+    for text in messages[:1000]:
+        detector.detect(text)
+    cold_us = (time.perf_counter() - cold_started) / 1000 * 1e6
+
+    # Тёплый проход с замером каждого сообщения
+    samples = []
+    matches = 0
+    total_started = time.perf_counter()
+    for text in messages:
+        t0 = time.perf_counter_ns()
+        if detector.detect(text):
+            matches += 1
+        samples.append(time.perf_counter_ns() - t0)
+    total = time.perf_counter() - total_started
+
+    samples.sort()
+    mean_us = statistics.fmean(samples) / 1000
+    p50_us = samples[len(samples) // 2] / 1000
+    p99_us = samples[int(len(samples) * 0.99)] / 1000
+
+    print("=== Детектор красных флагов ===")
+    print(f"Построение автомата: {build_ms:.1f} мс")
+    print(f"Сообщений: {len(messages)}, с красным флагом: {matches}")
+    print(f"Холодный кэш: {cold_us:.1f} мкс/сообщение")
+    print(f"Среднее: {mean_us:.1f} мкс, p50: {p50_us:.1f} мкс, p99: {p99_us:.1f} мкс")
+    print(f"Пропускная способность: {len(messages) / total:,.0f} сообщений/сек на одно ядро")
+    print(f"При {args.rate:g} сообщ./сек: {args.rate * mean_us / 1e4:.4f}% одного ядра")
+
+
+if __name__ == "__main__":
+    main()
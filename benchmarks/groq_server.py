@@ -0,0 +1,254 @@
+"""
+Локальный сервер, совместимый с Groq (chat completions), для нагрузочных тестов
+
+Отвечает на POST /openai/v1/chat/completions правдоподобными ответами для
+каждого промпта AIService (JSON проверки симптомов, улучшенный текст, массив
+симптомов, JSON рекомендации) и умеет имитировать проблемы: распределение
+задержек, 429 с retry-after, 500, зависания дольше таймаута клиента и
+некорректный JSON в ответе модели.
+
+Запуск (из корня проекта):
+    python -m benchmarks.groq_server [--port 8765] [--latency lognormal:0.3:0.5]
+        [--rate-429 0.05] [--rate-500 0.01] [--rate-timeout 0.01] [--rate-malformed 0.05]
+
+Бот направляется на сервер переменной окружения:
+    GROQ_BASE_URL=http://127.0.0.1:8765 python main.py
+
+GET /stats - счётчики запросов по типам промптов и исходам.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+from aiohttp import web
+
+
+SUGGESTED_SYMPTOMS = [
+    "Головокружение", "Слабость", "Тошнота", "Повышенная температура", "Озноб",
+    "Потеря аппетита", "Нарушение сна", "Боль в мышцах", "Сухость во рту", "Потливость"
+]
+
+# Ответы модели, которые AIService не сможет разобрать
+MALFORMED_RESPONSES = [
+    '{"is_valid": true, "improved_text": "Головная боль',
+    "Конечно! Вот ответ в формате JSON:",
+    '["Слабость", "Тошнота",',
+    "{'specialist': 'Терапевт', 'urgency': 'medium'}",
+    ""
+]
+
+
+# ============ ЗАДЕРЖКИ ============
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Распределение задержки ответа (сек) по описанию:
+        0.3                  - фиксированная
+        uniform:0.1:0.5      - равномерная от и до
+        exp:0.3              - экспоненциальная со средним
+        lognormal:0.3:0.5    - логнормальная с медианой и sigma (длинный хвост)
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(":")] if params else []
+    if not params:
+        fixed = float(kind)
+        return lambda rng: fixed
+    if kind == "uniform" and len(values) == 2:
+        low, high = values
+        return lambda rng: rng.uniform(low, high)
+    if kind == "exp" and len(values) == 1:
+        mean = values[0]
+        return lambda rng: rng.expovariate(1 / mean) if mean > 0 else 0.0
+    if kind == "lognormal" and len(values) == 2:
+        median, sigma = values
+        return lambda rng: median * rng.lognormvariate(0, sigma)
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+# ============ ОТВЕТЫ ============
+
+def prompt_family(system_prompt: str) -> str:
+    """Тип промпта AIService по его тексту"""
+    if "Выполни две задачи" in system_prompt:
+        return "check_and_improve"
+    if "проверить, описывает ли" in system_prompt:
+        return "validate"
+    if "медицинский редактор" in system_prompt:
+        return "improve"
+    if "дополнительных симптомов" in system_prompt:
+        return "additional"
+    if "специалиста" in system_prompt:
+        return "recommend"
+    return "unknown"
+
+
+def canned_completion(family: str, user_message: str) -> str:
+    """Правдоподобный ответ модели для типа промпта"""
+    text = user_message.split("\n\n", 1)[-1].strip()
+    if family == "check_and_improve":
+        return json.dumps({"is_valid": True, "reason": "", "improved_text": text}, ensure_ascii=False)
+    if family == "validate":
+        return json.dumps({"is_valid": True, "symptoms": text, "reason": ""}, ensure_ascii=False)
+    if family == "improve":
+        return text
+    if family == "additional":
+        return json.dumps(SUGGESTED_SYMPTOMS, ensure_ascii=False)
+    if family == "recommend":
+        return json.dumps({
+            "specialist": "Терапевт",
+            "urgency": "medium",
+            "reasoning": "Симптомы требуют очного осмотра терапевтом."
+        }, ensure_ascii=False)
+    return ""
+
+
+def count_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (по словам и знакам)"""
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+class GroqStubServer:
+    """Сервер chat completions с управляемыми задержками и сбоями"""
+
+    def __init__(self, latency: str = "0", rate_429: float = 0.0, rate_500: float = 0.0,
+                 rate_timeout: float = 0.0, rate_malformed: float = 0.0,
+                 retry_after: float = 1.0, hang: float = 120.0, seed: Optional[int] = 42):
+        self.latency = parse_latency(latency)
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.rate_timeout = rate_timeout
+        self.rate_malformed = rate_malformed
+        self.retry_after = retry_after
+        self.hang = hang
+        self._rng = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+        self.requests = 0
+        self.by_family: Counter = Counter()
+        self.outcomes: Counter = Counter()
+        self.tokens: Counter = Counter()
+
+    def _fault(self) -> Optional[str]:
+        """Какой сбой имитировать в этом запросе (None - без сбоя)"""
+        roll = self._rng.random()
+        for fault, rate in (("429", self.rate_429), ("500", self.rate_500),
+                            ("timeout", self.rate_timeout), ("malformed", self.rate_malformed)):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    async def completions(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        body = await request.json()
+        messages = {message["role"]: message["content"] for message in body.get("messages", [])}
+        family = prompt_family(messages.get("system", ""))
+        self.by_family[family] += 1
+
+        fault = self._fault()
+        if fault == "429":
+            self.outcomes["429"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "tokens", "code": "rate_limit_exceeded"}},
+                status=429, headers={"retry-after": f"{self.retry_after:g}"}
+            )
+        if fault == "500":
+            self.outcomes["500"] += 1
+            return web.json_response({"error": {"message": "Internal server error"}}, status=500)
+        if fault == "timeout":
+            # Клиент должен сдаться раньше
+            self.outcomes["timeout"] += 1
+            await asyncio.sleep(self.hang)
+
+        await asyncio.sleep(max(0.0, self.latency(self._rng)))
+
+        if fault == "malformed":
+            self.outcomes["malformed"] += 1
+            content = self._rng.choice(MALFORMED_RESPONSES)
+        else:
+            self.outcomes["ok"] += 1
+            content = canned_completion(family, messages.get("user", ""))
+
+        prompt_tokens = sum(count_tokens(text) for text in messages.values())
+        completion_tokens = count_tokens(content)
+        self.tokens["prompt"] += prompt_tokens
+        self.tokens["completion"] += completion_tokens
+        return web.json_response({
+            "id": f"chatcmpl-stub-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+    async def stats_handler(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'by_family': dict(self.by_family),
+            'outcomes': dict(self.outcomes),
+            'tokens': dict(self.tokens)
+        }
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/openai/v1/chat/completions", self.completions)
+        app.router.add_get("/stats", self.stats_handler)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер в текущем цикле событий; возвращает base_url для GROQ_BASE_URL"""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port, backlog=4096).start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:0.3:0.5", help="Распределение задержки (см. выше)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--rate-timeout", type=float, default=0.0, help="Доля зависающих запросов")
+    parser.add_argument("--rate-malformed", type=float, default=0.0, help="Доля ответов с некорректным JSON")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after в ответах 429 (сек)")
+    parser.add_argument("--hang", type=float, default=120.0, help="Сколько висит зависающий запрос (сек)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed генератора сбоев (для повторяемости)")
+    args = parser.parse_args()
+
+    server = GroqStubServer(
+        latency=args.latency, rate_429=args.rate_429, rate_500=args.rate_500,
+        rate_timeout=args.rate_timeout, rate_malformed=args.rate_malformed,
+        retry_after=args.retry_after, hang=args.hang, seed=args.seed
+    )
+    print(f"Groq stub on http://{args.host}:{args.port} (latency {args.latency})")
+    web.run_app(server.app(), host=args.host, port=args.port, access_log=None, print=None, backlog=4096)
+
+
+if __name__ == "__main__":
+    main()
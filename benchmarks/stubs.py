@@ -0,0 +1,68 @@
+"""
+Заглушка Telegram Bot API для бенчмарков
+(Groq - см. benchmarks.groq_server, Supabase - DB_BACKEND=memory)
+
+Заглушка работает в том же процессе и не ходит в сеть, поэтому замеры
+показывают стоимость кода бота.
+"""
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import Any, AsyncGenerator, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageReplyMarkup, EditMessageText, SendMessage, TelegramMethod
+from aiogram.types import Chat, InlineKeyboardMarkup, Message, User
+
+
+# ============ TELEGRAM ============
+
+class FakeSession(BaseSession):
+    """
+    Сессия бота без сети: отвечает на методы Bot API правдоподобными объектами
+    и считает вызовы по методам
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        # Последнее сообщение с инлайн-клавиатурой в чате (для callback-кнопок)
+        self.inline_messages: dict[int, Message] = {}
+        self._message_ids = itertools.count(1_000_000)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if isinstance(method, SendMessage):
+            message = Message(
+                message_id=next(self._message_ids),
+                date=int(time.time()),
+                chat=Chat(id=method.chat_id, type="private"),
+                from_user=User(id=bot.id, is_bot=True, first_name="Bot"),
+                text=method.text,
+                reply_markup=method.reply_markup if isinstance(method.reply_markup, InlineKeyboardMarkup) else None
+            ).as_(bot)
+            if message.reply_markup is not None:
+                self.inline_messages[method.chat_id] = message
+            return message
+        if isinstance(method, (EditMessageText, EditMessageReplyMarkup)):
+            return True
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url: str, headers: Optional[dict] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        """Сценарии бенчмарка не скачивают файлы: пустое содержимое"""
+        self.calls["stream_content"] += 1
+        return
+        yield
+
+    def total(self) -> int:
+        return sum(self.calls.values())
@@ -0,0 +1,115 @@
+"""
+Отложенное и объединённое редактирование инлайн-клавиатур
+
+Каждое нажатие на симптом меняло клавиатуру сразу: быстрые нажатия давали
+серию editMessageReplyMarkup, упирались в лимиты Telegram (429) и тормозили
+остальные чаты. Коалесер запоминает последнюю клавиатуру сообщения и
+отправляет не больше одного редактирования за окно: первое нажатие видно
+сразу, а серия следующих превращается в одно редактирование с итоговым
+состоянием в конце окна.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from config import EDIT_DEBOUNCE
+
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingEdit:
+    __slots__ = ("markup", "dirty", "task")
+
+    def __init__(self, markup: InlineKeyboardMarkup):
+        self.markup = markup
+        self.dirty = True
+        self.task: Optional[asyncio.Task] = None
+
+
+class EditCoalescer:
+    """Не больше одного editMessageReplyMarkup на сообщение за окно debounce"""
+
+    def __init__(self, delay: float = EDIT_DEBOUNCE):
+        self.delay = delay
+        self._pending: dict[tuple[int, int], _PendingEdit] = {}
+
+        self.scheduled = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.not_modified = 0
+        self.retry_after = 0
+        self.failed = 0
+
+    def schedule(self, bot: Bot, chat_id: int, message_id: int, markup: InlineKeyboardMarkup):
+        """Запоминает новую клавиатуру; отправится последняя из пришедших за окно"""
+        self.scheduled += 1
+        key = (chat_id, message_id)
+        entry = self._pending.get(key)
+        if entry is not None:
+            # Ещё не отправленная правка заменяется новой
+            if entry.dirty:
+                self.coalesced += 1
+            entry.markup = markup
+            entry.dirty = True
+            return
+
+        entry = self._pending[key] = _PendingEdit(markup)
+        entry.task = asyncio.create_task(self._run(bot, key, entry))
+
+    def discard(self, chat_id: int, message_id: int):
+        """Отменяет ожидающее редактирование (сообщение удаляется или больше не нужно)"""
+        entry = self._pending.pop((chat_id, message_id), None)
+        if entry is not None and entry.task is not None:
+            entry.task.cancel()
+
+    async def _run(self, bot: Bot, key: tuple[int, int], entry: _PendingEdit):
+        """Первая правка уходит сразу, следующие за окно - одной правкой в его конце"""
+        chat_id, message_id = key
+        try:
+            while entry.dirty:
+                entry.dirty = False
+                try:
+                    await bot.edit_message_reply_markup(
+                        chat_id=chat_id, message_id=message_id, reply_markup=entry.markup
+                    )
+                    self.sent += 1
+                except TelegramRetryAfter as e:
+                    # Ждём сколько просит Telegram и отправляем самое свежее состояние
+                    self.retry_after += 1
+                    entry.dirty = True
+                    await asyncio.sleep(e.retry_after)
+                except TelegramBadRequest as e:
+                    if "message is not modified" in str(e):
+                        self.not_modified += 1
+                    else:
+                        self.failed += 1
+                        logger.warning("Edit markup error (%s/%s): %s", chat_id, message_id, e)
+                        return
+                except Exception as e:
+                    self.failed += 1
+                    logger.warning("Edit markup error (%s/%s): %s", chat_id, message_id, e)
+                    return
+                await asyncio.sleep(self.delay)
+        finally:
+            if self._pending.get(key) is entry:
+                del self._pending[key]
+
+    def stats(self) -> dict:
+        """Сколько правок запрошено и сколько реально отправлено"""
+        return {
+            'pending': len(self._pending),
+            'scheduled': self.scheduled,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'not_modified': self.not_modified,
+            'retry_after': self.retry_after,
+            'failed': self.failed
+        }
+
+
+edit_coalescer = EditCoalescer()
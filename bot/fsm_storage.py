@@ -0,0 +1,166 @@
+"""
+Постоянное хранилище FSM по протоколу Redis
+
+Состояние и данные каждой сессии лежат в отдельных ключах Redis со сроком
+жизни: брошенные регистрации и консультации истекают сами. Данные
+кодируются компактным двоичным форматом (bot/state_codec.py), который
+сохраняет множества. Хранилище переживает перезапуски и позволяет
+запускать несколько реплик бота.
+
+Для локального запуска и проверок есть InMemoryRedis - тот же набор
+команд в памяти процесса.
+"""
+import fnmatch
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DEFAULT_DESTINY, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import FSM_STORAGE, REDIS_URL, FSM_STATE_TTL
+from .state_codec import encode, decode, StateCodecError
+
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryRedis:
+    """Минимальная замена Redis в памяти процесса (GET/MGET/SET EX NX/DELETE/SCAN)"""
+
+    def __init__(self):
+        # ключ -> (значение, момент истечения или None)
+        self._data: dict[str, tuple[bytes, Optional[float]]] = {}
+
+    def _alive(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._alive(key)
+
+    async def set(self, key: str, value: Any, ex: Optional[int] = None, nx: bool = False) -> Optional[bool]:
+        if nx and self._alive(key) is not None:
+            return None
+        if isinstance(value, (str, int)):
+            value = str(value).encode()
+        self._data[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    async def mget(self, keys: list[str]) -> list[Optional[bytes]]:
+        return [self._alive(key) for key in keys]
+
+    async def delete(self, *keys: str) -> int:
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    async def scan_iter(self, match: str = "*", count: Optional[int] = None) -> AsyncIterator[str]:
+        for key in list(self._data):
+            if fnmatch.fnmatchcase(key, match) and self._alive(key) is not None:
+                yield key
+
+    async def aclose(self):
+        self._data.clear()
+
+
+class RedisFSMStorage(BaseStorage):
+    """Хранилище FSM aiogram поверх клиента Redis (redis.asyncio или InMemoryRedis)"""
+
+    def __init__(self, redis, ttl: Optional[int] = FSM_STATE_TTL, prefix: str = "fsm"):
+        self.redis = redis
+        self.ttl = ttl or None
+        self.prefix = prefix
+
+    def build_key(self, key: StorageKey, part: str) -> str:
+        """fsm:<bot>:<chat>:<user>[:<thread>][:<business>][:<destiny>]:<state|data>"""
+        parts = [self.prefix, str(key.bot_id), str(key.chat_id), str(key.user_id)]
+        if key.thread_id:
+            parts.append(f"t{key.thread_id}")
+        if key.business_connection_id:
+            parts.append(f"b{key.business_connection_id}")
+        if key.destiny != DEFAULT_DESTINY:
+            parts.append(key.destiny)
+        parts.append(part)
+        return ":".join(parts)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        redis_key = self.build_key(key, "state")
+        if state is None:
+            await self.redis.delete(redis_key)
+            return
+        value = state.state if isinstance(state, State) else state
+        await self.redis.set(redis_key, value, ex=self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        value = await self.redis.get(self.build_key(key, "state"))
+        if isinstance(value, bytes):
+            return value.decode()
+        return value
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        redis_key = self.build_key(key, "data")
+        if not data:
+            await self.redis.delete(redis_key)
+            return
+        await self.redis.set(redis_key, encode(data), ex=self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self.redis.get(self.build_key(key, "data"))
+        if value is None:
+            return {}
+        try:
+            return decode(value)
+        except StateCodecError as e:
+            logger.error("FSM data decode error (%s): %s", key.chat_id, e)
+            return {}
+
+    async def usage(self, batch: int = 500) -> tuple[int, int]:
+        """
+        Сессии с состоянием и байты их ключей (состояние + данные).
+        Проходит все ключи хранилища (SCAN), поэтому вызывается редко - из SessionManager
+        """
+        sessions = data_bytes = 0
+        keys: list[str] = []
+
+        async def measure():
+            nonlocal sessions, data_bytes
+            values = await self.redis.mget(keys)
+            for key, value in zip(keys, values):
+                if value is None:
+                    continue
+                key = key.decode() if isinstance(key, bytes) else key
+                sessions += key.endswith(":state")
+                data_bytes += len(value)
+            keys.clear()
+
+        async for key in self.redis.scan_iter(match=f"{self.prefix}:*", count=batch):
+            keys.append(key)
+            if len(keys) >= batch:
+                await measure()
+        if keys:
+            await measure()
+        return sessions, data_bytes
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+def create_storage() -> BaseStorage:
+    """
+    Хранилище FSM по настройке FSM_STORAGE:
+    "memory" - MemoryStorage aiogram, "redis" - Redis по REDIS_URL,
+    "local" - RedisFSMStorage поверх InMemoryRedis (для проверок)
+    """
+    if FSM_STORAGE == "redis":
+        from redis.asyncio import Redis
+
+        return RedisFSMStorage(Redis.from_url(REDIS_URL))
+    if FSM_STORAGE == "local":
+        return RedisFSMStorage(InMemoryRedis())
+    return MemoryStorage()
@@ -5,7 +5,8 @@ from aiogram.fsm.context import FSMContext
 
 from bot.keyboards import get_main_menu, get_gender_keyboard
 from bot.states import Registration
-from database.connection import supabase_client
+from database.repository import profiles
+from services.speculation import speculative_tasks
 
 
 router = Router()
@@ -19,9 +20,9 @@ async def cmd_start(message: Message, state: FSMContext):
     
     # Проверяем, зарегистрирован ли пользователь
     try:
-        response = supabase_client.table('user_profiles').select('*').eq('user_id', user_id).execute()
+        profile = await profiles.get(user_id)
         
-        if response.data:
+        if profile:
             # Пользователь уже зарегистрирован
             await message.answer(
                 f"👋 С возвращением!\n\n"
@@ -94,6 +95,7 @@ async def cmd_cancel(message: Message, state: FSMContext):
         )
         return
     
+    speculative_tasks.cancel(state.key)
     await state.clear()
     await message.answer(
         "❌ Операция отменена\n\n"
@@ -1,3 +1,6 @@
+import logging
+import time
+from typing import Optional
 from datetime import datetime
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
@@ -14,12 +17,22 @@ from bot.keyboards import (
     get_manual_symptoms_keyboard,
     update_symptom_selection,
     get_final_confirmation,
+    get_red_flag_keyboard,
     get_result_keyboard
 )
+from config import SYMPTOMS_PIPELINE
 from services.ai_service import AIService
-from database.connection import supabase_client
+from services.speculation import speculative_tasks
+from services.red_flags import RedFlag, red_flag_detector, emergency_result
+from services.symptom_suggestions import symptom_suggester
+from services.metrics import metrics, timed
+from bot.edit_coalescer import edit_coalescer
+from bot.progress import ProgressReporter
+from bot.middlewares import send_priority, PRIORITY_EMERGENCY, PRIORITY_NORMAL
+from database.repository import profiles, consultations
 
 
+logger = logging.getLogger(__name__)
 router = Router()
 ai_service = AIService()
 
@@ -29,10 +42,8 @@ ai_service = AIService()
 async def get_user_profile(user_id: int) -> dict:
     """Получает профиль пользователя для AI"""
     try:
-        response = supabase_client.table('user_profiles').select('*').eq('user_id', user_id).execute()
-        if response.data:
-            profile = response.data[0]
-            
+        profile = await profiles.get(user_id)
+        if profile:
             if profile.get('birthdate'):
                 birthdate = datetime.fromisoformat(profile['birthdate'])
                 age = (datetime.now() - birthdate).days // 365
@@ -51,6 +62,59 @@ async def get_user_profile(user_id: int) -> dict:
     return {'gender': None, 'age': None, 'height': None, 'weight': None}
 
 
+def get_symptoms_pipeline(user_id: int) -> str:
+    """Способ проверки симптомов для пользователя (для A/B - по чётности user_id)"""
+    if SYMPTOMS_PIPELINE == "ab":
+        return "combined" if user_id % 2 == 0 else "split"
+    return SYMPTOMS_PIPELINE
+
+
+def prefetch_additional_symptoms(state: FSMContext, main_symptoms: str) -> Optional[list[str]]:
+    """
+    Заранее подбирает дополнительные симптомы, пока пользователь подтверждает
+    симптомы и выбирает давность. Давность ещё неизвестна, поэтому запрос
+    один и без неё: на список уточняющих симптомов она почти не влияет.
+    
+    Returns:
+        Симптомы по истории консультаций (сохраняются в данных FSM для
+        process_duration) или None - тогда запущен запрос к AI
+    """
+    # По истории консультаций симптомы подбираются мгновенно - AI не нужен
+    suggested = symptom_suggester.suggest(main_symptoms)
+    if suggested is not None:
+        return suggested
+    
+    speculative_tasks.start(
+        state.key,
+        "additional",
+        ai_service.generate_additional_symptoms(main_symptoms=main_symptoms),
+        fingerprint=main_symptoms
+    )
+    return None
+
+
+def recommendation_inputs(data: dict) -> tuple:
+    """Входные данные для рекомендации (они же - отпечаток для спекуляции)"""
+    return (
+        data.get('main_symptoms', ''),
+        data.get('duration', ''),
+        tuple(sorted(data.get('selected_additional', set())))
+    )
+
+
+async def get_recommendation(user_id: int, inputs: tuple) -> dict:
+    """Получает профиль и рекомендацию врача"""
+    main_symptoms, duration, additional_symptoms = inputs
+    user_profile = await get_user_profile(user_id)
+    
+    return await ai_service.recommend_doctor(
+        main_symptoms=main_symptoms,
+        duration=duration,
+        additional_symptoms=list(additional_symptoms),
+        user_profile=user_profile
+    )
+
+
 async def save_consultation(user_id: int, data: dict):
     """Сохраняет консультацию в БД"""
     try:
@@ -62,12 +126,106 @@ async def save_consultation(user_id: int, data: dict):
             'questions_answers': json.dumps(data.get('questions_answers', {}), ensure_ascii=False),
             'recommended_doctor': data.get('specialist'),
             'urgency_level': data.get('urgency'),
+            'symptoms_pipeline': data.get('symptoms_pipeline'),
+            'label_source': data.get('label_source'),
             'created_at': datetime.now().isoformat()
         }
         
-        supabase_client.table('consultations').insert(consultation_data).execute()
+        await consultations.create(consultation_data)
     except Exception as e:
         print(f"DB Error: {e}")
+        return
+    
+    symptoms = data.get('symptoms', {})
+    symptom_suggester.add(symptoms.get('main', ''), symptoms.get('additional', []))
+
+
+def format_recommendation(recommendation: dict) -> str:
+    """Текст рекомендации специалиста"""
+    urgency_emoji = {
+        'emergency': '🚨',
+        'high': '⚠️',
+        'medium': '📋',
+        'low': 'ℹ️'
+    }
+    
+    urgency_text = {
+        'emergency': 'СРОЧНО! Требуется скорая помощь',
+        'high': 'Высокая (обратиться в течение 24 часов)',
+        'medium': 'Средняя (обратиться в течение недели)',
+        'low': 'Низкая (плановый приём)'
+    }
+    
+    result_text = f"🩺 *Рекомендация специалиста*\n\n"
+    result_text += f"*Специалист:* {recommendation['specialist']}\n\n"
+    result_text += f"{urgency_emoji.get(recommendation['urgency'], '📋')} *Срочность:* "
+    result_text += f"{urgency_text.get(recommendation['urgency'], 'Средняя')}\n\n"
+    result_text += f"*Обоснование:*\n{recommendation['reasoning']}"
+    return result_text
+
+
+async def finish_consultation(message: Message, state: FSMContext, symptoms: dict, recommendation: dict,
+                              progress: Optional[ProgressReporter] = None, symptoms_pipeline: Optional[str] = None):
+    """Сохраняет консультацию, показывает рекомендацию (через progress, если он есть) и завершает сессию"""
+    await save_consultation(message.from_user.id, {
+        'symptoms': symptoms,
+        'questions_answers': {},
+        'specialist': recommendation['specialist'],
+        'urgency': recommendation['urgency'],
+        'label_source': recommendation.get('source'),
+        'symptoms_pipeline': symptoms_pipeline
+    })
+    
+    # Экстренная рекомендация обгоняет остальные исходящие сообщения
+    priority = PRIORITY_EMERGENCY if recommendation['urgency'] == 'emergency' else PRIORITY_NORMAL
+    with send_priority(priority):
+        if progress is not None:
+            await progress.finish(
+                format_recommendation(recommendation),
+                reply_markup=get_result_keyboard(),
+                parse_mode="Markdown"
+            )
+        else:
+            await message.answer(
+                format_recommendation(recommendation),
+                reply_markup=get_result_keyboard(),
+                parse_mode="Markdown"
+            )
+    
+    speculative_tasks.cancel(state.key)
+    await state.clear()
+
+
+async def check_red_flags(message: Message, state: FSMContext, text: str) -> Optional[RedFlag]:
+    """
+    Проверяет текст на признаки неотложного состояния (без AI).
+    При совпадении этап останавливается экстренным результатом, AI не вызывается.
+    Детектор может ошибиться, поэтому пользователь может продолжить консультацию
+    (см. continue_after_red_flag) - флаг сохраняется, и итог будет срочным.
+    
+    Returns:
+        Найденный красный флаг (этап остановлен) или None
+    """
+    data = await state.get_data()
+    # Пользователь уже решил продолжить - итог и так будет срочным
+    if data.get('red_flag'):
+        return None
+    
+    red_flag = red_flag_detector.detect(text)
+    if red_flag is None:
+        return None
+    
+    logger.info("Red flag detected: %s (%s)", red_flag.category, red_flag.phrase)
+    await state.update_data(
+        red_flag=(red_flag.category, red_flag.phrase, red_flag.specialist),
+        red_flag_text=text,
+        red_flag_step=await state.get_state()
+    )
+    await state.set_state(Consultation.red_flag_confirm)
+    # Экстренный результат обгоняет остальные исходящие сообщения
+    with send_priority(PRIORITY_EMERGENCY):
+        await message.answer(emergency_result(red_flag), reply_markup=get_red_flag_keyboard(), parse_mode="Markdown")
+    return red_flag
 
 
 # ============ НАЧАЛО КОНСУЛЬТАЦИИ ============
@@ -76,8 +234,7 @@ async def save_consultation(user_id: int, data: dict):
 async def start_consultation(message: Message, state: FSMContext):
     """Начало новой консультации"""
     try:
-        response = supabase_client.table('user_profiles').select('user_id').eq('user_id', message.from_user.id).execute()
-        if not response.data:
+        if not await profiles.exists(message.from_user.id):
             await message.answer(
                 "❌ Пожалуйста, сначала зарегистрируйтесь\n"
                 "Используйте /start"
@@ -86,6 +243,7 @@ async def start_consultation(message: Message, state: FSMContext):
     except Exception as e:
         print(f"DB Error: {e}")
     
+    speculative_tasks.cancel(state.key)
     await state.clear()
     
     await message.answer(
@@ -106,6 +264,7 @@ async def start_consultation(message: Message, state: FSMContext):
 @router.message(Consultation.waiting_for_symptoms, F.text == "❌ Отменить")
 async def cancel_from_symptoms(message: Message, state: FSMContext):
     """Отмена на первом этапе (описание симптомов)"""
+    speculative_tasks.cancel(state.key)
     await state.clear()
     await message.answer(
         "❌ Консультация отменена",
@@ -119,39 +278,59 @@ async def process_symptoms_text(message: Message, state: FSMContext):
     
     symptoms_text = message.text.strip()
     
-    # ВАЛИДАЦИЯ
-    await message.answer("⏳ Проверяю ваше сообщение...")
-    
-    validation = ai_service.validate_symptoms(symptoms_text)
+    # Неотложные состояния определяем локально, не дожидаясь AI
+    if await check_red_flags(message, state, symptoms_text):
+        return
     
-    if not validation['is_valid']:
-        await message.answer(
-            f"❌ *Ошибка валидации*\n\n"
-            f"{validation['reason']}\n\n"
-            f"Пожалуйста, опишите именно медицинские симптомы:\n"
-            f"• Боли и их локализация\n"
-            f"• Температура\n"
-            f"• Тошнота, слабость\n"
-            f"• Другие физические ощущения\n\n"
-            f"Попробуйте ещё раз:",
+    await analyze_symptoms_text(message, state, symptoms_text)
+
+
+async def analyze_symptoms_text(message: Message, state: FSMContext, symptoms_text: str):
+    """Проверка и улучшение описания симптомов AI, переход к подтверждению"""
+    # ВАЛИДАЦИЯ И ОКУЛЬТУРИВАНИЕ СИМПТОМОВ
+    async with ProgressReporter(message) as progress:
+        pipeline = get_symptoms_pipeline(message.from_user.id)
+        started = time.perf_counter()
+        analysis = await ai_service.analyze_symptoms(symptoms_text, pipeline=pipeline)
+        elapsed = time.perf_counter() - started
+        # Группа A/B вместе с фактическим способом (combined_fallback не смешивается со split)
+        metrics.record_pipeline(analysis['pipeline'], elapsed, analysis['is_valid'])
+        logger.debug(
+            "Symptoms pipeline=%s valid=%s took %.2fs", analysis['pipeline'], analysis['is_valid'], elapsed
+        )
+        
+        if not analysis['is_valid']:
+            await progress.finish(
+                f"❌ *Ошибка валидации*\n\n"
+                f"{analysis['reason']}\n\n"
+                f"Пожалуйста, опишите именно медицинские симптомы:\n"
+                f"• Боли и их локализация\n"
+                f"• Температура\n"
+                f"• Тошнота, слабость\n"
+                f"• Другие физические ощущения\n\n"
+                f"Попробуйте ещё раз:",
+                parse_mode="Markdown"
+            )
+            return
+        
+        improved_symptoms = analysis['improved']
+        
+        # Пока пользователь думает - готовим следующий шаг
+        suggested = prefetch_additional_symptoms(state, improved_symptoms)
+        
+        await state.update_data(
+            main_symptoms=improved_symptoms,
+            symptoms_pipeline=analysis['pipeline'],
+            suggested_additional=suggested
+        )
+        
+        await progress.finish(
+            f"📝 *Ваши симптомы:*\n\n"
+            f"{improved_symptoms}\n\n"
+            f"Подтвердите или добавьте детали:",
+            reply_markup=get_symptoms_confirmation(),
             parse_mode="Markdown"
         )
-        return
-    
-    # ОКУЛЬТУРИВАНИЕ СИМПТОМОВ
-    await message.answer("✏️ Улучшаю формулировку...")
-    
-    improved_symptoms = ai_service.improve_symptoms_text(symptoms_text)
-    
-    await state.update_data(main_symptoms=improved_symptoms)
-    
-    await message.answer(
-        f"📝 *Ваши симптомы:*\n\n"
-        f"{improved_symptoms}\n\n"
-        f"Подтвердите или добавьте детали:",
-        reply_markup=get_symptoms_confirmation(),
-        parse_mode="Markdown"
-    )
     
     await state.set_state(Consultation.confirming_symptoms)
 
@@ -186,6 +365,7 @@ async def confirm_symptoms(message: Message, state: FSMContext):
 @router.message(Consultation.confirming_symptoms, F.text == "🔄 Начать заново")
 async def restart_symptoms(message: Message, state: FSMContext):
     """Начать описание заново"""
+    speculative_tasks.cancel(state.key)
     await message.answer(
         "🔄 Начинаем заново\n\n"
         "Опишите ваши симптомы:",
@@ -222,49 +402,58 @@ async def process_duration(message: Message, state: FSMContext):
     
     await state.update_data(duration=duration_text)
     
-    await message.answer(f"📅 Давность: {duration_text}")
-    
-    # Генерируем дополнительные симптомы через AI
-    await message.answer("⏳ Анализирую симптомы...")
-    
-    data = await state.get_data()
-    main_symptoms = data.get('main_symptoms', '')
-    
-    additional_symptoms = ai_service.generate_additional_symptoms(
-        main_symptoms=main_symptoms,
-        duration=duration_text
-    )
-    
-    # ЛОГИРОВАНИЕ для отладки
-    print(f"DEBUG: Generated {len(additional_symptoms)} symptoms: {additional_symptoms}")
-    
-    # Если AI не сгенерировал симптомы - предлагаем написать вручную
-    if not additional_symptoms:
-        print("DEBUG: No symptoms generated by AI, asking user to write manually")
-        await message.answer(
-            "⚠️ Не удалось подобрать дополнительные симптомы автоматически.\n\n"
-            "📝 Опишите дополнительные симптомы вручную или нажмите 'Готово' для продолжения:",
-            reply_markup=get_manual_symptoms_keyboard()
-        )
+    # Подтверждение давности войдёт в сообщение следующего этапа
+    async with ProgressReporter(message) as progress:
+        data = await state.get_data()
+        main_symptoms = data.get('main_symptoms', '')
+        
+        # Подобранные по истории консультаций или результат AI, который
+        # мог быть посчитан заранее (см. prefetch_additional_symptoms)
+        additional_symptoms = data.get('suggested_additional')
+        if not additional_symptoms:
+            # Ожидание заранее запущенного запроса - тоже ожидание LLM
+            with timed("llm"):
+                additional_symptoms = await speculative_tasks.take(
+                    state.key, "additional", fingerprint=main_symptoms
+                )
+        if not additional_symptoms:
+            additional_symptoms = await ai_service.generate_additional_symptoms(
+                main_symptoms=main_symptoms,
+                duration=duration_text
+            )
+        
+        # ЛОГИРОВАНИЕ для отладки
+        print(f"DEBUG: Generated {len(additional_symptoms)} symptoms: {additional_symptoms}")
+        
+        # Если AI не сгенерировал симптомы - предлагаем написать вручную
+        if not additional_symptoms:
+            print("DEBUG: No symptoms generated by AI, asking user to write manually")
+            await progress.finish(
+                f"📅 Давность: {duration_text}\n\n"
+                "⚠️ Не удалось подобрать дополнительные симптомы автоматически.\n\n"
+                "📝 Опишите дополнительные симптомы вручную или нажмите 'Готово' для продолжения:",
+                reply_markup=get_manual_symptoms_keyboard()
+            )
+            await state.update_data(
+                additional_symptoms_options=[],
+                selected_additional=set()
+            )
+            await state.set_state(Consultation.waiting_for_other_symptoms)
+            return
+        
         await state.update_data(
-            additional_symptoms_options=[],
+            additional_symptoms_options=additional_symptoms,
             selected_additional=set()
         )
-        await state.set_state(Consultation.waiting_for_other_symptoms)
-        return
-    
-    await state.update_data(
-        additional_symptoms_options=additional_symptoms,
-        selected_additional=set()
-    )
-    
-    await message.answer(
-        "📋 *Этап 3 из 4*\n\n"
-        "Отметьте, что ещё вас беспокоит:\n"
-        "(выберите все подходящие варианты)",
-        reply_markup=get_additional_cancel_keyboard(),
-        parse_mode="Markdown"
-    )
+        
+        await progress.finish(
+            f"📅 Давность: {duration_text}\n\n"
+            "📋 *Этап 3 из 4*\n\n"
+            "Отметьте, что ещё вас беспокоит:\n"
+            "(выберите все подходящие варианты)",
+            reply_markup=get_additional_cancel_keyboard(),
+            parse_mode="Markdown"
+        )
     
     # Формируем клавиатуру
     keyboard = get_additional_symptoms_keyboard(additional_symptoms)
@@ -299,6 +488,7 @@ async def toggle_symptom(callback: CallbackQuery, state: FSMContext):
     """Переключение выбора симптома"""
     print(f"DEBUG: Callback received: {callback.data}")
     
+    answered = False
     try:
         # Извлекаем индекс из callback_data
         idx = int(callback.data.split("_")[1])
@@ -316,6 +506,10 @@ async def toggle_symptom(callback: CallbackQuery, state: FSMContext):
             await callback.answer("❌ Ошибка выбора", show_alert=True)
             return
         
+        # Убираем часики сразу, не дожидаясь обновления клавиатуры
+        await callback.answer()
+        answered = True
+        
         symptom = options[idx]
         print(f"DEBUG: Toggling symptom: {symptom}")
         
@@ -329,23 +523,22 @@ async def toggle_symptom(callback: CallbackQuery, state: FSMContext):
         
         await state.update_data(selected_additional=selected)
         
-        # Обновляем клавиатуру
+        # Обновляем клавиатуру: серия быстрых нажатий даст одно редактирование
         updated_keyboard = update_symptom_selection(
             callback.message.reply_markup,
             selected,
             options  # Передаём полный список
         )
-        
-        print(f"DEBUG: Updating keyboard with {len(updated_keyboard.inline_keyboard)} rows")
-        
-        await callback.message.edit_reply_markup(reply_markup=updated_keyboard)
-        await callback.answer()  # Убираем часики
+        edit_coalescer.schedule(
+            callback.bot, callback.message.chat.id, callback.message.message_id, updated_keyboard
+        )
         
     except Exception as e:
         print(f"DEBUG ERROR: Exception in toggle_symptom: {e}")
         import traceback
         traceback.print_exc()
-        await callback.answer("❌ Ошибка", show_alert=True)
+        if not answered:
+            await callback.answer("❌ Ошибка", show_alert=True)
 
 
 @router.callback_query(Consultation.selecting_additional_symptoms, F.data == "no_additional")
@@ -353,6 +546,7 @@ async def no_additional_symptoms(callback: CallbackQuery, state: FSMContext):
     """Нет дополнительных симптомов"""
     await state.update_data(selected_additional=set())
     
+    edit_coalescer.discard(callback.message.chat.id, callback.message.message_id)
     await callback.message.delete()
     await callback.message.answer("✅ Дополнительных симптомов нет")
     
@@ -363,6 +557,7 @@ async def no_additional_symptoms(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(Consultation.selecting_additional_symptoms, F.data == "other_symptom")
 async def other_symptom(callback: CallbackQuery, state: FSMContext):
     """Описать другой симптом"""
+    edit_coalescer.discard(callback.message.chat.id, callback.message.message_id)
     await callback.message.delete()
     await callback.message.answer(
         "✏️ Опишите дополнительный симптом:",
@@ -420,8 +615,17 @@ async def process_other_symptom(message: Message, state: FSMContext):
     """Обработка другого симптома"""
     other_symptom = message.text.strip()
     
+    if await check_red_flags(message, state, other_symptom):
+        return
+    
+    await add_other_symptom(message, state, other_symptom)
+
+
+async def add_other_symptom(message: Message, state: FSMContext, other_symptom: str):
+    """Проверка симптома, введённого вручную, и добавление к выбранным"""
+    data = await state.get_data()
     # Валидация
-    validation = ai_service.validate_symptoms(other_symptom)
+    validation = await ai_service.validate_symptoms(other_symptom)
     
     if not validation['is_valid']:
         await message.answer(
@@ -430,7 +634,6 @@ async def process_other_symptom(message: Message, state: FSMContext):
         )
         return
     
-    data = await state.get_data()
     selected = data.get('selected_additional', set())
     selected.add(validation['symptoms'] if validation['symptoms'] else other_symptom)
     
@@ -461,6 +664,7 @@ async def done_additional_symptoms(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     selected = data.get('selected_additional', set())
     
+    edit_coalescer.discard(callback.message.chat.id, callback.message.message_id)
     await callback.message.delete()
     
     if selected:
@@ -506,68 +710,45 @@ async def show_final_confirmation(message: Message, state: FSMContext):
     )
     
     await state.set_state(Consultation.final_confirmation)
+    
+    # Пока пользователь читает анамнез - заранее подбираем специалиста.
+    # message здесь может быть сообщением бота, поэтому user_id берём из ключа FSM
+    inputs = recommendation_inputs(data)
+    speculative_tasks.start(
+        state.key,
+        "recommendation",
+        get_recommendation(state.key.user_id, inputs),
+        fingerprint=inputs
+    )
 
 
 @router.message(Consultation.final_confirmation, F.text == "✅ Подтвердить")
 async def final_confirm(message: Message, state: FSMContext):
     """Финальное подтверждение и получение рекомендации"""
-    await message.answer("✅ Данные подтверждены")
-    
-    await message.answer("⏳ Анализирую симптомы и подбираю специалиста...")
-    
-    data = await state.get_data()
-    user_profile = await get_user_profile(message.from_user.id)
-    
-    recommendation = ai_service.recommend_doctor(
-        main_symptoms=data.get('main_symptoms', ''),
-        duration=data.get('duration', ''),
-        additional_symptoms=list(data.get('selected_additional', set())),
-        user_profile=user_profile
-    )
-    
-    await save_consultation(message.from_user.id, {
-        'symptoms': {
+    async with ProgressReporter(message) as progress:
+        data = await state.get_data()
+        inputs = recommendation_inputs(data)
+        
+        # Рекомендация обычно уже посчитана в show_final_confirmation
+        with timed("llm"):
+            recommendation = await speculative_tasks.take(state.key, "recommendation", fingerprint=inputs)
+        if recommendation is None:
+            recommendation = await get_recommendation(message.from_user.id, inputs)
+        # Пользователь продолжил после красного флага - срочность не ниже экстренной
+        if data.get('red_flag'):
+            recommendation = {**recommendation, 'urgency': 'emergency'}
+        
+        await finish_consultation(message, state, {
             'main': data.get('main_symptoms'),
             'duration': data.get('duration'),
             'additional': list(data.get('selected_additional', set()))
-        },
-        'questions_answers': {},
-        'specialist': recommendation['specialist'],
-        'urgency': recommendation['urgency']
-    })
-    
-    urgency_emoji = {
-        'emergency': '🚨',
-        'high': '⚠️',
-        'medium': '📋',
-        'low': 'ℹ️'
-    }
-    
-    urgency_text = {
-        'emergency': 'СРОЧНО! Требуется скорая помощь',
-        'high': 'Высокая (обратиться в течение 24 часов)',
-        'medium': 'Средняя (обратиться в течение недели)',
-        'low': 'Низкая (плановый приём)'
-    }
-    
-    result_text = f"🩺 *Рекомендация специалиста*\n\n"
-    result_text += f"*Специалист:* {recommendation['specialist']}\n\n"
-    result_text += f"{urgency_emoji.get(recommendation['urgency'], '📋')} *Срочность:* "
-    result_text += f"{urgency_text.get(recommendation['urgency'], 'Средняя')}\n\n"
-    result_text += f"*Обоснование:*\n{recommendation['reasoning']}"
-    
-    await message.answer(
-        result_text,
-        reply_markup=get_result_keyboard(),
-        parse_mode="Markdown"
-    )
-    
-    await state.clear()
+        }, recommendation, progress, symptoms_pipeline=data.get('symptoms_pipeline'))
 
 
 @router.message(Consultation.final_confirmation, F.text == "➕ Добавить симптомы")
 async def add_more_from_final(message: Message, state: FSMContext):
     """Добавить симптомы с финального этапа"""
+    speculative_tasks.cancel(state.key, "recommendation")
     await message.answer(
         "✏️ Опишите дополнительные симптомы:",
         reply_markup=get_additional_cancel_keyboard()
@@ -579,6 +760,7 @@ async def add_more_from_final(message: Message, state: FSMContext):
 @router.message(Consultation.final_confirmation, F.text == "🔄 Начать заново")
 async def restart_consultation(message: Message, state: FSMContext):
     """Начать консультацию заново"""
+    speculative_tasks.cancel(state.key)
     await state.clear()
     await start_consultation(message, state)
 
@@ -588,6 +770,7 @@ async def restart_consultation(message: Message, state: FSMContext):
 @router.message(F.text == "🏠 В главное меню")
 async def back_to_main_menu(message: Message, state: FSMContext):
     """Возврат в главное меню"""
+    speculative_tasks.cancel(state.key)
     await state.clear()
     await message.answer(
         "Главное меню",
@@ -609,6 +792,7 @@ async def book_appointment(message: Message):
 @router.message(F.text == "❌ Отменить")
 async def cancel_consultation_button(message: Message, state: FSMContext):
     """Отмена консультации через кнопку"""
+    speculative_tasks.cancel(state.key)
     await state.clear()
     await message.answer(
         "❌ Консультация отменена",
@@ -619,8 +803,38 @@ async def cancel_consultation_button(message: Message, state: FSMContext):
 @router.message(F.text == "/cancel")
 async def cancel_consultation_command(message: Message, state: FSMContext):
     """Отмена через команду"""
+    speculative_tasks.cancel(state.key)
     await state.clear()
     await message.answer(
         "❌ Консультация отменена",
         reply_markup=get_main_menu()
     )
+
+
+# ============ КРАСНЫЕ ФЛАГИ ============
+# После отмены: «❌ Отменить» в этом состоянии обрабатывает cancel_consultation_button
+
+@router.message(Consultation.red_flag_confirm, F.text == "▶️ Продолжить консультацию")
+async def continue_after_red_flag(message: Message, state: FSMContext):
+    """Продолжение консультации после экстренного результата: текст этапа уходит в AI"""
+    data = await state.get_data()
+    text = data.pop('red_flag_text', '')
+    step = data.pop('red_flag_step', None)
+    await state.set_data(data)
+    
+    if step == Consultation.waiting_for_other_symptoms.state:
+        await state.set_state(Consultation.waiting_for_other_symptoms)
+        await add_other_symptom(message, state, text)
+    else:
+        await state.set_state(Consultation.waiting_for_symptoms)
+        await analyze_symptoms_text(message, state, text)
+
+
+@router.message(Consultation.red_flag_confirm)
+async def red_flag_choice_required(message: Message):
+    """Любое другое сообщение после экстренного результата"""
+    await message.answer(
+        "🚨 При признаках неотложного состояния вызовите скорую помощь (103 или 112).\n\n"
+        "Чтобы продолжить консультацию, нажмите «▶️ Продолжить консультацию».",
+        reply_markup=get_red_flag_keyboard()
+    )
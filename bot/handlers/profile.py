@@ -12,8 +12,9 @@ from bot.keyboards import (
     get_profile_menu,
     get_edit_profile_menu
 )
-from database.connection import supabase_client
+from database.repository import profiles
 from services.phone_formatter import format_phone_number, get_phone_info
+from services.speculation import speculative_tasks
 
 
 router = Router()
@@ -46,9 +47,9 @@ def parse_date(date_string: str) -> datetime:
 async def show_profile(message: Message):
     """Показать профиль пользователя"""
     try:
-        response = supabase_client.table('user_profiles').select('*').eq('user_id', message.from_user.id).execute()
+        profile = await profiles.get(message.from_user.id)
         
-        if not response.data:
+        if not profile:
             await message.answer(
                 "❌ Профиль не найден\n\n"
                 "Пожалуйста, пройдите регистрацию:\n"
@@ -56,8 +57,6 @@ async def show_profile(message: Message):
             )
             return
         
-        profile = response.data[0]
-        
         # Форматируем дату рождения
         birthdate = profile.get('birthdate')
         age = None
@@ -385,7 +384,7 @@ async def process_weight(message: Message, state: FSMContext):
                 'updated_at': datetime.now().isoformat()
             }
             
-            supabase_client.table('user_profiles').insert(profile_data).execute()
+            await profiles.create(profile_data)
             
             await message.answer(
                 "🎉 *Регистрация завершена!*\n\n"
@@ -510,10 +509,10 @@ async def edit_full_name(message: Message, state: FSMContext):
         return
     
     try:
-        supabase_client.table('user_profiles').update({
+        await profiles.update(message.from_user.id, {
             'full_name': full_name,
             'updated_at': datetime.now().isoformat()
-        }).eq('user_id', message.from_user.id).execute()
+        })
         
         await message.answer(f"✅ ФИО обновлено: {full_name}")
         await message.answer("Что ещё хотите изменить?", reply_markup=get_edit_profile_menu())
@@ -544,10 +543,10 @@ async def edit_phone(message: Message, state: FSMContext):
         phone_info = get_phone_info(phone_input)
         
         # Сохраняем в БД
-        supabase_client.table('user_profiles').update({
+        await profiles.update(message.from_user.id, {
             'phone': formatted_phone,
             'updated_at': datetime.now().isoformat()
-        }).eq('user_id', message.from_user.id).execute()
+        })
         
         # Показываем что сохранили
         info_text = f"✅ *Телефон обновлён:*\n\n"
@@ -583,10 +582,10 @@ async def edit_birthdate(message: Message, state: FSMContext):
             await message.answer("❌ Укажите корректную дату")
             return
         
-        supabase_client.table('user_profiles').update({
+        await profiles.update(message.from_user.id, {
             'birthdate': birthdate.date().isoformat(),
             'updated_at': datetime.now().isoformat()
-        }).eq('user_id', message.from_user.id).execute()
+        })
         
         await message.answer(f"✅ Дата рождения обновлена: {birthdate.strftime('%d.%m.%Y')} ({age} лет)")
         await message.answer("Что ещё хотите изменить?", reply_markup=get_edit_profile_menu())
@@ -605,10 +604,10 @@ async def edit_gender(message: Message, state: FSMContext):
     gender = "male" if message.text == "👨 Мужской" else "female"
     
     try:
-        supabase_client.table('user_profiles').update({
+        await profiles.update(message.from_user.id, {
             'gender': gender,
             'updated_at': datetime.now().isoformat()
-        }).eq('user_id', message.from_user.id).execute()
+        })
         
         await message.answer(f"✅ Пол обновлён: {message.text}", reply_markup=ReplyKeyboardRemove())
         await message.answer("Что ещё хотите изменить?", reply_markup=get_edit_profile_menu())
@@ -629,10 +628,10 @@ async def edit_height(message: Message, state: FSMContext):
             await message.answer("❌ Укажите корректный рост (50-250 см)")
             return
         
-        supabase_client.table('user_profiles').update({
+        await profiles.update(message.from_user.id, {
             'height': height,
             'updated_at': datetime.now().isoformat()
-        }).eq('user_id', message.from_user.id).execute()
+        })
         
         await message.answer(f"✅ Рост обновлён: {height} см")
         await message.answer("Что ещё хотите изменить?", reply_markup=get_edit_profile_menu())
@@ -655,10 +654,10 @@ async def edit_weight(message: Message, state: FSMContext):
             await message.answer("❌ Укажите корректный вес (20-300 кг)")
             return
         
-        supabase_client.table('user_profiles').update({
+        await profiles.update(message.from_user.id, {
             'weight': weight,
             'updated_at': datetime.now().isoformat()
-        }).eq('user_id', message.from_user.id).execute()
+        })
         
         await message.answer(f"✅ Вес обновлён: {weight} кг")
         await message.answer("Что ещё хотите изменить?", reply_markup=get_edit_profile_menu())
@@ -694,6 +693,7 @@ async def cancel_profile_action(message: Message, state: FSMContext):
         )
         await state.set_state(EditProfile.choosing_field)
     else:
+        speculative_tasks.cancel(state.key)
         await state.clear()
         await message.answer(
             "Главное меню",
@@ -187,6 +187,15 @@ def get_final_confirmation() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
 
 
+def get_red_flag_keyboard() -> ReplyKeyboardMarkup:
+    """Клавиатура после экстренного результата (красный флаг)"""
+    keyboard = [
+        [KeyboardButton(text="▶️ Продолжить консультацию")],
+        [KeyboardButton(text="❌ Отменить")]
+    ]
+    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+
+
 def get_result_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура после получения рекомендации (ОБЫЧНЫЕ КНОПКИ)"""
     keyboard = [
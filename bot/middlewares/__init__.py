@@ -0,0 +1,17 @@
+"""
+Middlewares диспетчера
+"""
+from .dedup import UpdateDeduplicationMiddleware
+from .ordering import ChatOrderingMiddleware
+from .metrics import UpdateMetricsMiddleware, HandlerMetricsMiddleware, BotApiTimingMiddleware
+from .outbound import (
+    OutboundLimiter, OutboundRateLimitMiddleware, send_priority,
+    PRIORITY_EMERGENCY, PRIORITY_NORMAL, PRIORITY_LOW
+)
+
+__all__ = [
+    'UpdateDeduplicationMiddleware', 'ChatOrderingMiddleware',
+    'UpdateMetricsMiddleware', 'HandlerMetricsMiddleware', 'BotApiTimingMiddleware',
+    'OutboundLimiter', 'OutboundRateLimitMiddleware', 'send_priority',
+    'PRIORITY_EMERGENCY', 'PRIORITY_NORMAL', 'PRIORITY_LOW'
+]
@@ -0,0 +1,97 @@
+"""
+Идемпотентная обработка обновлений: отбрасывание повторов по update_id
+
+Telegram повторяет доставку вебхука, если не получил ответ, а при
+нескольких репликах одно обновление может прийти дважды - консультация
+сохранилась бы два раза, а запросы к AI оплачены дважды.
+
+Локально недавние update_id хранятся в кольцевом буфере + множестве
+(ограничены и размером, и окном времени). Если передан клиент Redis,
+проверка общая для всех реплик: SET NX EX на ключ обновления.
+"""
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import DEDUP_WINDOW, DEDUP_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+
+class RecentUpdates:
+    """Недавние update_id: кольцевой буфер (порядок) + множество (поиск)"""
+
+    def __init__(self, maxsize: int = DEDUP_SIZE, window: float = DEDUP_WINDOW):
+        self.window = window
+        self._order: deque[tuple[int, float]] = deque(maxlen=maxsize)
+        self._ids: set[int] = set()
+
+    def seen(self, update_id: int) -> bool:
+        """Запоминает update_id; True, если он уже был в окне"""
+        now = time.monotonic()
+        deadline = now - self.window
+        while self._order and self._order[0][1] <= deadline:
+            self._ids.discard(self._order.popleft()[0])
+
+        if update_id in self._ids:
+            return True
+
+        if len(self._order) == self._order.maxlen:
+            self._ids.discard(self._order[0][0])
+        self._order.append((update_id, now))
+        self._ids.add(update_id)
+        return False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class UpdateDeduplicationMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: повторное обновление не обрабатывается"""
+
+    def __init__(self, redis=None, window: float = DEDUP_WINDOW, maxsize: int = DEDUP_SIZE):
+        self.redis = redis
+        self.window = window
+        self.recent = RecentUpdates(maxsize, window)
+        self.dropped = 0
+
+    async def _is_duplicate(self, bot_id: int, update_id: int) -> bool:
+        # Локальная проверка дешевле и отсекает повторы в пределах процесса
+        if self.recent.seen(update_id):
+            return True
+        if self.redis is None:
+            return False
+        try:
+            created = await self.redis.set(f"dedup:{bot_id}:{update_id}", 1, nx=True, ex=int(self.window))
+            return not created
+        except Exception as e:
+            # Общее хранилище недоступно - лучше обработать, чем потерять обновление
+            logger.warning("Dedup store error: %s", e)
+            return False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Update):
+            bot = data.get("bot")
+            if await self._is_duplicate(bot.id if bot else 0, event.update_id):
+                self.dropped += 1
+                logger.debug("Duplicate update %s dropped (total %s)", event.update_id, self.dropped)
+                return None
+        return await handler(event, data)
+
+    def stats(self) -> dict:
+        """Сколько повторов отброшено"""
+        return {
+            'dropped': self.dropped,
+            'tracked': len(self.recent),
+            'shared': self.redis is not None
+        }
@@ -0,0 +1,85 @@
+"""
+Инструментирование горячего пути: время обновлений и обработчиков
+
+UpdateMetricsMiddleware (внешний, dp.update) открывает учёт ожиданий LLM,
+БД и Bot API для обновления и записывает его полное время.
+HandlerMetricsMiddleware (внутренний, dp.message/dp.callback_query - действует
+на все вложенные роутеры) записывает время обработчика по имени и состоянию
+FSM, ожидания зависимостей и ошибки. BotApiTimingMiddleware (сессия бота)
+засчитывает запросы к Bot API как ожидание "bot".
+"""
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject
+
+from services.metrics import MetricsRegistry, metrics, begin_update, end_update, current_timings, timed
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: полное время обработки обновления"""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        timings, token = begin_update()
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception:
+            self.registry.record_update(time.perf_counter() - started, handled=True, error=True)
+            raise
+        finally:
+            end_update(timings, token)
+        self.registry.record_update(time.perf_counter() - started, handled=result is not UNHANDLED)
+        return result
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время обработчика, ожидания зависимостей и ошибки"""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        state = data.get("raw_state")
+        started = time.perf_counter()
+        error = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.registry.record_handler(name, state, time.perf_counter() - started, current_timings(), error)
+
+
+class BotApiTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время запросов к Bot API (вместе с ожиданием лимитов)"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        with timed("bot"):
+            return await make_request(bot, method)
@@ -0,0 +1,96 @@
+"""
+Порядок обработки: последовательно внутри чата, параллельно между чатами
+
+aiogram обрабатывает обновления конкурентно: двойное нажатие кнопки или
+быстрое переключение симптомов запускает обработчики, которые одновременно
+читают и пишут одни и те же данные FSM (get_data -> изменить -> update_data).
+
+Middleware ставит обновления каждого чата в очередь (FIFO-блокировка на
+чат с ограниченной глубиной), а общее число одновременно обрабатываемых
+обновлений ограничивает семафором. Разные чаты не ждут друг друга.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import CHAT_QUEUE_DEPTH, UPDATE_MAX_CONCURRENCY
+
+
+logger = logging.getLogger(__name__)
+
+
+class _ChatQueue:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        # asyncio.Lock будит ожидающих в порядке очереди
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class ChatOrderingMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: по одному обновлению на чат за раз"""
+
+    def __init__(self, max_depth: int = CHAT_QUEUE_DEPTH, max_concurrency: int = UPDATE_MAX_CONCURRENCY):
+        self.max_depth = max_depth
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queues: dict[Hashable, _ChatQueue] = {}
+        self.dropped = 0
+        self.max_seen_depth = 0
+
+    @staticmethod
+    def _key(data: Dict[str, Any]) -> Hashable:
+        chat = data.get("event_chat")
+        if chat is not None:
+            return chat.id
+        user = data.get("event_from_user")
+        return ("user", user.id) if user is not None else None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        key = self._key(data)
+        if key is None:
+            async with self._semaphore:
+                return await handler(event, data)
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _ChatQueue()
+
+        if queue.depth >= self.max_depth:
+            # Пользователь жмёт быстрее, чем мы успеваем отвечать - лишнее отбрасываем
+            self.dropped += 1
+            logger.debug("Chat %s queue is full (%s), update dropped", key, queue.depth)
+            if isinstance(event, Update) and event.callback_query is not None:
+                try:
+                    await event.callback_query.answer()
+                except Exception:
+                    pass
+            return None
+
+        queue.depth += 1
+        self.max_seen_depth = max(self.max_seen_depth, queue.depth)
+        try:
+            async with queue.lock:
+                async with self._semaphore:
+                    return await handler(event, data)
+        finally:
+            queue.depth -= 1
+            if queue.depth == 0:
+                del self._queues[key]
+
+    def stats(self) -> dict:
+        """Очереди чатов и отброшенные обновления"""
+        return {
+            'chats': len(self._queues),
+            'queued': sum(queue.depth for queue in self._queues.values()),
+            'max_depth': self.max_seen_depth,
+            'dropped': self.dropped
+        }
@@ -0,0 +1,234 @@
+"""
+Исходящие запросы к Telegram: ограничение скорости с учётом flood control
+
+Telegram ограничивает отправку примерно одним сообщением в секунду на чат
+и ~30 в секунду на бота; при превышении отвечает 429 с retry_after.
+Middleware сессии бота пропускает каждый запрос, адресованный чату,
+через токен-бакеты (на чат и общий). Очередь ожидающих разделена на полосы
+приоритета: экстренные рекомендации уходят раньше служебных сообщений.
+Ответ 429 блокирует чат на retry_after, и запрос повторяется автоматически.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Hashable, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, DeleteMessage, SendChatAction, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from config import OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST
+
+
+logger = logging.getLogger(__name__)
+
+
+# Полосы приоритета (меньше - раньше)
+PRIORITY_EMERGENCY = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITIES = (PRIORITY_EMERGENCY, PRIORITY_NORMAL, PRIORITY_LOW)
+
+# Приоритет запросов текущей задачи (см. send_priority)
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_NORMAL)
+
+# Не расходуют лимит отправки сообщений
+UNLIMITED_METHODS = (AnswerCallbackQuery, DeleteMessage, SendChatAction)
+
+# Сколько раз повторять запрос после 429
+MAX_RETRIES = 3
+
+# Сколько последних задержек хранить для перцентилей
+LATENCY_WINDOW = 1000
+
+# Бакеты чатов чистятся, когда их становится больше
+MAX_CHAT_BUCKETS = 10000
+
+
+@contextmanager
+def send_priority(priority: int):
+    """Приоритет исходящих запросов внутри блока with"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 - уже доступен)"""
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Блокирует бакет (ответ 429 с retry_after)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def idle(self, now: float) -> bool:
+        return self.wait_time(now) == 0 and self.tokens >= self.capacity
+
+
+class OutboundLimiter:
+    """Очередь исходящих запросов с полосами приоритета и токен-бакетами"""
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE, chat_rate: float = OUTBOUND_CHAT_RATE,
+                 chat_burst: float = OUTBOUND_CHAT_BURST):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, max(global_rate, 1))
+        self._chat_buckets: dict[Hashable, TokenBucket] = {}
+        # Полоса -> очередь (чат, future)
+        self._lanes: dict[int, deque] = {priority: deque() for priority in PRIORITIES}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                for key in [k for k, b in self._chat_buckets.items() if b.idle(now)]:
+                    del self._chat_buckets[key]
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def acquire(self, chat_id: Hashable, priority: int = PRIORITY_NORMAL):
+        """Ждёт разрешения на запрос в чат"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append((chat_id, future))
+        self._wakeup.set()
+        await future
+
+    def block(self, chat_id: Optional[Hashable], seconds: float):
+        """Блокирует чат (или всю отправку, если чат неизвестен) на seconds"""
+        bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+        bucket.block(seconds)
+
+    def _grant(self) -> float:
+        """Выдаёт разрешения, которые можно выдать сейчас; возвращает время до следующей попытки"""
+        now = time.monotonic()
+        next_attempt = float("inf")
+        for priority in PRIORITIES:
+            lane = self._lanes[priority]
+            for item in list(lane):
+                chat_id, future = item
+                if future.done():
+                    lane.remove(item)
+                    continue
+                # Общий лимит исчерпан - младшие полосы не обгоняют старшие
+                global_wait = self.global_bucket.wait_time(now)
+                if global_wait > 0:
+                    return min(next_attempt, global_wait)
+                chat_wait = self._chat_bucket(chat_id).wait_time(now)
+                if chat_wait > 0:
+                    next_attempt = min(next_attempt, chat_wait)
+                    continue
+                self.global_bucket.take()
+                self._chat_bucket(chat_id).take()
+                lane.remove(item)
+                future.set_result(None)
+        return next_attempt
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            next_attempt = self._grant()
+            if next_attempt == float("inf"):
+                await self._wakeup.wait()
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_attempt)
+            except asyncio.TimeoutError:
+                pass
+
+    def queue_depth(self) -> dict:
+        return {priority: sum(not future.done() for _, future in lane) for priority, lane in self._lanes.items()}
+
+
+class OutboundRateLimitMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: bot.session.middleware(OutboundRateLimitMiddleware())"""
+
+    def __init__(self, limiter: Optional[OutboundLimiter] = None):
+        self.limiter = limiter or OutboundLimiter()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._queue_waits: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or isinstance(method, UNLIMITED_METHODS):
+            return await make_request(bot, method)
+
+        started = time.monotonic()
+        for attempt in range(MAX_RETRIES + 1):
+            await self.limiter.acquire(chat_id, _priority.get())
+            if attempt == 0:
+                self._queue_waits.append(time.monotonic() - started)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == MAX_RETRIES:
+                    self.failed += 1
+                    raise
+                self.retried += 1
+                logger.info("Flood control for chat %s, retry after %ss", chat_id, e.retry_after)
+                self.limiter.block(chat_id, e.retry_after)
+                continue
+            self.sent += 1
+            self._latencies.append(time.monotonic() - started)
+            return response
+
+    @staticmethod
+    def _percentile(values, fraction: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def stats(self) -> dict:
+        """Очередь по полосам и задержки отправки (сек, от постановки в очередь до ответа)"""
+        return {
+            'queue_depth': self.limiter.queue_depth(),
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'queue_wait_p50': self._percentile(self._queue_waits, 0.5),
+            'queue_wait_p99': self._percentile(self._queue_waits, 0.99),
+            'latency_p50': self._percentile(self._latencies, 0.5),
+            'latency_p99': self._percentile(self._latencies, 0.99)
+        }
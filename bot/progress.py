@@ -0,0 +1,75 @@
+"""
+Индикация долгой обработки без отдельных статусных сообщений
+
+Раньше каждый этап отправлял своё сообщение («⏳ Проверяю...», «⏳ Анализирую...»),
+а затем отдельно приходил результат - лишние запросы к Bot API, которые
+расходуют лимиты отправки. К результатам консультации прикладывается обычная
+клавиатура, а её нельзя добавить правкой статуса: статус пришлось бы удалять
+и отправлять результат заново. Поэтому ProgressReporter только показывает
+«печатает...» (chat action не расходует лимит отправки), обновляя его,
+пока идёт работа, и отправляет результат одним сообщением.
+"""
+import asyncio
+import logging
+from typing import Optional, Union
+
+from aiogram.enums import ChatAction
+from aiogram.types import (
+    ForceReply, InlineKeyboardMarkup, Message, ReplyKeyboardMarkup, ReplyKeyboardRemove
+)
+
+
+logger = logging.getLogger(__name__)
+
+# «печатает...» в Telegram гаснет через 5 секунд
+TYPING_INTERVAL = 4.5
+
+ReplyMarkup = Union[InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, ForceReply]
+
+
+class ProgressReporter:
+    """
+    «печатает...» в чате пользователя, пока идёт долгая операция
+
+        async with ProgressReporter(message) as progress:
+            result = await ai_service.analyze_symptoms(text)
+            await progress.finish(result_text, reply_markup=keyboard)
+
+    Выход из блока (в том числе по исключению) гасит индикацию.
+    """
+
+    def __init__(self, message: Message):
+        self.bot = message.bot
+        self.chat_id = message.chat.id
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Показывает «печатает...» до finish или close"""
+        self._task = asyncio.create_task(self._keep_typing())
+
+    async def __aenter__(self) -> "ProgressReporter":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _keep_typing(self):
+        while True:
+            try:
+                await self.bot.send_chat_action(self.chat_id, ChatAction.TYPING)
+            except Exception as e:
+                logger.warning("Chat action error (%s): %s", self.chat_id, e)
+            await asyncio.sleep(TYPING_INTERVAL)
+
+    async def finish(self, text: str, reply_markup: Optional[ReplyMarkup] = None,
+                     parse_mode: Optional[str] = None) -> Message:
+        """Гасит индикацию и отправляет результат"""
+        await self.close()
+        return await self.bot.send_message(self.chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+    async def close(self):
+        """Гасит индикацию без результата (обработчик ответил иначе)"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
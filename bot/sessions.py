@@ -0,0 +1,195 @@
+"""
+Жизненный цикл FSM-сессий: учёт активности и вытеснение брошенных
+
+Пользователь, ушедший посреди консультации или регистрации, оставляет
+в хранилище FSM состояние и данные (main_symptoms, варианты симптомов...).
+SessionManager запоминает время последней активности каждого чата,
+фоновая задача периодически очищает сессии, простаивающие дольше TTL,
+отменяет их спекулятивные задачи и (по настройке) сообщает пользователю.
+
+Так работает только MemoryStorage: её сессии видит один процесс. Общее
+хранилище (RedisFSMStorage) может обслуживать несколько реплик, и по
+активности, известной одной реплике, нельзя стирать сессию, с которой
+пользователь работает через другую. Там сессии истекают сами по сроку
+жизни ключей (FSM_STATE_TTL), а фоновая задача только чистит брошенные
+спекулятивные задачи.
+
+При каждой проверке SessionManager также измеряет хранилище: сколько
+сессий с состоянием и примерный объём их данных (в байтах кодека FSM).
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import TelegramObject
+
+from config import SESSION_TTL, SESSION_SWEEP_INTERVAL, SESSION_TIMEOUT_NOTIFY
+from bot.keyboards import get_main_menu
+from bot.middlewares import send_priority, PRIORITY_LOW
+from bot.fsm_storage import RedisFSMStorage
+from bot.state_codec import encode, StateCodecError
+from services.speculation import speculative_tasks
+
+
+logger = logging.getLogger(__name__)
+
+
+TIMEOUT_MESSAGE = (
+    "⏰ Сессия завершена из-за неактивности.\n\n"
+    "Введённые данные не сохранены. Чтобы продолжить, начните заново из главного меню."
+)
+
+
+class SessionManager:
+    """Учёт активности FSM-сессий и вытеснение простаивающих"""
+
+    def __init__(self, storage: BaseStorage, ttl: float = SESSION_TTL,
+                 sweep_interval: float = SESSION_SWEEP_INTERVAL, notify: bool = SESSION_TIMEOUT_NOTIFY):
+        self.storage = storage
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.notify = notify
+        # Активность учитывается только для хранилища этого процесса (см. выше)
+        self.tracking = isinstance(storage, MemoryStorage)
+        # key -> время последней активности; порядок - от давних к недавним
+        self._activity: OrderedDict[StorageKey, float] = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self._bot: Optional[Bot] = None
+
+        self.evicted = 0
+        self.notified = 0
+        # Результат последнего измерения хранилища (см. measure)
+        self.live = 0
+        self.bytes = 0
+
+    def touch(self, key: StorageKey):
+        """Отмечает активность сессии"""
+        if not self.tracking:
+            return
+        self._activity[key] = time.monotonic()
+        self._activity.move_to_end(key)
+
+    async def _evict(self, key: StorageKey):
+        state = await self.storage.get_state(key)
+        # Пользователь мог вернуться, пока шёл запрос к хранилищу
+        if key in self._activity:
+            return
+        speculative_tasks.cancel(key)
+
+        if state is not None:
+            await self.storage.set_state(key, None)
+            await self.storage.set_data(key, {})
+            self.evicted += 1
+
+            if self.notify and self._bot is not None:
+                try:
+                    with send_priority(PRIORITY_LOW):
+                        await self._bot.send_message(key.chat_id, TIMEOUT_MESSAGE, reply_markup=get_main_menu())
+                    self.notified += 1
+                except Exception as e:
+                    logger.warning("Session timeout notify error (%s): %s", key.chat_id, e)
+
+        # MemoryStorage создаёт запись при любом обращении и никогда её не удаляет
+        self.storage.storage.pop(key, None)
+
+    async def sweep(self) -> int:
+        """Вытесняет сессии, простаивающие дольше TTL; возвращает их число"""
+        deadline = time.monotonic() - self.ttl
+        expired = []
+        for key, last_activity in self._activity.items():
+            if last_activity > deadline:
+                break
+            expired.append(key)
+
+        for key in expired:
+            del self._activity[key]
+            try:
+                await self._evict(key)
+            except Exception as e:
+                logger.warning("Session evict error (%s): %s", key.chat_id, e)
+        return len(expired)
+
+    async def measure(self, batch: int = 1000):
+        """Считает сессии с состоянием и примерный объём их данных"""
+        if isinstance(self.storage, RedisFSMStorage):
+            self.live, self.bytes = await self.storage.usage()
+            return
+        if not self.tracking:
+            return
+
+        records = [record for record in list(self.storage.storage.values()) if record.state is not None]
+        data_bytes = 0
+        for index, record in enumerate(records, 1):
+            data_bytes += len(record.state)
+            if record.data:
+                try:
+                    data_bytes += len(encode(record.data))
+                except StateCodecError:
+                    pass
+            # Кодирование всех сессий не должно надолго занимать цикл событий
+            if index % batch == 0:
+                await asyncio.sleep(0)
+        self.live, self.bytes = len(records), data_bytes
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            evicted = await self.sweep()
+            speculative_tasks.prune()
+            try:
+                await self.measure()
+            except Exception as e:
+                logger.warning("Session measure error: %s", e)
+            if evicted:
+                logger.info("Evicted %s idle sessions, %s live", evicted, self.live)
+
+    def start(self, bot: Bot):
+        """Запускает фоновую очистку"""
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """
+        Сессии с состоянием и их объём (по последнему measure), отслеживаемые
+        чаты (только MemoryStorage) и вытесненные сессии
+        """
+        return {
+            'live': self.live,
+            'bytes': self.bytes,
+            'tracked': len(self._activity),
+            'evicted': self.evicted,
+            'notified': self.notified
+        }
+
+
+class SessionActivityMiddleware(BaseMiddleware):
+    """Отмечает активность FSM-сессии на каждом событии"""
+
+    def __init__(self, manager: SessionManager):
+        self.manager = manager
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        state = data.get("state")
+        if state is not None:
+            self.manager.touch(state.key)
+        return await handler(event, data)
@@ -0,0 +1,392 @@
+"""
+Многопроцессный режим: фронт раздаёт обновления воркерам по chat_id
+
+Один процесс asyncio упирается в одно ядро: фильтры aiogram, клавиатуры
+и JSON считаются в нём же. Фронт принимает обновления (webhook или
+polling) и по консистентному хэшу chat_id отправляет их в один из N
+процессов-воркеров. Все обновления чата попадают в один воркер - порядок
+и локальность FSM сохраняются.
+
+Фронт и воркеры общаются через unix-сокет кадрами "длина + JSON".
+У каждого воркера своя очередь на фронте: пока воркер перезапускается,
+его обновления ждут в очереди. Перезапуск мягкий: воркер дорабатывает
+начатые обновления, закрывает соединения и завершается, затем фронт
+запускает новый. Воркеры периодически присылают свою статистику и метрики:
+фронт отдаёт их в /metrics с меткой worker (с задержкой до STATS_INTERVAL).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import struct
+import tempfile
+import time
+from bisect import bisect
+from typing import Any, Awaitable, Callable, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+from config import WORKER_DRAIN_TIMEOUT
+
+
+logger = logging.getLogger(__name__)
+
+
+# Виртуальных узлов на воркер (равномерность распределения)
+RING_REPLICAS = 100
+
+# Как часто воркер присылает статистику (сек)
+STATS_INTERVAL = 5
+
+# Упавший воркер перезапускается не чаще, чем раз в столько секунд
+RESTART_BACKOFF = 5
+
+_FRAME_HEADER = struct.Struct(">I")
+
+
+# ============ МАРШРУТИЗАЦИЯ ============
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Консистентный хэш: ключ -> номер воркера"""
+
+    def __init__(self, nodes: int, replicas: int = RING_REPLICAS):
+        points = sorted((_hash(f"worker-{node}:{replica}"), node)
+                        for node in range(nodes) for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key: int) -> int:
+        index = bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._nodes[index]
+
+
+def routing_key(update: dict) -> int:
+    """chat_id обновления (или id пользователя, если чата нет)"""
+    for name, payload in update.items():
+        if name == "update_id" or not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if user:
+            return user["id"]
+    return update.get("update_id", 0)
+
+
+# ============ ПРОТОКОЛ ============
+
+async def read_frame(reader: asyncio.StreamReader) -> dict:
+    header = await reader.readexactly(_FRAME_HEADER.size)
+    (length,) = _FRAME_HEADER.unpack(header)
+    return json.loads(await reader.readexactly(length))
+
+
+def write_frame(writer: asyncio.StreamWriter, frame: dict):
+    raw = json.dumps(frame, ensure_ascii=False).encode()
+    writer.write(_FRAME_HEADER.pack(len(raw)) + raw)
+
+
+# ============ ФРОНТ ============
+
+class _Worker:
+    """Состояние воркера на стороне фронта"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.process: Optional[multiprocessing.Process] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.sender: Optional[asyncio.Task] = None
+        self.connected = asyncio.Event()
+        self.restarting = False
+        self.routed = 0
+        self.restarts = 0
+        self.started_at = 0.0
+        self.reported: dict = {}
+        # Семейства метрик из последнего отчёта (PrometheusWriter.families)
+        self.metrics: list[dict] = []
+
+
+class ShardFront:
+    """Фронт-процесс: запускает воркеры и раздаёт им обновления"""
+
+    def __init__(self, workers: int, target: Callable[[int, str], None],
+                 drain_timeout: float = WORKER_DRAIN_TIMEOUT):
+        self.target = target
+        self.drain_timeout = drain_timeout
+        self.ring = HashRing(workers)
+        self.workers = [_Worker(index) for index in range(workers)]
+        self.address = os.path.join(tempfile.mkdtemp(prefix="bot-shards-"), "front.sock")
+        self._context = multiprocessing.get_context("spawn")
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._monitor: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def route(self, update: dict):
+        """Ставит обновление в очередь воркера его чата"""
+        worker = self.workers[self.ring.node(routing_key(update))]
+        worker.routed += 1
+        worker.queue.put_nowait(update)
+
+    def _spawn(self, worker: _Worker):
+        worker.connected.clear()
+        worker.process = self._context.Process(
+            target=self.target, args=(worker.index, self.address), name=f"bot-worker-{worker.index}", daemon=True
+        )
+        worker.process.start()
+        worker.started_at = time.time()
+        worker.reported = {}
+        worker.metrics = []
+        logger.info("Worker %s started (pid %s)", worker.index, worker.process.pid)
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._on_connect, path=self.address)
+        for worker in self.workers:
+            self._spawn(worker)
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        hello = await read_frame(reader)
+        worker = self.workers[hello["worker"]]
+        worker.writer = writer
+        worker.connected.set()
+        worker.sender = asyncio.create_task(self._send(worker, writer))
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame.get("type") == "stats":
+                    worker.reported = frame["stats"]
+                    worker.metrics = frame.get("metrics") or []
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # К этому моменту мог подключиться уже новый процесс воркера
+            if worker.writer is writer:
+                worker.sender.cancel()
+                worker.writer = None
+            writer.close()
+
+    async def _send(self, worker: _Worker, writer: asyncio.StreamWriter):
+        """Передаёт обновления из очереди воркеру"""
+        while True:
+            update = await worker.queue.get()
+            try:
+                write_frame(writer, {"type": "update", "update": update})
+                await writer.drain()
+            except BaseException:
+                # Запись не завершилась (воркер упал, отправку отменили) - обновление
+                # не потеряется: его получит перезапущенный воркер. Если кадр всё же
+                # дошёл, повтор отбросит общая проверка update_id (Redis, см. dedup)
+                self._requeue_first(worker, update)
+                raise
+
+    @staticmethod
+    def _requeue_first(worker: _Worker, update: dict):
+        pending = [update]
+        while not worker.queue.empty():
+            pending.append(worker.queue.get_nowait())
+        for item in pending:
+            worker.queue.put_nowait(item)
+
+    async def _watch(self):
+        """Перезапускает упавшие воркеры"""
+        while not self._stopping:
+            await asyncio.sleep(1)
+            for worker in self.workers:
+                if worker.restarting or worker.process is None or worker.process.is_alive():
+                    continue
+                if time.time() - worker.started_at < RESTART_BACKOFF:
+                    continue
+                logger.warning("Worker %s exited with code %s, restarting", worker.index, worker.process.exitcode)
+                worker.restarts += 1
+                self._spawn(worker)
+
+    async def _drain(self, worker: _Worker):
+        """Мягко останавливает воркер: он дорабатывает начатые обновления"""
+        # Только что запущенный воркер сначала должен подключиться
+        if worker.process.is_alive() and not worker.connected.is_set():
+            try:
+                await asyncio.wait_for(worker.connected.wait(), timeout=self.drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        # Время на доработку отсчитывается с команды drain, а не с ожидания подключения
+        deadline = time.monotonic() + self.drain_timeout
+        if worker.sender is not None:
+            worker.sender.cancel()
+            try:
+                await worker.sender
+            except (asyncio.CancelledError, ConnectionError):
+                pass
+        if worker.writer is not None:
+            try:
+                write_frame(worker.writer, {"type": "drain"})
+                await worker.writer.drain()
+            except ConnectionError:
+                pass
+
+        while worker.process.is_alive() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if worker.process.is_alive():
+            logger.warning("Worker %s did not stop in %ss, terminating", worker.index, self.drain_timeout)
+            worker.process.terminate()
+            await asyncio.to_thread(worker.process.join, 5)
+
+    async def restart(self):
+        """Поочерёдный мягкий перезапуск всех воркеров"""
+        for worker in self.workers:
+            worker.restarting = True
+            try:
+                await self._drain(worker)
+                worker.restarts += 1
+                self._spawn(worker)
+                await asyncio.wait_for(worker.connected.wait(), timeout=self.drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Worker %s did not connect after restart", worker.index)
+            finally:
+                worker.restarting = False
+
+    async def stop(self):
+        self._stopping = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+        for worker in self.workers:
+            worker.restarting = True
+        await asyncio.gather(*(self._drain(worker) for worker in self.workers if worker.process))
+        if self._server is not None:
+            self._server.close()
+
+    def stats(self) -> list[dict]:
+        """Статистика по воркерам (очередь на фронте + отчёт воркера)"""
+        return [
+            {
+                'worker': worker.index,
+                'pid': worker.process.pid if worker.process else None,
+                'alive': bool(worker.process and worker.process.is_alive()),
+                'connected': worker.writer is not None,
+                'routed': worker.routed,
+                'queued': worker.queue.qsize(),
+                'restarts': worker.restarts,
+                'uptime': round(time.time() - worker.started_at, 1),
+                **worker.reported
+            }
+            for worker in self.workers
+        ]
+
+    def write_metrics(self, writer):
+        """Метрики воркеров (последние отчёты) и их очередей на фронте в PrometheusWriter"""
+        for worker in self.workers:
+            writer.merge(worker.metrics, {'worker': str(worker.index)})
+        writer.gauge(
+            "shard_queue_updates", "Updates waiting on the front for a worker",
+            [({'worker': str(worker.index)}, worker.queue.qsize()) for worker in self.workers]
+        )
+        writer.counter(
+            "shard_updates_routed", "Updates routed to a worker",
+            [({'worker': str(worker.index)}, worker.routed) for worker in self.workers]
+        )
+        writer.counter(
+            "shard_worker_restarts", "Worker process restarts",
+            [({'worker': str(worker.index)}, worker.restarts) for worker in self.workers]
+        )
+
+    # ============ ИСТОЧНИКИ ОБНОВЛЕНИЙ ============
+
+    def webhook_handler(self, secret_token: str) -> Callable[[web.Request], Awaitable[web.Response]]:
+        """aiohttp-обработчик вебхука: проверка секрета, маршрутизация, ответ сразу"""
+        async def handle(request: web.Request) -> web.Response:
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not secrets.compare_digest(token, secret_token):
+                return web.Response(status=401, text="Unauthorized")
+            self.route(await request.json())
+            return web.json_response({})
+        return handle
+
+    async def workers_handler(self, request: web.Request) -> web.Response:
+        """GET /workers - статистика воркеров"""
+        return web.json_response(self.stats())
+
+    async def poll(self, bot: Bot, allowed_updates: list[str]):
+        """Long polling на фронте: обновления раздаются воркерам"""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.warning("Polling error: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                self.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+
+
+# ============ ВОРКЕР ============
+
+async def run_worker(index: int, address: str, bot: Bot, dp: Dispatcher,
+                     start_services: Callable[[], Awaitable[Any]],
+                     stop_services: Callable[[], Awaitable[Any]],
+                     collect_metrics: Optional[Callable[[], list[dict]]] = None):
+    """
+    Цикл воркера: получает обновления от фронта и обрабатывает их диспетчером
+
+    collect_metrics возвращает семейства метрик процесса (PrometheusWriter.families)
+    для отчёта фронту
+    """
+    reader, writer = await asyncio.open_unix_connection(address)
+    write_frame(writer, {"worker": index})
+    await writer.drain()
+
+    tasks: set[asyncio.Task] = set()
+    stats = {'processed': 0, 'errors': 0, 'in_flight': 0, 'handle_ms_total': 0.0}
+
+    async def handle(update: dict):
+        started = time.perf_counter()
+        try:
+            await dp.feed_raw_update(bot, update)
+            stats['processed'] += 1
+        except Exception as e:
+            stats['errors'] += 1
+            logger.error("Worker %s update error: %s", index, e)
+        finally:
+            stats['handle_ms_total'] += (time.perf_counter() - started) * 1000
+
+    async def report():
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            stats['in_flight'] = len(tasks)
+            frame = {"type": "stats", "stats": stats}
+            if collect_metrics is not None:
+                frame["metrics"] = collect_metrics()
+            write_frame(writer, frame)
+            await writer.drain()
+
+    await start_services()
+    reporter = asyncio.create_task(report())
+    try:
+        while True:
+            try:
+                frame = await read_frame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            if frame.get("type") == "drain":
+                break
+            task = asyncio.create_task(handle(frame["update"]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        # Дорабатываем начатые обновления
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        reporter.cancel()
+        writer.close()
+        await stop_services()
@@ -0,0 +1,161 @@
+"""
+Компактное двоичное кодирование данных FSM
+
+JSON не умеет множества (selected_additional), pickle небезопасен и
+многословен. Формат: байт версии, затем значения с однобайтовым тегом.
+Целые - zigzag varint, длины строк и коллекций - varint. Частые ключи
+данных (KNOWN_KEYS) кодируются одним байтом номера.
+
+KNOWN_KEYS можно только дополнять в конце: номер ключа - часть формата.
+"""
+import struct
+from typing import Any
+
+
+VERSION = 1
+
+# Ключи данных, которые пишут обработчики (только добавлять в конец!)
+KNOWN_KEYS = (
+    "main_symptoms", "duration", "additional_symptoms_options", "selected_additional",
+    "full_name", "phone", "birthdate", "gender", "height", "weight", "current_category",
+    "symptoms_pipeline", "red_flag", "red_flag_text", "red_flag_step", "suggested_additional",
+)
+_KEY_INDEX = {key: index for index, key in enumerate(KNOWN_KEYS)}
+
+# Теги значений
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _BYTES, _LIST, _TUPLE, _SET, _DICT, _KEY = range(12)
+
+_DOUBLE = struct.Struct("<d")
+
+
+class StateCodecError(ValueError):
+    """Значение нельзя закодировать или данные повреждены"""
+
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_str(out: bytearray, value: str):
+    raw = value.encode()
+    _write_varint(out, len(raw))
+    out += raw
+
+
+def _encode(out: bytearray, value: Any):
+    # bool проверяется раньше int: True - тоже int
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _DOUBLE.pack(value)
+    elif isinstance(value, str):
+        out.append(_STR)
+        _write_str(out, value)
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(_BYTES)
+        _write_varint(out, len(value))
+        out += value
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise StateCodecError(f"Dict keys must be str, got {type(key).__name__}")
+            index = _KEY_INDEX.get(key)
+            if index is not None:
+                out.append(_KEY)
+                out.append(index)
+            else:
+                out.append(_STR)
+                _write_str(out, key)
+            _encode(out, item)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        out.append(_LIST if isinstance(value, list) else _TUPLE if isinstance(value, tuple) else _SET)
+        _write_varint(out, len(value))
+        for item in value:
+            _encode(out, item)
+    else:
+        raise StateCodecError(f"Unsupported type in FSM data: {type(value).__name__}")
+
+
+def _decode(data: bytes, pos: int) -> tuple[Any, int]:
+    tag = data[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _INT:
+        raw, pos = _read_varint(data, pos)
+        return (raw >> 1) ^ -(raw & 1), pos
+    if tag == _FLOAT:
+        return _DOUBLE.unpack_from(data, pos)[0], pos + _DOUBLE.size
+    if tag in (_STR, _BYTES):
+        length, pos = _read_varint(data, pos)
+        raw = bytes(data[pos:pos + length])
+        return (raw.decode() if tag == _STR else raw), pos + length
+    if tag in (_LIST, _TUPLE, _SET):
+        length, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(length):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return (items if tag == _LIST else tuple(items) if tag == _TUPLE else set(items)), pos
+    if tag == _DICT:
+        length, pos = _read_varint(data, pos)
+        result = {}
+        for _ in range(length):
+            if data[pos] == _KEY:
+                key = KNOWN_KEYS[data[pos + 1]]
+                pos += 2
+            elif data[pos] == _STR:
+                key, pos = _decode(data, pos)
+            else:
+                raise StateCodecError(f"Bad dict key tag {data[pos]} at {pos}")
+            result[key], pos = _decode(data, pos)
+        return result, pos
+    raise StateCodecError(f"Unknown tag {tag} at {pos - 1}")
+
+
+def encode(value: Any) -> bytes:
+    """Кодирует данные FSM (dict, list, set, str, числа, None)"""
+    out = bytearray((VERSION,))
+    _encode(out, value)
+    return bytes(out)
+
+
+def decode(data: bytes) -> Any:
+    """Декодирует результат encode"""
+    if not data or data[0] != VERSION:
+        raise StateCodecError("Unknown FSM data format")
+    try:
+        value, pos = _decode(data, 1)
+    except (IndexError, UnicodeDecodeError, struct.error) as e:
+        raise StateCodecError(f"Corrupted FSM data: {e}") from e
+    if pos != len(data):
+        raise StateCodecError("Trailing bytes in FSM data")
+    return value
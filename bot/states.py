@@ -37,6 +37,9 @@ class Consultation(StatesGroup):
     
     # Этап 4: Финальное подтверждение
     final_confirmation = State()
+    
+    # Экстренный результат по красному флагу: продолжить или отменить
+    red_flag_confirm = State()
 
 
 class FindSpecialist(StatesGroup):
@@ -1,4 +1,5 @@
 import os
+import hashlib
 from dotenv import load_dotenv
 
 # Загружаем переменные из .env файла (для локальной разработки)
@@ -14,19 +15,119 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY environment variable is not set")
 
+# База данных: "supabase", "memory" (SQLite в памяти) или "sqlite" (файл DB_SQLITE_PATH).
+# Локальные варианты - для тестов, бенчмарков и разработки без сети
+DB_BACKEND = os.getenv("DB_BACKEND", "supabase").lower()
+DB_SQLITE_PATH = os.getenv("DB_SQLITE_PATH", "local_db.sqlite3")
+
+if DB_BACKEND not in ("supabase", "memory", "sqlite"):
+    raise ValueError(f"Unknown DB_BACKEND: {DB_BACKEND}")
+
 # Supabase credentials
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
+if DB_BACKEND == "supabase" and (not SUPABASE_URL or not SUPABASE_KEY):
     raise ValueError("SUPABASE_URL and SUPABASE_KEY environment variables must be set")
 
 # Настройки
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
 PORT = int(os.getenv("PORT", 8080))
 
+# Groq: максимум одновременных запросов и таймаут (сек)
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", 20))
+# Отдельный бюджет для спекулятивных запросов (заранее, пока пользователь думает):
+# они не занимают места обычных, а при исчерпании бюджета не выполняются
+AI_SPECULATIVE_CONCURRENCY = int(os.getenv("AI_SPECULATIVE_CONCURRENCY", 10))
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", 30))
+# Сколько ждать рекомендацию от AI, прежде чем ответить локальной моделью (сек)
+AI_RECOMMEND_TIMEOUT = float(os.getenv("AI_RECOMMEND_TIMEOUT", 15))
+
+# Supabase: максимум одновременных запросов и таймаут (сек)
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", 20))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", 10))
+
+# Кэш профилей: максимум записей и время жизни (сек)
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", 10000))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", 300))
+
+# Кэш ответов LLM (память + SQLite)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "True").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", 5000))
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", 100000))
+
+# Проверка и улучшение симптомов: "combined" (один запрос), "split" (два запроса)
+# или "ab" (половина пользователей на каждом варианте, по user_id)
+SYMPTOMS_PIPELINE = os.getenv("SYMPTOMS_PIPELINE", "combined").lower()
+
+# Локальный классификатор специалиста: файл модели и порог уверенности
+CLASSIFIER_PATH = os.getenv("CLASSIFIER_PATH", "models/specialist_classifier.npz")
+CLASSIFIER_CONFIDENCE = float(os.getenv("CLASSIFIER_CONFIDENCE", 0.9))
+
+# Подбор дополнительных симптомов по истории: сколько консультаций загружать
+# при старте и сколько нужно, чтобы отвечать без LLM
+SUGGESTIONS_HISTORY_LIMIT = int(os.getenv("SUGGESTIONS_HISTORY_LIMIT", 20000))
+SUGGESTIONS_MIN_HISTORY = int(os.getenv("SUGGESTIONS_MIN_HISTORY", 200))
+
+# Хранилище FSM: "memory" (теряется при перезапуске), "redis" или "local"
+# (формат Redis в памяти процесса - для проверок); срок жизни сессии в секундах
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", 24 * 3600))
+
+# Брошенные сессии: время простоя до очистки, период проверки (сек)
+# и нужно ли сообщать пользователю (только MemoryStorage; Redis - по FSM_STATE_TTL)
+SESSION_TTL = float(os.getenv("SESSION_TTL", 3600))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", 60))
+SESSION_TIMEOUT_NOTIFY = os.getenv("SESSION_TIMEOUT_NOTIFY", "True").lower() == "true"
+
+# Получение обновлений: "polling" или "webhook" (на том же веб-сервере, что и /health)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Публичный адрес сервиса (Render задаёт RENDER_EXTERNAL_URL сам)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; по умолчанию выводится
+# из токена бота, чтобы у всех реплик он был одинаковым
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise ValueError("WEBHOOK_URL environment variable must be set for BOT_MODE=webhook")
+
+# Отбрасывание повторных обновлений: окно (сек) и сколько update_id помнить
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", 3600))
+DEDUP_SIZE = int(os.getenv("DEDUP_SIZE", 100000))
+
+# Процессов-воркеров (1 - всё в одном процессе, как раньше) и сколько ждать
+# мягкой остановки воркера при перезапуске (сек)
+WORKERS = int(os.getenv("WORKERS", 1))
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", 30))
+
+# Сессии воркера в памяти пропали бы при его перезапуске (SIGHUP, падение):
+# пользователи посреди консультации вернулись бы в начало
+if WORKERS > 1 and FSM_STORAGE != "redis":
+    raise ValueError("FSM_STORAGE=redis is required for WORKERS > 1")
+
+# Обработка обновлений: глубина очереди одного чата (лишние нажатия отбрасываются)
+# и сколько обновлений разных чатов обрабатывается одновременно
+CHAT_QUEUE_DEPTH = int(os.getenv("CHAT_QUEUE_DEPTH", 10))
+UPDATE_MAX_CONCURRENCY = int(os.getenv("UPDATE_MAX_CONCURRENCY", 200))
+
+# Окно объединения правок инлайн-клавиатуры при выборе симптомов (сек)
+EDIT_DEBOUNCE = float(os.getenv("EDIT_DEBOUNCE", 0.4))
+
+# Лимиты исходящих сообщений Telegram: общий (в секунду), на чат (в секунду)
+# и сколько сообщений в чат можно отправить подряд
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 30))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", 1))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", 3))
+
+# Токен для /metrics (заголовок Authorization: Bearer ...); пусто - без проверки
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 print("✅ Configuration loaded successfully")
 print(f"   - Bot token: {'*' * 10}{BOT_TOKEN[-10:]}")
 print(f"   - Groq API: {'*' * 10}{GROQ_API_KEY[-10:]}")
-print(f"   - Supabase: {SUPABASE_URL}")
+print(f"   - Database: {SUPABASE_URL if DB_BACKEND == 'supabase' else DB_BACKEND}")
 print(f"   - Port: {PORT}")
@@ -2,7 +2,12 @@
 Database module for Telegram Medical Bot
 """
 
-from .connection import supabase_client
+from .connection import get_supabase_client, close_supabase_client
 from .models import UserProfile, Consultation, Message
+from .repository import profiles, consultations, messages
 
-__all__ = ['supabase_client', 'UserProfile', 'Consultation', 'Message']
+__all__ = [
+    'get_supabase_client', 'close_supabase_client',
+    'UserProfile', 'Consultation', 'Message',
+    'profiles', 'consultations', 'messages'
+]
@@ -1,19 +1,46 @@
-import os
-from supabase import create_client, Client
+import asyncio
+from typing import Optional, Union
 
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
 
-# Получаем переменные окружения
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+from config import DB_BACKEND, DB_SQLITE_PATH, DB_TIMEOUT, SUPABASE_URL, SUPABASE_KEY
+from .memory_backend import LocalSupabaseClient
 
-# Проверяем наличие переменных
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError(
-        "Missing Supabase credentials. "
-        "Please set SUPABASE_URL and SUPABASE_KEY environment variables."
-    )
 
-# Создаём клиент Supabase
-supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Асинхронный клиент Supabase создаётся лениво при первом запросе.
+# Один клиент на процесс = один пул HTTP-соединений к PostgREST.
+# При DB_BACKEND=memory/sqlite вместо него - локальный клиент с тем же API.
+_supabase_client: Optional[Union[AsyncClient, LocalSupabaseClient]] = None
+_client_lock = asyncio.Lock()
 
-print("✅ Supabase client initialized successfully")
+
+async def get_supabase_client() -> Union[AsyncClient, LocalSupabaseClient]:
+    """Возвращает общий асинхронный клиент Supabase (или его локальную замену)"""
+    global _supabase_client
+    if _supabase_client is None:
+        async with _client_lock:
+            if _supabase_client is None:
+                if DB_BACKEND == "supabase":
+                    _supabase_client = await acreate_client(
+                        SUPABASE_URL,
+                        SUPABASE_KEY,
+                        options=AsyncClientOptions(postgrest_client_timeout=DB_TIMEOUT)
+                    )
+                    print("✅ Supabase client initialized successfully")
+                else:
+                    _supabase_client = LocalSupabaseClient(
+                        ":memory:" if DB_BACKEND == "memory" else DB_SQLITE_PATH
+                    )
+                    print(f"✅ Local database initialized ({DB_BACKEND})")
+    return _supabase_client
+
+
+async def close_supabase_client():
+    """Закрывает HTTP-соединения с Supabase (или локальную базу)"""
+    global _supabase_client
+    if _supabase_client is not None:
+        if isinstance(_supabase_client, LocalSupabaseClient):
+            await _supabase_client.aclose()
+        else:
+            await _supabase_client.postgrest.aclose()
+        _supabase_client = None
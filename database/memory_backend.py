@@ -0,0 +1,203 @@
+"""
+Локальная замена Supabase/PostgREST для тестов, бенчмарков и разработки
+
+Реализует подмножество query builder'а, которое использует database.repository:
+table().select().eq().order().limit().execute(), insert() и update().
+Таблицы создаются из supabase_schema.sql (диалект PostgreSQL переводится
+в SQLite), поэтому соблюдаются те же столбцы, первичные ключи, CHECK и
+внешние ключи, что и в Supabase. Нарушения возвращаются как APIError
+postgrest - так же, как от настоящего сервера.
+
+DB_BACKEND=memory - база в памяти процесса, DB_BACKEND=sqlite - файл
+DB_SQLITE_PATH. Запросы выполняются синхронно в цикле событий: для локальной
+базы это микросекунды и повторяемые замеры без сетевого ввода-вывода.
+"""
+import os
+import re
+import sqlite3
+from dataclasses import dataclass
+from typing import Any, Optional, Union
+
+from postgrest.exceptions import APIError
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "supabase_schema.sql")
+
+# Перевод типов и умолчаний PostgreSQL в SQLite
+_SQLITE_REPLACEMENTS = [
+    (re.compile(r"\bSERIAL\s+PRIMARY\s+KEY\b", re.I), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    (re.compile(r"\bTIMESTAMP\s+WITH\s+TIME\s+ZONE\b", re.I), "TEXT"),
+    (re.compile(r"\bDEFAULT\s+NOW\(\)", re.I), "DEFAULT CURRENT_TIMESTAMP"),
+]
+
+# Коды PostgreSQL для нарушений ограничений (по тексту ошибки SQLite)
+_CONSTRAINT_CODES = [
+    ("UNIQUE", "23505"),
+    ("CHECK", "23514"),
+    ("FOREIGN KEY", "23503"),
+    ("NOT NULL", "23502"),
+]
+
+
+def schema_statements(sql: str) -> list[str]:
+    """Операторы схемы Supabase в диалекте SQLite (без COMMENT ON)"""
+    sql = re.sub(r"--[^\n]*", "", sql)
+    statements = []
+    for statement in sql.split(";"):
+        statement = statement.strip()
+        if not statement or statement.upper().startswith("COMMENT ON"):
+            continue
+        for pattern, replacement in _SQLITE_REPLACEMENTS:
+            statement = pattern.sub(replacement, statement)
+        statements.append(statement)
+    return statements
+
+
+@dataclass
+class Response:
+    """Ответ в форме postgrest APIResponse (используется только data)"""
+    data: list[dict]
+    count: Optional[int] = None
+
+
+class _Query:
+    """Запрос к одной таблице: методы возвращают self, как в postgrest"""
+
+    def __init__(self, client: "LocalSupabaseClient", table: str):
+        self.client = client
+        self.table = table
+        self._action = "select"
+        self._columns = "*"
+        self._payload: Any = None
+        self._filters: list[tuple[str, Any]] = []
+        self._order: list[tuple[str, bool]] = []
+        self._limit: Optional[int] = None
+
+    def select(self, columns: str = "*", *more: str):
+        self._action = "select"
+        self._columns = ",".join((columns, *more))
+        return self
+
+    def insert(self, row: Union[dict, list[dict]]):
+        self._action, self._payload = "insert", row if isinstance(row, list) else [row]
+        return self
+
+    def update(self, fields: dict):
+        self._action, self._payload = "update", fields
+        return self
+
+    def eq(self, column: str, value):
+        self._filters.append((column, value))
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def _column(self, name: str) -> str:
+        """Имя столбца после проверки по схеме (в SQL подставляются только они)"""
+        name = name.strip()
+        if name not in self.client.columns(self.table):
+            raise APIError({
+                'message': f'column {self.table}.{name} does not exist',
+                'code': '42703', 'hint': None, 'details': None
+            })
+        return f'"{name}"'
+
+    def _where(self) -> tuple[str, list]:
+        if not self._filters:
+            return "", []
+        clause = " AND ".join(f"{self._column(column)} = ?" for column, _ in self._filters)
+        return f" WHERE {clause}", [value for _, value in self._filters]
+
+    def _select_sql(self, where: str) -> str:
+        columns = "*" if self._columns.strip() == "*" else ", ".join(
+            self._column(column) for column in self._columns.split(",")
+        )
+        sql = f'SELECT {columns} FROM "{self.table}"{where}'
+        if self._order:
+            sql += " ORDER BY " + ", ".join(
+                f"{self._column(column)} {'DESC' if desc else 'ASC'}" for column, desc in self._order
+            )
+        if self._limit is not None:
+            sql += f" LIMIT {int(self._limit)}"
+        return sql
+
+    async def execute(self) -> Response:
+        self.client.query_count += 1
+        try:
+            return Response(data=self._run())
+        except sqlite3.IntegrityError as e:
+            # Как PostgREST: нарушение ограничения - ошибка запроса с кодом PostgreSQL
+            code = next((code for prefix, code in _CONSTRAINT_CODES if str(e).startswith(prefix)), '23000')
+            raise APIError({'message': str(e), 'code': code, 'hint': None, 'details': None}) from e
+
+    def _run(self) -> list[dict]:
+        db = self.client.connection
+        if self.client.columns(self.table) == ():
+            raise APIError({
+                'message': f'relation "{self.table}" does not exist',
+                'code': '42P01', 'hint': None, 'details': None
+            })
+
+        if self._action == "insert":
+            rows = []
+            with db:
+                for row in self._payload:
+                    columns = ", ".join(self._column(column) for column in row)
+                    placeholders = ", ".join("?" for _ in row)
+                    cursor = db.execute(
+                        f'INSERT INTO "{self.table}" ({columns}) VALUES ({placeholders}) RETURNING *',
+                        list(row.values())
+                    )
+                    rows.append(dict(cursor.fetchone()))
+            return rows
+
+        where, params = self._where()
+        if self._action == "update":
+            assignments = ", ".join(f"{self._column(column)} = ?" for column in self._payload)
+            with db:
+                cursor = db.execute(
+                    f'UPDATE "{self.table}" SET {assignments}{where} RETURNING *',
+                    [*self._payload.values(), *params]
+                )
+                return [dict(row) for row in cursor.fetchall()]
+
+        return [dict(row) for row in db.execute(self._select_sql(where), params).fetchall()]
+
+
+class LocalSupabaseClient:
+    """Совместимый с AsyncClient Supabase клиент поверх SQLite"""
+
+    def __init__(self, path: str = ":memory:", schema_path: str = SCHEMA_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        with open(schema_path, encoding="utf-8") as f:
+            for statement in schema_statements(f.read()):
+                self.connection.execute(statement)
+        self.connection.commit()
+        self._columns: dict[str, tuple[str, ...]] = {}
+        self.query_count = 0
+
+    def columns(self, table: str) -> tuple[str, ...]:
+        """Столбцы таблицы (пустой кортеж - таблицы нет)"""
+        columns = self._columns.get(table)
+        if columns is None:
+            columns = self._columns[table] = tuple(
+                row["name"] for row in self.connection.execute(
+                    "SELECT name FROM pragma_table_info(?)", (table,)
+                )
+            )
+        return columns
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    async def aclose(self):
+        self.connection.close()
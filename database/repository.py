@@ -0,0 +1,181 @@
+"""
+Асинхронный слой доступа к данным (профили, консультации, сообщения)
+
+Хендлеры работают с БД только через эти репозитории: все запросы
+выполняются асинхронно через общий клиент Supabase, а число одновременных
+запросов к PostgREST ограничено DB_MAX_CONCURRENCY.
+"""
+import asyncio
+import time
+from typing import Optional
+
+from config import DB_MAX_CONCURRENCY, PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL
+from services.cache import TTLCache, MISSING
+from services.metrics import metrics, timed
+from .connection import get_supabase_client
+
+
+# Ограничение числа одновременных запросов к PostgREST
+_db_semaphore = asyncio.Semaphore(DB_MAX_CONCURRENCY)
+
+# Счётчик запросов к PostgREST (для оценки эффекта кэширования)
+_query_count = 0
+
+
+async def _execute(build_query, operation: str = "unknown"):
+    """
+    Выполняет запрос к Supabase
+
+    Args:
+        build_query: Функция, которая по клиенту строит запрос (query builder)
+        operation: Имя запроса для метрик ("таблица.действие")
+
+    Returns:
+        Ответ PostgREST (с полем data)
+    """
+    global _query_count
+    client = await get_supabase_client()
+    with timed("db"):
+        async with _db_semaphore:
+            _query_count += 1
+            started = time.perf_counter()
+            try:
+                response = await build_query(client).execute()
+            except Exception:
+                metrics.record_db(operation, time.perf_counter() - started, error=True)
+                raise
+            metrics.record_db(operation, time.perf_counter() - started)
+            return response
+
+
+def db_stats() -> dict:
+    """Статистика обращений к БД"""
+    return {
+        'queries': _query_count,
+        'profile_cache': profiles.cache_stats()
+    }
+
+
+class ProfileRepository:
+    """
+    Профили пользователей (таблица user_profiles)
+
+    Чтения идут через read-through кэш (TTL + LRU) по user_id,
+    записи обновляют или инвалидируют кэш.
+    """
+
+    table = 'user_profiles'
+
+    def __init__(self, cache_size: int = PROFILE_CACHE_SIZE, cache_ttl: float = PROFILE_CACHE_TTL):
+        # Кэшируем и отсутствие профиля (None), чтобы не спрашивать БД повторно
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    async def get(self, user_id: int) -> Optional[dict]:
+        """Возвращает профиль пользователя или None"""
+        profile = self._cache.get(user_id)
+        if profile is not MISSING:
+            return profile
+
+        response = await _execute(
+            lambda client: client.table(self.table).select('*').eq('user_id', user_id),
+            f"{self.table}.select"
+        )
+        profile = response.data[0] if response.data else None
+        self._cache.set(user_id, profile)
+        return profile
+
+    async def exists(self, user_id: int) -> bool:
+        """Проверяет, зарегистрирован ли пользователь"""
+        # Берём полный профиль: он понадобится дальше в консультации
+        return await self.get(user_id) is not None
+
+    async def create(self, profile_data: dict):
+        """Создаёт профиль"""
+        try:
+            await _execute(lambda client: client.table(self.table).insert(profile_data), f"{self.table}.insert")
+        except Exception:
+            self._cache.pop(profile_data['user_id'])
+            raise
+        self._cache.set(profile_data['user_id'], dict(profile_data))
+
+    async def update(self, user_id: int, fields: dict):
+        """Обновляет поля профиля"""
+        try:
+            await _execute(
+                lambda client: client.table(self.table).update(fields).eq('user_id', user_id),
+                f"{self.table}.update"
+            )
+        except Exception:
+            self._cache.pop(user_id)
+            raise
+
+        cached = self._cache.get(user_id)
+        if cached is not MISSING and cached is not None:
+            self._cache.set(user_id, {**cached, **fields})
+        else:
+            self._cache.pop(user_id)
+
+    def invalidate(self, user_id: int):
+        """Сбрасывает закэшированный профиль"""
+        self._cache.pop(user_id)
+
+    def cache_stats(self) -> dict:
+        """Статистика кэша профилей"""
+        return self._cache.stats()
+
+
+class ConsultationRepository:
+    """Консультации (таблица consultations)"""
+
+    table = 'consultations'
+
+    async def create(self, consultation_data: dict):
+        """Сохраняет консультацию"""
+        await _execute(lambda client: client.table(self.table).insert(consultation_data), f"{self.table}.insert")
+
+    async def list_by_user(self, user_id: int, limit: int = 20) -> list[dict]:
+        """Последние консультации пользователя"""
+        response = await _execute(
+            lambda client: client.table(self.table).select('*')
+            .eq('user_id', user_id)
+            .order('created_at', desc=True)
+            .limit(limit),
+            f"{self.table}.select"
+        )
+        return response.data or []
+
+    async def list_recent(self, limit: int = 1000) -> list[dict]:
+        """Последние консультации всех пользователей (для обучения моделей)"""
+        response = await _execute(
+            lambda client: client.table(self.table)
+            .select('id, symptoms, recommended_doctor, urgency_level, label_source')
+            .order('created_at', desc=True)
+            .limit(limit),
+            f"{self.table}.select"
+        )
+        return response.data or []
+
+
+class MessageRepository:
+    """История сообщений (таблица messages)"""
+
+    table = 'messages'
+
+    async def create(self, message_data: dict):
+        """Сохраняет сообщение"""
+        await _execute(lambda client: client.table(self.table).insert(message_data), f"{self.table}.insert")
+
+    async def list_by_consultation(self, consultation_id: int) -> list[dict]:
+        """Сообщения консультации в хронологическом порядке"""
+        response = await _execute(
+            lambda client: client.table(self.table).select('*')
+            .eq('consultation_id', consultation_id)
+            .order('created_at'),
+            f"{self.table}.select"
+        )
+        return response.data or []
+
+
+profiles = ProfileRepository()
+consultations = ConsultationRepository()
+messages = MessageRepository()
@@ -1,12 +1,33 @@
 import asyncio
+import hmac
 import logging
+import signal
 from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, PORT, SUGGESTIONS_HISTORY_LIMIT,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WORKERS, OUTBOUND_GLOBAL_RATE,
+    METRICS_TOKEN
+)
 from bot.handlers import basic, profile, consultation, specialists
+from bot.fsm_storage import create_storage, RedisFSMStorage
+from bot.middlewares import (
+    UpdateDeduplicationMiddleware, ChatOrderingMiddleware,
+    OutboundLimiter, OutboundRateLimitMiddleware,
+    UpdateMetricsMiddleware, HandlerMetricsMiddleware, BotApiTimingMiddleware
+)
+from bot.sessions import SessionManager, SessionActivityMiddleware
+from bot.sharding import ShardFront, run_worker
+from database.connection import close_supabase_client
+from bot.edit_coalescer import edit_coalescer
+from database.repository import consultations, db_stats
+from services.metrics import PrometheusWriter, metrics, loop_lag, write_registry
+from services.speculation import speculative_tasks
+from services.symptom_suggestions import symptom_suggester
 
 
 # Настройка логирования
@@ -23,7 +44,40 @@ bot = Bot(
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 
-dp = Dispatcher()
+# Время запросов к Bot API (вместе с ожиданием лимитов) - в метрики обработчиков
+bot.session.middleware(BotApiTimingMiddleware())
+
+# Исходящие сообщения - через токен-бакеты (на чат и общий) с учётом 429;
+# в многопроцессном режиме общий лимит делится между воркерами
+outbound = OutboundRateLimitMiddleware(OutboundLimiter(global_rate=OUTBOUND_GLOBAL_RATE / WORKERS))
+bot.session.middleware(outbound)
+
+dp = Dispatcher(storage=create_storage())
+
+# Метрики: полное время обновления и учёт ожиданий LLM, БД и Bot API
+dp.update.outer_middleware(UpdateMetricsMiddleware())
+
+# Обновления одного чата - строго по очереди, разных чатов - параллельно.
+# Раньше всех middleware с await (dedup ходит в Redis): место в очереди чата
+# занимается в порядке поступления обновлений
+ordering = ChatOrderingMiddleware()
+dp.update.outer_middleware(ordering)
+
+# Повторы одного update_id (ретраи вебхука, несколько реплик) не обрабатываются;
+# с Redis-хранилищем проверка общая для всех реплик
+dedup = UpdateDeduplicationMiddleware(
+    redis=dp.storage.redis if isinstance(dp.storage, RedisFSMStorage) else None
+)
+dp.update.outer_middleware(dedup)
+
+# Учёт активности и очистка брошенных сессий
+sessions = SessionManager(dp.storage)
+dp.update.outer_middleware(SessionActivityMiddleware(sessions))
+
+# Время обработчиков по имени и состоянию FSM (действует на все роутеры)
+handler_metrics = HandlerMetricsMiddleware()
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
 
 
 # Регистрация роутеров (ПОРЯДОК ВАЖЕН!)
@@ -39,14 +93,169 @@ async def health_check(request):
     return web.Response(text="OK", status=200)
 
 
+def write_process_metrics(writer: PrometheusWriter):
+    """
+    Метрики этого процесса: реестр (обработчики, LLM, БД, цикл событий)
+    и счётчики компонентов. Только данные в памяти, без запросов к хранилищу FSM и БД
+    """
+    write_registry(writer, metrics, loop_lag)
+
+    session_stats = sessions.stats()
+    writer.gauge(
+        "fsm_sessions_live", "FSM sessions with a state, as of the last sweep (shared storage: whole storage)",
+        [({}, session_stats['live'])]
+    )
+    writer.gauge(
+        "fsm_sessions_bytes", "Approximate FSM state and data size in bytes, as of the last sweep",
+        [({}, session_stats['bytes'])]
+    )
+    writer.gauge(
+        "fsm_sessions_tracked", "Chats tracked for idle eviction (MemoryStorage only)",
+        [({}, session_stats['tracked'])]
+    )
+    writer.counter("fsm_sessions_evicted", "Idle FSM sessions evicted", [({}, session_stats['evicted'])])
+    writer.counter(
+        "fsm_sessions_timeout_notified", "Users notified about session timeout", [({}, session_stats['notified'])]
+    )
+
+    outbound_stats = outbound.stats()
+    writer.gauge(
+        "outbound_queue_depth", "Outgoing Bot API requests waiting for rate limit, by priority lane",
+        [({'priority': priority}, depth) for priority, depth in outbound_stats['queue_depth'].items()]
+    )
+    writer.counter(
+        "outbound_requests", "Rate-limited Bot API requests by result",
+        [({'result': result}, outbound_stats[result]) for result in ('sent', 'retried', 'failed')]
+    )
+
+    ordering_stats = ordering.stats()
+    writer.gauge("chat_queue_updates", "Updates waiting in per-chat queues", [({}, ordering_stats['queued'])])
+    writer.counter("chat_queue_dropped", "Updates dropped on full chat queue", [({}, ordering_stats['dropped'])])
+
+    dedup_stats = dedup.stats()
+    writer.counter("updates_duplicate", "Duplicate updates dropped", [({}, dedup_stats['dropped'])])
+    writer.gauge("dedup_tracked_updates", "update_ids remembered for deduplication", [({}, dedup_stats['tracked'])])
+
+    database = db_stats()
+    writer.counter("db_queries", "Database queries", [({}, database['queries'])])
+
+    profile_cache = database['profile_cache']
+    llm_cache = consultation.ai_service.cache_stats()
+    cache_requests = [
+        ({'cache': 'profiles', 'result': 'hit'}, profile_cache['hits']),
+        ({'cache': 'profiles', 'result': 'miss'}, profile_cache['misses'])
+    ]
+    cache_entries = [({'cache': 'profiles'}, profile_cache['size'])]
+    if llm_cache:
+        cache_requests += [
+            ({'cache': 'llm', 'result': 'memory_hit'}, llm_cache['memory_hits']),
+            ({'cache': 'llm', 'result': 'disk_hit'}, llm_cache['disk_hits']),
+            ({'cache': 'llm', 'result': 'miss'}, llm_cache['misses'])
+        ]
+        cache_entries.append(({'cache': 'llm'}, llm_cache['memory_size']))
+    writer.counter("cache_requests", "Cache lookups by cache and result", cache_requests)
+    writer.gauge("cache_entries", "Entries in in-memory caches", cache_entries)
+
+    ai_stats = consultation.ai_service.call_stats()
+    writer.gauge("llm_inflight_requests", "Groq requests in flight", [({}, ai_stats['inflight'])])
+    writer.counter(
+        "classifier_recommendations", "Recommendations answered by the local classifier",
+        [
+            ({'path': 'fast'}, ai_stats['classifier_answers']),
+            ({'path': 'fallback'}, ai_stats['classifier_fallbacks'])
+        ]
+    )
+
+    suggester_stats = symptom_suggester.stats()
+    writer.counter(
+        "symptom_suggestions", "Additional-symptom lookups in consultation history by result",
+        [({'result': result}, suggester_stats[result]) for result in ('suggested', 'cold_start', 'low_confidence')]
+    )
+    writer.gauge(
+        "symptom_suggester_consultations", "Consultations in the suggestion model",
+        [({}, suggester_stats['consultations'])]
+    )
+
+    speculation_stats = speculative_tasks.stats()
+    writer.counter(
+        "speculative_tasks", "Speculative tasks by event",
+        [({'event': event}, speculation_stats[event]) for event in ('started', 'used', 'cancelled')]
+    )
+    writer.gauge("speculative_tasks_active", "Speculative tasks held", [({}, speculation_stats['tasks'])])
+
+    edit_stats = edit_coalescer.stats()
+    writer.counter(
+        "keyboard_edits", "Symptom keyboard edits by result",
+        [
+            ({'result': result}, edit_stats[result])
+            for result in ('scheduled', 'sent', 'coalesced', 'not_modified', 'retry_after', 'failed')
+        ]
+    )
+    writer.gauge("keyboard_edits_pending", "Keyboard edits waiting to be sent", [({}, edit_stats['pending'])])
+
+
+def collect_process_metrics() -> list[dict]:
+    """Семейства метрик процесса-воркера для отчёта фронту"""
+    writer = PrometheusWriter(prefix="medbot_")
+    write_process_metrics(writer)
+    return writer.families()
+
+
+def metrics_handler(front: ShardFront = None):
+    """
+    aiohttp-обработчик метрик в текстовом формате Prometheus
+
+    Собираются только из счётчиков в памяти, поэтому /metrics можно
+    опрашивать каждые несколько секунд. В многопроцессном режиме
+    (WORKERS > 1) к метрикам фронта (worker="front") добавляются
+    последние отчёты воркеров с меткой их номера.
+    """
+    async def handle(request):
+        if METRICS_TOKEN and not hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+        ):
+            return web.Response(text="Unauthorized", status=401)
+
+        writer = PrometheusWriter(prefix="medbot_")
+        if front is None:
+            write_process_metrics(writer)
+        else:
+            writer.merge(collect_process_metrics(), {'worker': 'front'})
+            front.write_metrics(writer)
+        return web.Response(text=writer.text(), headers={"Content-Type": PrometheusWriter.CONTENT_TYPE})
+
+    return handle
+
+
+async def start_services():
+    """Фоновые службы, общие для polling и webhook"""
+    # История для подбора симптомов загружается в фоне, не задерживая старт
+    asyncio.create_task(
+        symptom_suggester.load(consultations.list_recent, SUGGESTIONS_HISTORY_LIMIT)
+    )
+    sessions.start(bot)
+    loop_lag.start()
+
+
+async def stop_services():
+    """Закрывает соединения и фоновые задачи"""
+    await sessions.stop()
+    await consultation.ai_service.close()
+    await close_supabase_client()
+    await dp.storage.close()
+    await bot.session.close()
+
+
 async def start_bot():
-    """Запуск бота"""
+    """Запуск бота (long polling)"""
     try:
         logger.info("Starting bot...")
         
         # Удаляем старые вебхуки (если есть)
         await bot.delete_webhook(drop_pending_updates=True)
         
+        await start_services()
+        
         # Запускаем polling
         logger.info("Bot started successfully!")
         await dp.start_polling(bot)
@@ -55,34 +264,119 @@ async def start_bot():
         logger.error(f"Error starting bot: {e}")
         raise
     finally:
+        await stop_services()
+
+
+async def register_webhook():
+    """Устанавливает вебхук на WEBHOOK_URL + WEBHOOK_PATH с секретом реплик"""
+    url = f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}"
+    await bot.set_webhook(
+        url=url,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info(f"Webhook set: {url}")
+
+
+async def start_webhook():
+    """Запуск бота (webhook): обновления приходят на веб-сервер"""
+    try:
+        logger.info("Starting bot (webhook)...")
+        await start_services()
+        await register_webhook()
+        
+        # Вебхук не удаляем при остановке: новый экземпляр (редеплой)
+        # сразу переустановит его, а обновления подождут в очереди Telegram
+        await asyncio.Event().wait()
+        
+    except Exception as e:
+        logger.error(f"Error starting bot: {e}")
+        raise
+    finally:
+        await stop_services()
+
+
+def worker_process(index: int, address: str):
+    """Точка входа процесса-воркера (многопроцессный режим)"""
+    try:
+        asyncio.run(run_worker(index, address, bot, dp, start_services, stop_services, collect_process_metrics))
+    except KeyboardInterrupt:
+        pass
+
+
+async def start_sharded(front: ShardFront):
+    """
+    Многопроцессный режим: этот процесс только принимает обновления
+    и раздаёт их воркерам. SIGHUP - поочерёдный мягкий перезапуск воркеров.
+    """
+    try:
+        logger.info(f"Starting bot with {WORKERS} workers...")
+        await front.start()
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGHUP, lambda: asyncio.create_task(front.restart())
+        )
+        
+        if BOT_MODE == "webhook":
+            await register_webhook()
+            await asyncio.Event().wait()
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            logger.info("Bot started successfully!")
+            await front.poll(bot, dp.resolve_used_update_types())
+        
+    except Exception as e:
+        logger.error(f"Error starting bot: {e}")
+        raise
+    finally:
+        await front.stop()
         await bot.session.close()
 
 
-async def start_web_server():
+async def start_web_server(front: ShardFront = None):
     """Запуск веб-сервера для Render"""
     app = web.Application()
     app.router.add_get('/health', health_check)
     app.router.add_get('/', health_check)
+    app.router.add_get('/metrics', metrics_handler(front))
+    
+    if front is not None:
+        app.router.add_get('/workers', front.workers_handler)
+        if BOT_MODE == "webhook":
+            app.router.add_post(WEBHOOK_PATH, front.webhook_handler(WEBHOOK_SECRET))
+    elif BOT_MODE == "webhook":
+        # Telegram получает 200 сразу, обновление обрабатывается в фоне:
+        # медленный запрос к AI не вызовет повторной доставки
+        SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=WEBHOOK_SECRET,
+            handle_in_background=True
+        ).register(app, path=WEBHOOK_PATH)
     
     runner = web.AppRunner(app)
     await runner.setup()
     
     # Render использует порт из переменной окружения PORT
-    import os
-    port = int(os.getenv('PORT', 8080))
-    
-    site = web.TCPSite(runner, '0.0.0.0', port)
+    site = web.TCPSite(runner, '0.0.0.0', PORT)
     await site.start()
     
-    logger.info(f"Web server started on port {port}")
+    # Задержка цикла событий процесса, который отдаёт /metrics
+    loop_lag.start()
+    
+    logger.info(f"Web server started on port {PORT}")
 
 
 async def main():
     """Главная функция"""
     # Запускаем веб-сервер и бота параллельно
+    if WORKERS > 1:
+        front = ShardFront(WORKERS, worker_process)
+        await asyncio.gather(start_web_server(front), start_sharded(front))
+        return
+    
     await asyncio.gather(
         start_web_server(),
-        start_bot()
+        start_webhook() if BOT_MODE == "webhook" else start_bot()
     )
 
 
@@ -1,44 +1,220 @@
-import os
+import asyncio
 import json
 import re
-from groq import Groq
+import time
+from typing import Optional
+
+import httpx
+from groq import AsyncGroq
+from pydantic import BaseModel, ValidationError
+
+from config import (
+    GROQ_API_KEY, AI_MAX_CONCURRENCY, AI_SPECULATIVE_CONCURRENCY, AI_TIMEOUT, AI_RECOMMEND_TIMEOUT,
+    CLASSIFIER_PATH, CLASSIFIER_CONFIDENCE,
+    LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_TTL,
+    LLM_CACHE_MEMORY_SIZE, LLM_CACHE_MAX_ROWS
+)
+from .llm_cache import LLMCache
+from .metrics import metrics, timed
+from .specialist_classifier import load_classifier
+from .speculation import SpeculationSkipped, is_speculative
+
+
+# Специалисты, которых может рекомендовать бот
+SPECIALISTS = [
+    "Кардиолог", "Невролог", "Гастроэнтеролог", "Эндокринолог", 
+    "Пульмонолог", "Уролог", "Гинеколог", "Дерматолог", 
+    "Офтальмолог", "Отоларинголог (ЛОР)", "Ортопед-травматолог", 
+    "Ревматолог", "Аллерголог-иммунолог", "Психиатр", "Онколог", 
+    "Хирург", "Проктолог", "Маммолог", "Нефролог", "Терапевт"
+]
+
+
+class SymptomsCheck(BaseModel):
+    """Схема ответа объединённой проверки и улучшения симптомов"""
+    is_valid: bool
+    reason: str = ""
+    improved_text: str = ""
+
+
+# Общий пул HTTP-соединений к Groq (один на процесс)
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Возвращает общий асинхронный HTTP-клиент с пулом соединений"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=AI_MAX_CONCURRENCY + AI_SPECULATIVE_CONCURRENCY,
+                max_keepalive_connections=AI_MAX_CONCURRENCY + AI_SPECULATIVE_CONCURRENCY
+            ),
+            timeout=AI_TIMEOUT
+        )
+    return _http_client
 
 
 class AIService:
     """Сервис для работы с Groq AI"""
     
-    def __init__(self):
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    def __init__(self, max_concurrency: int = AI_MAX_CONCURRENCY,
+                 speculative_concurrency: int = AI_SPECULATIVE_CONCURRENCY):
+        self.client = AsyncGroq(
+            api_key=GROQ_API_KEY,
+            http_client=get_http_client(),
+            timeout=AI_TIMEOUT
+        )
         self.model = "llama-3.1-8b-instant"
+        # Ограничение числа одновременных запросов к Groq
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Спекулятивные запросы - в своём бюджете, без очереди
+        self._speculative_limit = speculative_concurrency
+        self._speculative_active = 0
+        # Кэш ответов (память + диск)
+        self.cache = LLMCache(
+            path=LLM_CACHE_PATH,
+            ttl=LLM_CACHE_TTL,
+            memory_size=LLM_CACHE_MEMORY_SIZE,
+            max_rows=LLM_CACHE_MAX_ROWS
+        ) if LLM_CACHE_ENABLED else None
+        # Идущие запросы к Groq по ключу (single-flight)
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._stats = {
+            'requests': 0, 'cache_hits': 0, 'coalesced': 0, 'llm_calls': 0, 'errors': 0,
+            'speculation_skipped': 0,
+            'classifier_answers': 0, 'classifier_fallbacks': 0
+        }
+        # Локальный классификатор специалиста (быстрый путь и запасной вариант)
+        self.classifier = load_classifier(CLASSIFIER_PATH)
+    
+    async def close(self):
+        """Закрывает HTTP-соединения с Groq и кэш"""
+        await self.client.close()
+        if self.cache:
+            self.cache.close()
     
-    def _call_ai(self, system_prompt: str, user_message: str, temperature: float = 0.7) -> str:
+    def cache_stats(self) -> dict:
+        """Статистика кэша ответов"""
+        return self.cache.stats() if self.cache else {}
+    
+    async def _call_ai(self, system_prompt: str, user_message: str, temperature: float = 0.7,
+                       method: str = "unknown") -> str:
         """
         Базовый метод для вызова AI
         
+        Одинаковые одновременные запросы (тот же ключ кэша) объединяются:
+        в Groq уходит один запрос, его результат получают все вызвавшие.
+        
         Args:
             system_prompt: Системный промпт
             user_message: Сообщение пользователя
             temperature: Температура генерации (0-1)
+            method: Метод AIService, от имени которого идёт вызов (для метрик)
         
         Returns:
             Ответ от AI
         """
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=temperature,
-                max_tokens=1024
+        # Ожидание ответа (из кэша, общего или своего запроса) - время "llm" обновления
+        with timed("llm"):
+            return await self._resolve_ai(system_prompt, user_message, temperature, method)
+    
+    async def _resolve_ai(self, system_prompt: str, user_message: str, temperature: float, method: str) -> str:
+        """Ответ из кэша, из уже идущего запроса или новым запросом к Groq"""
+        self._stats['requests'] += 1
+        key = LLMCache.make_key(self.model, system_prompt, user_message, temperature)
+        
+        if self.cache:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                self._stats['cache_hits'] += 1
+                metrics.record_llm_call(method, "cache_hit")
+                return cached
+        
+        task = self._inflight.get(key)
+        if task is None:
+            speculative = is_speculative()
+            if speculative:
+                # Спекуляция не ждёт и не занимает места обычных запросов:
+                # при занятом бюджете она просто не выполняется
+                if self._speculative_active >= self._speculative_limit:
+                    self._stats['speculation_skipped'] += 1
+                    metrics.record_llm_call(method, "speculation_skipped")
+                    raise SpeculationSkipped(method)
+                self._speculative_active += 1
+            task = asyncio.create_task(
+                self._request_ai(key, system_prompt, user_message, temperature, method, speculative)
             )
-            return response.choices[0].message.content.strip()
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            if speculative:
+                task.add_done_callback(self._release_speculative)
+        else:
+            self._stats['coalesced'] += 1
+            metrics.record_llm_call(method, "coalesced")
+        
+        # shield: отмена одного из ожидающих не отменяет общий запрос
+        return await asyncio.shield(task)
+    
+    async def _request_ai(self, key: str, system_prompt: str, user_message: str, temperature: float,
+                          method: str, speculative: bool = False) -> str:
+        """Выполняет запрос к Groq и кэширует ответ"""
+        self._stats['llm_calls'] += 1
+        try:
+            if speculative:
+                # Место в бюджете спекуляции уже занято в _resolve_ai
+                response = await self._create_completion(system_prompt, user_message, temperature, method)
+            else:
+                async with self._semaphore:
+                    response = await self._create_completion(system_prompt, user_message, temperature, method)
+            content = response.choices[0].message.content.strip()
         except Exception as e:
+            self._stats['errors'] += 1
+            metrics.record_llm_call(method, "error")
             print(f"AI Error: {e}")
             return ""
+        
+        # Пустые ответы не кэшируем
+        if self.cache and content:
+            await self.cache.set(key, content)
+        
+        return content
+    
+    def _release_speculative(self, _task: asyncio.Task):
+        self._speculative_active -= 1
+    
+    async def _create_completion(self, system_prompt: str, user_message: str, temperature: float, method: str):
+        started = time.perf_counter()
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            temperature=temperature,
+            max_tokens=1024
+        )
+        metrics.record_llm_request(method, time.perf_counter() - started, response.usage)
+        return response
+    
+    def call_stats(self) -> dict:
+        """
+        Статистика вызовов
+        
+        Returns:
+            {
+                'requests': всего вызовов _call_ai,
+                'cache_hits': ответов из кэша,
+                'coalesced': запросов, присоединившихся к уже идущему,
+                'llm_calls': реальных запросов к Groq,
+                'errors': ошибок Groq,
+                'speculation_skipped': спекулятивных вызовов, не выполненных из-за бюджета,
+                'inflight': запросов в работе сейчас
+            }
+        """
+        return {**self._stats, 'inflight': len(self._inflight)}
     
-    def validate_symptoms(self, text: str) -> dict:
+    async def validate_symptoms(self, text: str) -> dict:
         """
         Проверяет, описывает ли текст медицинские симптомы
         
@@ -76,7 +252,7 @@ class AIService:
 
         user_message = f"Проверь, описывает ли это симптомы:\n\n{text}"
         
-        response = self._call_ai(system_prompt, user_message, temperature=0.3)
+        response = await self._call_ai(system_prompt, user_message, temperature=0.3, method="validate_symptoms")
         
         try:
             # Извлекаем JSON из ответа
@@ -98,7 +274,7 @@ class AIService:
             'reason': 'Не удалось распознать симптомы'
         }
     
-    def improve_symptoms_text(self, text: str) -> str:
+    async def improve_symptoms_text(self, text: str) -> str:
         """
         Окультуривает и улучшает описание симптомов от пользователя
         
@@ -134,7 +310,7 @@ class AIService:
 
         user_message = f"Улучши описание симптомов:\n\n{text}"
         
-        response = self._call_ai(system_prompt, user_message, temperature=0.3)
+        response = await self._call_ai(system_prompt, user_message, temperature=0.3, method="improve_symptoms_text")
         
         # Очищаем ответ от лишнего
         improved = response.strip()
@@ -153,13 +329,112 @@ class AIService:
         
         return improved if improved else text
     
-    def generate_additional_symptoms(self, main_symptoms: str, duration: str) -> list[str]:
+    async def check_and_improve_symptoms(self, text: str) -> dict:
+        """
+        Проверяет и улучшает описание симптомов одним запросом к AI
+        
+        Args:
+            text: Текст от пользователя
+        
+        Returns:
+            {
+                'is_valid': bool,  # True если это симптомы
+                'reason': str,     # Причина, если невалидно
+                'improved': str,   # Улучшенный текст симптомов
+                'pipeline': str    # "combined" или "combined_fallback" (ответ не по схеме,
+                                   # результат получен раздельными запросами)
+            }
+        """
+        system_prompt = """Ты медицинский ассистент и редактор. Выполни две задачи:
+
+1. ПРОВЕРЬ, описывает ли пользователь медицинские симптомы или жалобы на здоровье.
+СИМПТОМЫ - это физические ощущения (боль, температура, слабость, тошнота и т.д.), изменения в состоянии здоровья, видимые проявления (сыпь, отек, покраснение), нарушения функций организма.
+НЕ СИМПТОМЫ - рецепты, инструкции, вопросы не о здоровье, случайный текст, просьбы что-то сделать.
+
+2. ЕСЛИ это симптомы - УЛУЧШИ описание для врача:
+- Исправь грамматические и орфографические ошибки
+- Структурируй информацию логично, используй правильные медицинские термины
+- Сохрани ВСЮ важную информацию (локализация боли, интенсивность, время и т.д.)
+- Убери лишние слова ("типа", "как бы", "ну вот" и т.д.)
+- НЕ добавляй информацию, которой нет в оригинале, НЕ ставь диагнозы
+
+Пример улучшения:
+Исходно: "у меня как бы голова болит и типа в висках стреляет уже 2 день"
+Улучшено: "Головная боль в области висков, стреляющего характера. Беспокоит в течение 2 дней."
+
+Ответь СТРОГО в JSON формате:
+{
+    "is_valid": true/false,
+    "reason": "почему невалидно" или "",
+    "improved_text": "улучшенное описание симптомов" или ""
+}"""
+
+        user_message = f"Проверь и улучши описание симптомов:\n\n{text}"
+        
+        response = await self._call_ai(
+            system_prompt, user_message, temperature=0.3, method="check_and_improve_symptoms"
+        )
+        
+        if not response:
+            return {
+                'is_valid': False, 'reason': 'Не удалось распознать симптомы', 'improved': '',
+                'pipeline': 'combined'
+            }
+        
+        try:
+            json_match = re.search(r'\{.*\}', response, re.DOTALL)
+            if json_match:
+                result = SymptomsCheck.model_validate_json(json_match.group())
+                if result.is_valid:
+                    return {
+                        'is_valid': True,
+                        'reason': '',
+                        'improved': result.improved_text.strip() or text,
+                        'pipeline': 'combined'
+                    }
+                return {
+                    'is_valid': False,
+                    'reason': result.reason or 'Не удалось распознать симптомы',
+                    'improved': '',
+                    'pipeline': 'combined'
+                }
+        except ValidationError as e:
+            print(f"JSON Schema Error: {e}")
+        
+        # Ответ не соответствует схеме - используем раздельные запросы,
+        # но помечаем результат, чтобы не смешивать его с группой "split"
+        result = await self.analyze_symptoms(text, pipeline="split")
+        return {**result, 'pipeline': 'combined_fallback'}
+    
+    async def analyze_symptoms(self, text: str, pipeline: str = "combined") -> dict:
+        """
+        Проверка и улучшение симптомов выбранным способом
+        
+        Args:
+            text: Текст от пользователя
+            pipeline: "combined" - один запрос, "split" - проверка, затем улучшение
+        
+        Returns:
+            Словарь как у check_and_improve_symptoms; 'pipeline' - способ,
+            которым фактически получен результат ("combined", "split", "combined_fallback")
+        """
+        if pipeline == "combined":
+            return await self.check_and_improve_symptoms(text)
+        
+        validation = await self.validate_symptoms(text)
+        if not validation['is_valid']:
+            return {'is_valid': False, 'reason': validation['reason'], 'improved': '', 'pipeline': 'split'}
+        
+        improved = await self.improve_symptoms_text(text)
+        return {'is_valid': True, 'reason': '', 'improved': improved, 'pipeline': 'split'}
+    
+    async def generate_additional_symptoms(self, main_symptoms: str, duration: Optional[str] = None) -> list[str]:
         """
         Генерирует список дополнительных симптомов для уточнения
         
         Args:
             main_symptoms: Основные симптомы пользователя
-            duration: Давность симптомов
+            duration: Давность симптомов (None - без учёта давности)
         
         Returns:
             Список из 8-10 релевантных симптомов
@@ -193,12 +468,14 @@ class AIService:
 Формат ответа: JSON массив строк ТОЛЬКО на русском языке
 ["симптом 1", "симптом 2", ..., "симптом 8"]"""
 
+        duration_line = f"Давность: {duration}\n" if duration else ""
         user_message = f"""Основные симптомы: {main_symptoms}
-Давность: {duration}
-
+{duration_line}
 Предложи 8-10 дополнительных симптомов для уточнения НА РУССКОМ ЯЗЫКЕ (не украинском, не английском)."""
 
-        response = self._call_ai(system_prompt, user_message, temperature=0.7)
+        response = await self._call_ai(
+            system_prompt, user_message, temperature=0.7, method="generate_additional_symptoms"
+        )
         
         print(f"DEBUG AI: Raw response length: {len(response)}")
         print(f"DEBUG AI: First 200 chars: {response[:200]}")
@@ -260,7 +537,40 @@ class AIService:
         
         return filtered[:10]  # Максимум 10 симптомов
     
-    def recommend_doctor(self, 
+    def _classify(self, main_symptoms: str, additional_symptoms: list[str]) -> Optional[dict]:
+        """
+        Рекомендация локальной модели
+        
+        Returns:
+            {'recommendation': dict как у recommend_doctor, 'confident': bool}
+            или None, если модели нет
+        """
+        if self.classifier is None:
+            return None
+        
+        specialist, urgency = self.classifier.predict(' '.join([main_symptoms, *additional_symptoms]))
+        if specialist is None or specialist.label not in SPECIALISTS:
+            return None
+        
+        # Без уверенной оценки срочности ответ модели годится только как запасной
+        confident = (
+            specialist.confidence >= CLASSIFIER_CONFIDENCE
+            and urgency is not None
+            and urgency.confidence >= CLASSIFIER_CONFIDENCE
+        )
+        return {
+            'confident': confident,
+            'recommendation': {
+                'specialist': specialist.label,
+                'urgency': urgency.label if urgency else 'medium',
+                'reasoning': (
+                    f"Описанные симптомы характерны для обращений к специалисту "
+                    f"«{specialist.label}». Рекомендуется очная консультация для осмотра."
+                )
+            }
+        }
+    
+    async def recommend_doctor(self, 
                         main_symptoms: str, 
                         duration: str, 
                         additional_symptoms: list[str],
@@ -278,17 +588,15 @@ class AIService:
             {
                 'specialist': 'Название специалиста',
                 'urgency': 'low'|'medium'|'high'|'emergency',
-                'reasoning': 'Обоснование'
+                'reasoning': 'Обоснование',
+                'source': 'llm'|'classifier'|'classifier_fallback'|'default'
             }
         """
-        # Список доступных специалистов
-        specialists = [
-            "Кардиолог", "Невролог", "Гастроэнтеролог", "Эндокринолог", 
-            "Пульмонолог", "Уролог", "Гинеколог", "Дерматолог", 
-            "Офтальмолог", "Отоларинголог (ЛОР)", "Ортопед-травматолог", 
-            "Ревматолог", "Аллерголог-иммунолог", "Психиатр", "Онколог", 
-            "Хирург", "Проктолог", "Маммолог", "Нефролог", "Терапевт"
-        ]
+        # Быстрый путь: уверенный ответ локальной модели, без AI
+        local = self._classify(main_symptoms, additional_symptoms)
+        if local and local['confident']:
+            self._stats['classifier_answers'] += 1
+            return {**local['recommendation'], 'source': 'classifier'}
         
         system_prompt = f"""Ты опытный врач-терапевт. На основе симптомов пациента:
 1. Определи наиболее подходящего специалиста из списка
@@ -296,7 +604,7 @@ class AIService:
 3. Кратко объясни почему
 
 ДОСТУПНЫЕ СПЕЦИАЛИСТЫ:
-{', '.join(specialists)}
+{', '.join(SPECIALISTS)}
 
 УРОВНИ СРОЧНОСТИ:
 - emergency: Требуется скорая помощь (угроза жизни)
@@ -329,7 +637,14 @@ class AIService:
 
 Определи специалиста и срочность."""
 
-        response = self._call_ai(system_prompt, user_message, temperature=0.3)
+        try:
+            response = await asyncio.wait_for(
+                self._call_ai(system_prompt, user_message, temperature=0.3, method="recommend_doctor"),
+                timeout=AI_RECOMMEND_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            print("AI Error: recommend_doctor timed out")
+            response = ""
         
         try:
             # Извлекаем JSON
@@ -339,20 +654,27 @@ class AIService:
                 
                 # Проверяем что специалист из списка
                 specialist = result.get('specialist', 'Терапевт')
-                if specialist not in specialists:
+                if specialist not in SPECIALISTS:
                     specialist = 'Терапевт'
                 
                 return {
                     'specialist': specialist,
                     'urgency': result.get('urgency', 'medium'),
-                    'reasoning': result.get('reasoning', '')
+                    'reasoning': result.get('reasoning', ''),
+                    'source': 'llm'
                 }
         except Exception as e:
             print(f"JSON Parse Error: {e}")
         
+        # AI недоступен или ответ не разобран - отвечает локальная модель
+        if local:
+            self._stats['classifier_fallbacks'] += 1
+            return {**local['recommendation'], 'source': 'classifier_fallback'}
+        
         # Возвращаем дефолт если не удалось
         return {
             'specialist': 'Терапевт',
             'urgency': 'medium',
-            'reasoning': 'Рекомендуется консультация терапевта для первичного осмотра.'
+            'reasoning': 'Рекомендуется консультация терапевта для первичного осмотра.',
+            'source': 'default'
         }
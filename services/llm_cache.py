@@ -0,0 +1,154 @@
+"""
+Кэш ответов LLM: память (TTL + LRU) + SQLite на диске
+
+Ключ - хэш от модели, системного промпта, нормализованного сообщения
+пользователя и температуры. Дисковый уровень переживает перезапуски,
+устаревшие и лишние записи вытесняются периодически.
+"""
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from .cache import TTLCache, MISSING
+
+
+logger = logging.getLogger(__name__)
+
+
+# Как часто (в записях) чистить дисковый кэш
+EVICT_EVERY = 100
+
+
+def normalize_text(text: str) -> str:
+    """Нормализует ввод: регистр и пробелы не влияют на ключ"""
+    return ' '.join(text.casefold().split())
+
+
+class LLMCache:
+    """Двухуровневый кэш ответов LLM"""
+
+    def __init__(self, path: str, ttl: float, memory_size: int, max_rows: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._memory = TTLCache(maxsize=memory_size, ttl=ttl)
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._writes = 0
+
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, user_message: str, temperature: float) -> str:
+        """Ключ кэша для запроса к LLM"""
+        prompt_hash = hashlib.sha256(system_prompt.encode()).hexdigest()
+        raw = f"{model}\x00{prompt_hash}\x00{normalize_text(user_message)}\x00{temperature:.2f}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    # ============ SQLITE (выполняется в отдельном потоке) ============
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._db_lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row:
+                db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                db.commit()
+        return row[0] if row else None
+
+    def _disk_set(self, key: str, value: str):
+        now = time.time()
+        with self._db_lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(db, now)
+            db.commit()
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        """Удаляет устаревшие записи и самые старые сверх max_rows"""
+        db.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl,))
+        db.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,)
+        )
+
+    # ============ ПУБЛИЧНЫЙ API ============
+
+    async def get(self, key: str) -> Optional[str]:
+        """Возвращает закэшированный ответ или None"""
+        value = self._memory.get(key)
+        if value is not MISSING:
+            return value
+
+        try:
+            value = await asyncio.to_thread(self._disk_get, key)
+        except Exception as e:
+            logger.warning("LLM cache error: %s", e)
+            value = None
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.disk_hits += 1
+        self._memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: str):
+        """Сохраняет ответ в оба уровня"""
+        self._memory.set(key, value)
+        try:
+            await asyncio.to_thread(self._disk_set, key, value)
+        except Exception as e:
+            logger.warning("LLM cache error: %s", e)
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        """Статистика попаданий по уровням"""
+        memory_hits = self._memory.hits
+        total = memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_size': len(self._memory),
+            'memory_hits': memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': (memory_hits + self.disk_hits) / total if total else 0.0,
+            'memory_hit_ratio': memory_hits / total if total else 0.0,
+            'disk_hit_ratio': self.disk_hits / total if total else 0.0
+        }
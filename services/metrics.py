@@ -0,0 +1,476 @@
+"""
+Метрики задержек: гистограммы по обработчикам и время ожидания LLM, БД и Bot API
+
+Гистограммы устроены как HdrHistogram: логарифмические интервалы, каждый
+поделен на равные части, поэтому относительная погрешность не больше ~3%
+на всём диапазоне (от микросекунд до часа), а запись значения - это
+вычисление индекса и инкремент счётчика, без выделения памяти.
+
+Время ожидания внешних сервисов копится в объекте текущего обновления
+(ContextVar): repository, AIService и сессия бота оборачивают свои вызовы
+в timed("db" | "llm" | "bot"), обработчики - ожидание спекулятивных задач
+(как "llm"), а middleware обработчика записывает итог.
+
+PrometheusWriter выводит метрики в текстовом формате Prometheus (см. /metrics).
+"""
+import asyncio
+import math
+import time
+from array import array
+from functools import lru_cache
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterable, Optional
+
+
+# Делений в каждом логарифмическом интервале: 2^SUB_BITS
+SUB_BITS = 5
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1
+
+# Значения хранятся в микросекундах; больше ~71 минуты - в последнем интервале
+MAX_VALUE = (1 << 32) - 1
+BUCKETS = (MAX_VALUE.bit_length() - SUB_BITS + 1) * HALF_COUNT + HALF_COUNT
+
+# Внешние зависимости, время ожидания которых учитывается отдельно
+DEPENDENCIES = ("llm", "db", "bot")
+
+# Границы бакетов гистограмм в /metrics (сек)
+PROMETHEUS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Как часто измерять задержку цикла событий (сек)
+LOOP_LAG_INTERVAL = 0.5
+
+
+def _index(value: int) -> int:
+    if value < SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return shift * HALF_COUNT + (value >> shift)
+
+
+def _bounds(index: int) -> tuple[int, int]:
+    """Границы интервала [lower, upper) в микросекундах"""
+    if index < SUB_COUNT:
+        return index, index + 1
+    shift = index // HALF_COUNT - 1
+    mantissa = index - shift * HALF_COUNT
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+@lru_cache(maxsize=16)
+def _cutoffs(bounds: tuple) -> tuple[int, ...]:
+    """Для каждой границы (сек) - сколько первых интервалов целиком не больше неё"""
+    result = []
+    index = 0
+    for bound in bounds:
+        limit = bound * 1_000_000
+        while index < BUCKETS and _bounds(index)[1] <= limit:
+            index += 1
+        result.append(index)
+    return tuple(result)
+
+
+class Histogram:
+    """Гистограмма длительностей (сек) с логарифмически-линейными интервалами"""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * BUCKETS))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        micros = min(int(seconds * 1_000_000), MAX_VALUE)
+        self.counts[_index(max(micros, 0))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """Значение перцентиля (сек); середина интервала, в который он попал"""
+        if not self.count:
+            return 0.0
+        target = max(1, round(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            if seen >= target:
+                lower, upper = _bounds(index)
+                return min((lower + upper) / 2 / 1_000_000, self.max)
+        return self.max
+
+    def cumulative(self, bounds: Iterable[float]) -> list[int]:
+        """Сколько значений не больше каждой границы (сек) - для бакетов Prometheus"""
+        result = []
+        seen = 0
+        start = 0
+        for end in _cutoffs(tuple(bounds)):
+            seen += sum(self.counts[start:end])
+            start = end
+            result.append(seen)
+        return result
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'p50_ms': round(self.percentile(0.5) * 1000, 3),
+            'p90_ms': round(self.percentile(0.9) * 1000, 3),
+            'p99_ms': round(self.percentile(0.99) * 1000, 3),
+            'max_ms': round(self.max * 1000, 3)
+        }
+
+
+# ============ ВРЕМЯ ОЖИДАНИЯ ЗАВИСИМОСТЕЙ ============
+
+class UpdateTimings:
+    """Сколько времени текущее обновление ждало LLM, БД и Bot API (сек)"""
+
+    __slots__ = ("waits", "closed")
+
+    def __init__(self):
+        self.waits = dict.fromkeys(DEPENDENCIES, 0.0)
+        # После записи метрик фоновые задачи обновления (спекуляция,
+        # отложенные правки) в его время уже не попадают
+        self.closed = False
+
+    def add(self, dependency: str, seconds: float):
+        if not self.closed:
+            self.waits[dependency] += seconds
+
+
+_current: ContextVar[Optional[UpdateTimings]] = ContextVar("update_timings", default=None)
+
+
+def begin_update() -> tuple[UpdateTimings, object]:
+    """Начинает учёт ожиданий для обновления; вернуть токен в end_update"""
+    timings = UpdateTimings()
+    return timings, _current.set(timings)
+
+
+def end_update(timings: UpdateTimings, token):
+    timings.closed = True
+    _current.reset(token)
+
+
+def current_timings() -> Optional[UpdateTimings]:
+    return _current.get()
+
+
+@contextmanager
+def timed(dependency: str):
+    """Засчитывает время блока with как ожидание зависимости текущим обновлением"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(dependency, time.perf_counter() - started)
+
+
+# ============ РЕЕСТР ============
+
+class HandlerStats:
+    """Метрики одного обработчика в одном состоянии FSM"""
+
+    __slots__ = ("wall", "waits", "errors")
+
+    def __init__(self):
+        self.wall = Histogram()
+        self.waits = {dependency: Histogram() for dependency in DEPENDENCIES}
+        self.errors = 0
+
+
+class MetricsRegistry:
+    """Метрики обновлений и обработчиков процесса"""
+
+    def __init__(self):
+        self.handlers: dict[tuple[str, str], HandlerStats] = {}
+        self.updates = Histogram()
+        self.update_errors = 0
+        self.unhandled = 0
+        # LLM по методам AIService: исходы вызовов, время запросов к Groq, токены
+        self.llm_calls: Counter = Counter()
+        self.llm_latency: dict[str, Histogram] = {}
+        self.llm_tokens: Counter = Counter()
+        # Проверка симптомов по способам (A/B): результат и полное время
+        self.pipeline_runs: Counter = Counter()
+        self.pipeline_latency: dict[str, Histogram] = {}
+        # Запросы к БД по операциям ("таблица.действие")
+        self.db_latency: dict[str, Histogram] = {}
+        self.db_errors: Counter = Counter()
+
+    def record_handler(self, handler: str, state: Optional[str], seconds: float,
+                       timings: Optional[UpdateTimings], error: bool = False):
+        key = (handler, state or "")
+        stats = self.handlers.get(key)
+        if stats is None:
+            stats = self.handlers[key] = HandlerStats()
+        stats.wall.record(seconds)
+        if timings is not None:
+            for dependency, waited in timings.waits.items():
+                stats.waits[dependency].record(waited)
+        if error:
+            stats.errors += 1
+
+    def record_update(self, seconds: float, handled: bool, error: bool = False):
+        self.updates.record(seconds)
+        if error:
+            self.update_errors += 1
+        elif not handled:
+            self.unhandled += 1
+
+    def record_llm_call(self, method: str, outcome: str):
+        """Вызов LLM без запроса к Groq (cache_hit, coalesced) или неудачный запрос (error)"""
+        self.llm_calls[(method, outcome)] += 1
+
+    def record_llm_request(self, method: str, seconds: float, usage: Any = None):
+        """Успешный запрос к Groq: время и токены из usage ответа"""
+        self.llm_calls[(method, "ok")] += 1
+        histogram = self.llm_latency.get(method)
+        if histogram is None:
+            histogram = self.llm_latency[method] = Histogram()
+        histogram.record(seconds)
+        if usage is not None:
+            self.llm_tokens[(method, "prompt")] += getattr(usage, "prompt_tokens", 0) or 0
+            self.llm_tokens[(method, "completion")] += getattr(usage, "completion_tokens", 0) or 0
+
+    def record_pipeline(self, pipeline: str, seconds: float, valid: bool):
+        """Проверка симптомов способом pipeline (combined, split, combined_fallback)"""
+        self.pipeline_runs[(pipeline, valid)] += 1
+        histogram = self.pipeline_latency.get(pipeline)
+        if histogram is None:
+            histogram = self.pipeline_latency[pipeline] = Histogram()
+        histogram.record(seconds)
+
+    def record_db(self, operation: str, seconds: float, error: bool = False):
+        histogram = self.db_latency.get(operation)
+        if histogram is None:
+            histogram = self.db_latency[operation] = Histogram()
+        histogram.record(seconds)
+        if error:
+            self.db_errors[operation] += 1
+
+    def snapshot(self) -> dict:
+        """Сводка: обработчики по убыванию суммарного времени"""
+        handlers = sorted(self.handlers.items(), key=lambda item: item[1].wall.total, reverse=True)
+        return {
+            'updates': {
+                **self.updates.summary(),
+                'errors': self.update_errors,
+                'unhandled': self.unhandled
+            },
+            'handlers': [
+                {
+                    'handler': handler,
+                    'state': state,
+                    **stats.wall.summary(),
+                    'total_s': round(stats.wall.total, 3),
+                    'errors': stats.errors,
+                    **{f'{dependency}_p50_ms': round(hist.percentile(0.5) * 1000, 3)
+                       for dependency, hist in stats.waits.items()},
+                    **{f'{dependency}_total_s': round(hist.total, 3)
+                       for dependency, hist in stats.waits.items()}
+                }
+                for (handler, state), stats in handlers
+            ]
+        }
+
+
+class EventLoopLagMonitor:
+    """Задержка цикла событий: насколько позже просыпается sleep(interval)"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.histogram = Histogram()
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - started - self.interval)
+            self.histogram.record(self.last)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# ============ PROMETHEUS ============
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class PrometheusWriter:
+    """
+    Текстовый формат Prometheus (version 0.0.4): семейство метрик за вызов
+
+    Семейства хранятся как данные (families), поэтому метрики воркеров
+    можно передать фронту и добавить к его выводу с меткой воркера (merge).
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        # имя -> {'name', 'type', 'help', 'samples': [[имя образца, метки, значение]]}
+        self._families: dict[str, dict] = {}
+
+    def _family(self, name: str, kind: str, help_text: str) -> list:
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = {'name': name, 'type': kind, 'help': help_text, 'samples': []}
+        return family['samples']
+
+    def gauge(self, name: str, help_text: str, series: Iterable[tuple[dict, float]]):
+        name = self.prefix + name
+        self._family(name, "gauge", help_text).extend([name, labels, value] for labels, value in series)
+
+    def counter(self, name: str, help_text: str, series: Iterable[tuple[dict, float]]):
+        # У счётчика и HELP/TYPE, и образцы - с суффиксом _total
+        name = f"{self.prefix}{name}_total"
+        self._family(name, "counter", help_text).extend([name, labels, value] for labels, value in series)
+
+    def histogram(self, name: str, help_text: str, series: Iterable[tuple[dict, Histogram]],
+                  buckets: tuple = PROMETHEUS_BUCKETS):
+        name = self.prefix + name
+        samples = self._family(name, "histogram", help_text)
+        for labels, histogram in series:
+            for bound, count in zip(buckets, histogram.cumulative(buckets)):
+                samples.append([f"{name}_bucket", {**labels, 'le': bound}, count])
+            samples.append([f"{name}_bucket", {**labels, 'le': '+Inf'}, histogram.count])
+            samples.append([f"{name}_sum", labels, histogram.total])
+            samples.append([f"{name}_count", labels, histogram.count])
+
+    def families(self) -> list[dict]:
+        """Семейства метрик (сериализуются в JSON)"""
+        return list(self._families.values())
+
+    def merge(self, families: Iterable[dict], labels: dict):
+        """Добавляет семейства другого процесса, дописывая к образцам метки labels"""
+        for family in families:
+            self._family(family['name'], family['type'], family['help']).extend(
+                [name, {**labels, **sample_labels}, value] for name, sample_labels, value in family['samples']
+            )
+
+    def text(self) -> str:
+        lines = []
+        for family in self._families.values():
+            lines.append(f"# HELP {family['name']} {family['help']}")
+            lines.append(f"# TYPE {family['name']} {family['type']}")
+            lines.extend(f"{name}{_labels(labels)} {_number(value)}" for name, labels, value in family['samples'])
+        return "\n".join(lines) + "\n"
+
+
+def write_registry(writer: PrometheusWriter, registry: "MetricsRegistry", loop_lag: "EventLoopLagMonitor"):
+    """Метрики обработчиков, LLM, БД и цикла событий"""
+    writer.histogram(
+        "update_duration_seconds", "Full update processing time",
+        [({}, registry.updates)]
+    )
+    writer.counter(
+        "update_errors", "Updates that raised an exception", [({}, registry.update_errors)]
+    )
+    writer.counter(
+        "updates_unhandled", "Updates no handler matched", [({}, registry.unhandled)]
+    )
+
+    handlers = list(registry.handlers.items())
+    writer.histogram(
+        "handler_duration_seconds", "Handler wall time by handler and FSM state",
+        [({'handler': handler, 'state': state}, stats.wall) for (handler, state), stats in handlers]
+    )
+    writer.histogram(
+        "handler_dependency_wait_seconds", "Time a handler's update spent awaiting LLM, DB and Bot API",
+        [
+            ({'handler': handler, 'state': state, 'dependency': dependency}, histogram)
+            for (handler, state), stats in handlers
+            for dependency, histogram in stats.waits.items()
+        ]
+    )
+    writer.counter(
+        "handler_errors", "Handler exceptions",
+        [({'handler': handler, 'state': state}, stats.errors) for (handler, state), stats in handlers]
+    )
+
+    writer.counter(
+        "llm_calls", "LLM calls by AIService method and outcome (ok, error, cache_hit, coalesced)",
+        [({'method': method, 'outcome': outcome}, count) for (method, outcome), count in registry.llm_calls.items()]
+    )
+    writer.histogram(
+        "llm_request_duration_seconds", "Groq request time by AIService method",
+        [({'method': method}, histogram) for method, histogram in registry.llm_latency.items()]
+    )
+    writer.counter(
+        "llm_tokens", "Tokens used by AIService method and kind",
+        [({'method': method, 'kind': kind}, count) for (method, kind), count in registry.llm_tokens.items()]
+    )
+
+    writer.counter(
+        "symptoms_pipeline_runs", "Symptom checks by pipeline arm (combined, split, combined_fallback) and result",
+        [
+            ({'pipeline': pipeline, 'valid': str(valid).lower()}, count)
+            for (pipeline, valid), count in registry.pipeline_runs.items()
+        ]
+    )
+    writer.histogram(
+        "symptoms_pipeline_duration_seconds", "Symptom check time by pipeline arm",
+        [({'pipeline': pipeline}, histogram) for pipeline, histogram in registry.pipeline_latency.items()]
+    )
+
+    writer.histogram(
+        "db_query_duration_seconds", "Database query time by operation",
+        [({'operation': operation}, histogram) for operation, histogram in registry.db_latency.items()]
+    )
+    writer.counter(
+        "db_query_errors", "Database query errors by operation",
+        [({'operation': operation}, count) for operation, count in registry.db_errors.items()]
+    )
+
+    writer.histogram(
+        "event_loop_lag_seconds", "Event loop wake-up delay", [({}, loop_lag.histogram)]
+    )
+    writer.gauge(
+        "event_loop_lag_last_seconds", "Last measured event loop delay", [({}, loop_lag.last)]
+    )
+
+
+metrics = MetricsRegistry()
+loop_lag = EventLoopLagMonitor()
@@ -0,0 +1,338 @@
+"""
+Локальный детектор "красных флагов" - признаков неотложных состояний
+
+Работает без AI и за микросекунды: текст разбивается на слова, слова
+приводятся к основе (упрощённый стеммер для русского языка) с исправлением
+одиночных опечаток, затем автомат Ахо-Корасик ищет в потоке основ фразы
+из словаря красных флагов.
+
+Неоднозначные фразы ("судороги", "не могу дышать") срабатывают только
+в уточняющем контексте: нужны слова из CONTEXT_REQUIRED и не должно быть
+слов из CONTEXT_EXCLUDED ("судороги в ногах по ночам", "не могу дышать носом").
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import permutations
+from typing import Optional
+
+
+# ============ СЛОВАРЬ КРАСНЫХ ФЛАГОВ ============
+
+# Категория -> (специалист, фразы)
+RED_FLAG_LEXICON = {
+    "Признаки сердечного приступа": ("Кардиолог", [
+        "боль в груди", "боль за грудиной", "давящая боль в груди",
+        "жжение в груди", "сдавливание в груди", "сжимает грудь",
+        "давит в груди", "боль в сердце", "боль отдает в левую руку",
+    ]),
+    "Признаки инсульта": ("Невролог", [
+        "перекосило лицо", "перекошено лицо", "асимметрия лица",
+        "онемела половина лица", "онемение половины лица", "онемение половины тела",
+        "онемела рука и нога", "не могу говорить", "не может говорить", "невнятная речь",
+        "нарушение речи", "заплетается язык", "внезапная слабость в руке",
+        "внезапная сильная головная боль", "худшая головная боль",
+    ]),
+    "Нарушение дыхания": ("Пульмонолог", [
+        "не могу дышать", "не может дышать", "не дышит", "не могу вдохнуть", "не может вдохнуть",
+        "задыхаюсь", "задыхается", "удушье",
+        "нехватка воздуха", "не хватает воздуха", "синие губы", "посинели губы",
+    ]),
+    "Нарушение сознания": ("Невролог", [
+        "потеря сознания", "потерял сознание", "потеряла сознание",
+        "обморок", "упал в обморок", "упала в обморок", "не приходит в себя",
+        "судороги", "судорожный приступ",
+    ]),
+    "Признаки кровотечения": ("Хирург", [
+        "сильное кровотечение", "кровотечение не останавливается",
+        "рвота кровью", "кровавая рвота", "кровь в рвоте",
+        "черный стул", "дегтеобразный стул", "кашель с кровью", "кровохарканье",
+    ]),
+    "Острый живот": ("Хирург", [
+        "кинжальная боль в животе", "острая боль в животе", "резкая боль в животе",
+        "твердый живот",
+    ]),
+    "Тяжёлая аллергическая реакция": ("Аллерголог-иммунолог", [
+        "отек горла", "отекло горло", "отек языка", "отек квинке", "анафилаксия",
+    ]),
+    "Признаки менингита": ("Невролог", [
+        "сыпь не исчезает при надавливании", "не могу наклонить голову",
+        "ригидность затылочных мышц",
+    ]),
+    "Угроза жизни": ("Психиатр", [
+        "мысли о самоубийстве", "покончить с собой", "суицид",
+    ]),
+}
+
+# Неоднозначные фразы срабатывают, только если в тексте есть хотя бы одно
+# из уточняющих слов...
+CONTEXT_REQUIRED = {
+    "судороги": [
+        "тело", "тела", "телу", "сознание", "сознания", "приступ",
+        "пена", "пеной", "ребенок", "ребенка", "эпилепсия", "трясет", "дергается",
+        "не реагирует", "температура", "температуре",
+    ],
+    "черный стул": [
+        "кровь", "крови", "слабость", "головокружение", "кружится", "обморок",
+        "рвота", "рвет", "бледность", "бледный", "бледная", "язва",
+    ],
+    "не могу наклонить голову": [
+        "температура", "температуре", "жар", "лихорадка", "сыпь", "рвота", "рвет",
+        "светобоязнь", "головная боль", "голова болит",
+    ],
+}
+
+# ...и не срабатывают, если есть слово, объясняющее их безобидно
+_NASAL_CONTEXT = ["нос", "носом", "носа", "насморк", "заложен", "заложило", "заложенность", "сопли"]
+CONTEXT_EXCLUDED = {
+    "не могу дышать": _NASAL_CONTEXT,
+    "не может дышать": _NASAL_CONTEXT,
+    "не дышит": _NASAL_CONTEXT,
+    "нехватка воздуха": _NASAL_CONTEXT,
+    "не хватает воздуха": _NASAL_CONTEXT,
+    "черный стул": [
+        "уголь", "угля", "углем", "активированный", "активированного", "висмут",
+        "де-нол", "железо", "железа", "черника", "чернику", "черники",
+    ],
+}
+
+# Служебные слова не участвуют в сопоставлении
+STOPWORDS = {
+    "в", "во", "на", "и", "с", "со", "у", "за", "по", "от", "до", "при",
+    "к", "ко", "о", "об", "а", "же", "очень", "как", "будто", "меня", "мне",
+    "я", "у", "что", "то", "это", "уже", "так", "там", "тут", "еще",
+}
+
+# Отрицание перед найденной фразой ("нет боли в груди")
+# или сразу после неё ("боль в груди отсутствует") отменяет совпадение
+NEGATIONS_BEFORE = {"нет", "не", "без", "ни", "не было"}
+NEGATIONS_AFTER = {"нет", "отсутствует", "отсутствуют", "не было"}
+
+# Окончания для упрощённого стемминга (длинные проверяются первыми)
+REFLEXIVE_ENDINGS = ("ся", "сь")
+ENDINGS = tuple(sorted([
+    "иями", "ями", "ами", "иях", "ием", "ией", "ого", "его", "ому", "ему",
+    "ыми", "ими", "ала", "яла", "ила", "ела", "али", "яли", "или", "ели",
+    "ать", "ять", "ить", "еть", "уть", "ешь", "ишь", "ает", "яет", "ует",
+    "ях", "ах", "ых", "их", "ую", "юю", "ая", "яя", "ое", "ее", "ые", "ие",
+    "ий", "ый", "ой", "ей", "ом", "ем", "ам", "ям", "ов", "ев", "ью", "ия",
+    "ии", "ал", "ял", "ил", "ел", "ла", "ло", "ли", "ет", "ит", "ут", "ют",
+    "ат", "ят", "ти",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+], key=len, reverse=True))
+
+MIN_STEM_LENGTH = 3
+
+# Исправление опечаток только для достаточно длинных основ
+MIN_TYPO_STEM_LENGTH = 5
+
+WORD_RE = re.compile(r"[а-яa-z0-9]+")
+
+
+@lru_cache(maxsize=100_000)
+def stem(word: str) -> str:
+    """Упрощённая основа русского слова"""
+    if len(word) <= MIN_STEM_LENGTH:
+        return word
+
+    for ending in REFLEXIVE_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            word = word[:-len(ending)]
+            break
+
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    """Слова текста в нижнем регистре (ё -> е)"""
+    return WORD_RE.findall(text.lower().replace("ё", "е"))
+
+
+def _deletes(word: str) -> set[str]:
+    """Все варианты слова с одной удалённой буквой"""
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+@dataclass(frozen=True)
+class RedFlag:
+    """Найденный красный флаг"""
+    category: str
+    phrase: str
+    specialist: str
+
+
+class _AhoCorasick:
+    """Автомат Ахо-Корасик над последовательностями целых чисел (id основ)"""
+
+    def __init__(self):
+        self.goto: list[dict[int, int]] = [{}]
+        self.fail: list[int] = [0]
+        # Для каждого узла: (длина шаблона, id шаблона)
+        self.output: list[list[tuple[int, int]]] = [[]]
+
+    def add(self, sequence: tuple[int, ...], pattern_id: int):
+        node = 0
+        for symbol in sequence:
+            next_node = self.goto[node].get(symbol)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][symbol] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = next_node
+        self.output[node].append((len(sequence), pattern_id))
+
+    def build(self):
+        """Строит суффиксные ссылки (обход в ширину)"""
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for symbol, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and symbol not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                candidate = self.goto[fallback].get(symbol, 0)
+                self.fail[child] = candidate if candidate != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def search(self, sequence: list[int]):
+        """Генерирует (начало, конец, id шаблона) для всех вхождений"""
+        node = 0
+        for position, symbol in enumerate(sequence):
+            while node and symbol not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(symbol, 0)
+            for length, pattern_id in self.output[node]:
+                yield position - length + 1, position + 1, pattern_id
+
+
+class RedFlagDetector:
+    """Поиск красных флагов в тексте симптомов"""
+
+    def __init__(self, lexicon: dict = RED_FLAG_LEXICON):
+        self._vocab: dict[str, int] = {}
+        self._deletes: dict[str, set[str]] = {}
+        self._flags: list[RedFlag] = []
+        self._automaton = _AhoCorasick()
+
+        for category, (specialist, phrases) in lexicon.items():
+            for phrase in phrases:
+                self._add_phrase(RedFlag(category, phrase, specialist))
+        self._automaton.build()
+
+        # Отрицания и слова контекста тоже нужны в словаре, чтобы распознавать их в тексте
+        self._negations_before = {self._sequence(phrase) for phrase in NEGATIONS_BEFORE}
+        self._negations_after = {self._sequence(phrase) for phrase in NEGATIONS_AFTER}
+        self._required = self._context(CONTEXT_REQUIRED)
+        self._excluded = self._context(CONTEXT_EXCLUDED)
+
+    def _term_id(self, term: str) -> int:
+        term_id = self._vocab.get(term)
+        if term_id is None:
+            term_id = self._vocab[term] = len(self._vocab)
+            if len(term) >= MIN_TYPO_STEM_LENGTH:
+                for variant in _deletes(term):
+                    self._deletes.setdefault(variant, set()).add(term)
+        return term_id
+
+    def _sequence(self, phrase: str) -> tuple[int, ...]:
+        return tuple(self._term_id(stem(word)) for word in tokenize(phrase) if word not in STOPWORDS)
+
+    def _context(self, context: dict) -> dict[int, list[tuple[int, ...]]]:
+        """id шаблона -> последовательности основ слов контекста"""
+        return {
+            pattern_id: [self._sequence(words) for words in context[flag.phrase]]
+            for pattern_id, flag in enumerate(self._flags)
+            if flag.phrase in context
+        }
+
+    def _add_phrase(self, flag: RedFlag):
+        sequence = self._sequence(flag.phrase)
+        pattern_id = len(self._flags)
+        self._flags.append(flag)
+
+        # Короткие фразы ищем в любом порядке слов ("боль в груди" / "грудь болит")
+        variants = set(permutations(sequence)) if len(sequence) <= 3 else {sequence}
+        for variant in variants:
+            self._automaton.add(variant, pattern_id)
+
+    @lru_cache(maxsize=100_000)
+    def _lookup(self, term: str) -> int:
+        """id основы с учётом одной опечатки (-1 если слова нет в словаре)"""
+        term_id = self._vocab.get(term)
+        if term_id is not None:
+            return term_id
+        # Слово с пропущенной буквой может быть на одну букву короче основы
+        if len(term) < MIN_TYPO_STEM_LENGTH - 1:
+            return -1
+
+        # Symmetric delete: лишняя, пропущенная или заменённая буква
+        candidates = set(self._deletes.get(term, ()))
+        for variant in _deletes(term):
+            if variant in self._vocab:
+                candidates.add(variant)
+            candidates.update(self._deletes.get(variant, ()))
+
+        candidates = {c for c in candidates if len(c) >= MIN_TYPO_STEM_LENGTH}
+        if not candidates:
+            return -1
+        return self._vocab[min(candidates, key=lambda c: (abs(len(c) - len(term)), c))]
+
+    def _terms(self, text: str) -> list[int]:
+        return [
+            self._lookup(stem(word))
+            for word in tokenize(text)
+            if word not in STOPWORDS
+        ]
+
+    @staticmethod
+    def _contains(terms: list[int], sequence: tuple[int, ...]) -> bool:
+        length = len(sequence)
+        return any(tuple(terms[i:i + length]) == sequence for i in range(len(terms) - length + 1))
+
+    def _negated(self, terms: list[int], start: int, end: int) -> bool:
+        return any(
+            start >= len(sequence) and tuple(terms[start - len(sequence):start]) == sequence
+            for sequence in self._negations_before
+        ) or any(
+            tuple(terms[end:end + len(sequence)]) == sequence
+            for sequence in self._negations_after
+        )
+
+    def detect(self, text: str) -> Optional[RedFlag]:
+        """Возвращает первый найденный красный флаг или None"""
+        terms = self._terms(text)
+        for start, end, pattern_id in self._automaton.search(terms):
+            if self._negated(terms, start, end):
+                continue
+            required = self._required.get(pattern_id)
+            if required and not any(self._contains(terms, sequence) for sequence in required):
+                continue
+            excluded = self._excluded.get(pattern_id)
+            if excluded and any(self._contains(terms, sequence) for sequence in excluded):
+                continue
+            return self._flags[pattern_id]
+        return None
+
+
+def emergency_result(flag: RedFlag) -> str:
+    """
+    Экстренный результат вместо консультации AI. Пользователь может
+    продолжить консультацию, но её итог тоже будет срочным
+    """
+    return (
+        f"🚨 *СРОЧНО! Требуется скорая помощь*\n\n"
+        f"В описании есть признаки неотложного состояния ({flag.category.lower()}: "
+        f"«{flag.phrase}»).\n\n"
+        f"*Немедленно вызовите скорую помощь (103 или 112)*, не дожидаясь консультации.\n\n"
+        f"*Специалист:* {flag.specialist}\n\n"
+        f"Если вы уверены, что состояние не экстренное, можно продолжить консультацию - "
+        f"рекомендация всё равно будет отмечена как срочная."
+    )
+
+
+red_flag_detector = RedFlagDetector()
@@ -0,0 +1,365 @@
+"""
+Локальный классификатор специалиста и срочности (без AI)
+
+Признаки - символьные n-граммы слов (хэширование в фиксированное
+пространство) с TF-IDF, модель - мультиномиальная логистическая регрессия
+на NumPy. Две "головы": специалист и срочность. Модель обучается офлайн
+на сохранённых консультациях с метками LLM (label_source = 'llm': ответы
+самого классификатора в обучение не попадают) и описаниях симптомов
+из SPECIALISTS_DATA и сохраняется в компактный .npz файл.
+
+Консультации делятся на обучающие и отложенные по хэшу id: evaluate
+оценивает модель на тех же отложенных консультациях, что не видел train.
+
+Обучение и оценка:
+    python -m services.specialist_classifier train --out models/specialist_classifier.npz
+    python -m services.specialist_classifier evaluate --model models/specialist_classifier.npz
+"""
+import json
+import logging
+import os
+import re
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+# Размер пространства признаков (2^14) и длины n-грамм
+N_FEATURES = 1 << 14
+NGRAM_RANGE = (3, 5)
+
+WORD_RE = re.compile(r"[а-яa-z0-9]+")
+
+
+@dataclass
+class Prediction:
+    """Предсказание одной головы модели"""
+    label: str
+    confidence: float
+
+
+def _features(text: str) -> tuple[np.ndarray, np.ndarray]:
+    """Индексы и частоты хэшированных символьных n-грамм"""
+    counts: dict[int, int] = {}
+    for word in WORD_RE.findall(text.lower().replace("ё", "е")):
+        padded = f" {word} "
+        for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
+            for i in range(len(padded) - n + 1):
+                index = zlib.crc32(padded[i:i + n].encode()) & (N_FEATURES - 1)
+                counts[index] = counts.get(index, 0) + 1
+
+    if not counts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    return indices, values
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=-1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class _Head:
+    """Линейный softmax-классификатор поверх TF-IDF"""
+
+    def __init__(self, classes: list[str], weights: np.ndarray, bias: np.ndarray):
+        self.classes = classes
+        self.weights = weights  # (n_classes, N_FEATURES)
+        self.bias = bias
+
+    def predict(self, indices: np.ndarray, values: np.ndarray) -> Prediction:
+        scores = self.weights[:, indices].astype(np.float32) @ values + self.bias
+        probs = _softmax(scores)
+        best = int(probs.argmax())
+        return Prediction(self.classes[best], float(probs[best]))
+
+
+class SpecialistClassifier:
+    """Классификатор специалиста и срочности по тексту симптомов"""
+
+    def __init__(self, idf: np.ndarray, specialist: _Head, urgency: Optional[_Head]):
+        self.idf = idf
+        self.specialist = specialist
+        self.urgency = urgency
+
+    def _vectorize(self, text: str) -> tuple[np.ndarray, np.ndarray]:
+        indices, counts = _features(text)
+        values = np.log1p(counts) * self.idf[indices]
+        norm = np.linalg.norm(values)
+        return indices, values / norm if norm else values
+
+    def predict(self, text: str) -> tuple[Optional[Prediction], Optional[Prediction]]:
+        """
+        Предсказывает специалиста и срочность
+
+        Returns:
+            (специалист, срочность); срочность None, если голова не обучена
+        """
+        indices, values = self._vectorize(text)
+        if not len(indices):
+            return None, None
+        specialist = self.specialist.predict(indices, values)
+        urgency = self.urgency.predict(indices, values) if self.urgency else None
+        return specialist, urgency
+
+    # ============ СОХРАНЕНИЕ / ЗАГРУЗКА ============
+
+    def save(self, path: str):
+        """Сохраняет модель (веса во float16)"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {
+            'idf': self.idf.astype(np.float16),
+            'specialist_classes': np.array(self.specialist.classes),
+            'specialist_weights': self.specialist.weights.astype(np.float16),
+            'specialist_bias': self.specialist.bias,
+        }
+        if self.urgency:
+            arrays.update({
+                'urgency_classes': np.array(self.urgency.classes),
+                'urgency_weights': self.urgency.weights.astype(np.float16),
+                'urgency_bias': self.urgency.bias,
+            })
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "SpecialistClassifier":
+        with np.load(path) as data:
+            specialist = _Head(
+                [str(c) for c in data['specialist_classes']],
+                data['specialist_weights'],
+                data['specialist_bias'].astype(np.float32)
+            )
+            urgency = None
+            if 'urgency_classes' in data:
+                urgency = _Head(
+                    [str(c) for c in data['urgency_classes']],
+                    data['urgency_weights'],
+                    data['urgency_bias'].astype(np.float32)
+                )
+            return cls(data['idf'].astype(np.float32), specialist, urgency)
+
+
+def load_classifier(path: str) -> Optional[SpecialistClassifier]:
+    """Загружает модель, если файл есть (иначе None)"""
+    if not os.path.exists(path):
+        logger.warning("Specialist classifier not found: %s", path)
+        return None
+    try:
+        classifier = SpecialistClassifier.load(path)
+        logger.info("Specialist classifier loaded: %s", path)
+        return classifier
+    except Exception as e:
+        logger.error("Classifier load error: %s", e)
+        return None
+
+
+# ============ ОБУЧЕНИЕ ============
+
+def _fit_idf(texts: list[str]) -> np.ndarray:
+    document_frequency = np.zeros(N_FEATURES, dtype=np.float32)
+    for text in texts:
+        indices, _ = _features(text)
+        document_frequency[indices] += 1
+    return np.log((1 + len(texts)) / (1 + document_frequency)).astype(np.float32) + 1
+
+
+def _fit_head(rows: list[tuple[np.ndarray, np.ndarray]], labels: list[str],
+              epochs: int = 40, batch_size: int = 256, learning_rate: float = 4.0,
+              l2: float = 1e-5, seed: int = 42) -> _Head:
+    """Обучает softmax-регрессию мини-батчевым градиентным спуском"""
+    classes = sorted(set(labels))
+    class_index = {c: i for i, c in enumerate(classes)}
+    y = np.array([class_index[label] for label in labels])
+    n_classes = len(classes)
+
+    weights = np.zeros((n_classes, N_FEATURES), dtype=np.float32)
+    bias = np.zeros(n_classes, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+
+    for epoch in range(epochs):
+        step = learning_rate / (1 + epoch * 0.1)
+        order = rng.permutation(len(rows))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            lengths = np.array([len(rows[i][0]) for i in batch])
+            indices = np.concatenate([rows[i][0] for i in batch])
+            values = np.concatenate([rows[i][1] for i in batch]).astype(np.float32)
+            row_of = np.repeat(np.arange(len(batch)), lengths)
+            starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+            # Разреженное произведение: сумма вкладов признаков по строкам
+            contributions = (weights[:, indices] * values).T
+            scores = np.add.reduceat(contributions, starts, axis=0) + bias
+
+            error = _softmax(scores)
+            error[np.arange(len(batch)), y[batch]] -= 1
+            error /= len(batch)
+
+            feature_error = error[row_of] * values[:, None]
+            for c in range(n_classes):
+                gradient = np.bincount(indices, weights=feature_error[:, c], minlength=N_FEATURES)
+                weights[c] -= step * (gradient.astype(np.float32) + l2 * weights[c])
+            bias -= step * error.sum(axis=0)
+
+    return _Head(classes, weights, bias)
+
+
+def consultation_text(row: dict) -> Optional[str]:
+    """Текст симптомов из строки таблицы consultations"""
+    try:
+        symptoms = json.loads(row['symptoms']) if isinstance(row['symptoms'], str) else row['symptoms']
+    except (TypeError, ValueError):
+        return None
+    parts = [symptoms.get('main') or ''] + list(symptoms.get('additional') or [])
+    text = ' '.join(p for p in parts if p)
+    return text or None
+
+
+# Метки, на которых можно учиться (ответы классификатора дали бы обратную связь)
+TRAINING_LABEL_SOURCES = ("llm",)
+
+
+def is_training_label(row: dict, include_legacy: bool = False) -> bool:
+    """Метка поставлена LLM (include_legacy - и строки, сохранённые до появления label_source)"""
+    source = row.get('label_source')
+    return source in TRAINING_LABEL_SOURCES or (include_legacy and source is None)
+
+
+def is_holdout(row: dict, holdout: float) -> bool:
+    """Отложенная консультация: решение по id не зависит от набора и порядка строк"""
+    return zlib.crc32(str(row.get('id')).encode()) % 10_000 < holdout * 10_000
+
+
+def train(consultation_rows: list[dict], specialist_descriptions: dict,
+          allowed_specialists: list[str]) -> SpecialistClassifier:
+    """
+    Обучает модель
+
+    Args:
+        consultation_rows: Строки consultations (symptoms, recommended_doctor, urgency_level)
+            с метками LLM (см. is_training_label)
+        specialist_descriptions: SPECIALISTS_DATA (специалист -> {'symptoms': ...})
+        allowed_specialists: Специалисты, которых может рекомендовать бот
+    """
+    samples: list[tuple[str, str, Optional[str]]] = []
+    for row in consultation_rows:
+        text = consultation_text(row)
+        if text and row.get('recommended_doctor') in allowed_specialists:
+            samples.append((text, row['recommended_doctor'], row.get('urgency_level')))
+
+    # Описания симптомов специалистов: каждая фраза - отдельный пример
+    for specialist, info in specialist_descriptions.items():
+        if specialist not in allowed_specialists:
+            continue
+        for phrase in info.get('symptoms', '').split(','):
+            if phrase.strip():
+                samples.append((phrase.strip(), specialist, None))
+
+    # Тексты без признаков (только знаки препинания и т.п.) не обучают модель
+    samples = [sample for sample in samples if len(_features(sample[0])[0])]
+    texts = [text for text, _, _ in samples]
+    idf = _fit_idf(texts)
+    classifier = SpecialistClassifier(idf, specialist=None, urgency=None)
+    rows = [classifier._vectorize(text) for text in texts]
+
+    classifier.specialist = _fit_head(rows, [specialist for _, specialist, _ in samples])
+
+    urgency_rows = [(row, urgency) for row, (_, _, urgency) in zip(rows, samples) if urgency]
+    if len({urgency for _, urgency in urgency_rows}) > 1:
+        classifier.urgency = _fit_head(
+            [row for row, _ in urgency_rows],
+            [urgency for _, urgency in urgency_rows]
+        )
+    return classifier
+
+
+def evaluate(classifier: SpecialistClassifier, consultation_rows: list[dict], threshold: float) -> dict:
+    """Точность модели относительно меток LLM"""
+    total = correct = confident = confident_correct = urgency_correct = 0
+    for row in consultation_rows:
+        text = consultation_text(row)
+        if not text:
+            continue
+        specialist, urgency = classifier.predict(text)
+        if specialist is None:
+            continue
+        total += 1
+        hit = specialist.label == row.get('recommended_doctor')
+        correct += hit
+        urgency_correct += bool(urgency and urgency.label == row.get('urgency_level'))
+        if specialist.confidence >= threshold:
+            confident += 1
+            confident_correct += hit
+
+    return {
+        'samples': total,
+        'accuracy': correct / total if total else 0.0,
+        'urgency_accuracy': urgency_correct / total if total else 0.0,
+        'coverage_at_threshold': confident / total if total else 0.0,
+        'accuracy_at_threshold': confident_correct / confident if confident else 0.0
+    }
+
+
+async def _fetch_consultations(limit: int) -> list[dict]:
+    from database.repository import consultations
+    try:
+        return await consultations.list_recent(limit)
+    finally:
+        from database.connection import close_supabase_client
+        await close_supabase_client()
+
+
+def main():
+    import argparse
+    import asyncio
+    import time
+
+    from config import CLASSIFIER_PATH, CLASSIFIER_CONFIDENCE
+
+    parser = argparse.ArgumentParser(description="Обучение и оценка локального классификатора специалиста")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("--out", "--model", dest="path", default=CLASSIFIER_PATH, help="Файл модели")
+    parser.add_argument("--limit", type=int, default=50000, help="Сколько консультаций загрузить")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Доля консультаций для оценки")
+    parser.add_argument("--threshold", type=float, default=CLASSIFIER_CONFIDENCE)
+    parser.add_argument("--include-legacy", action="store_true",
+                        help="Учитывать консультации без label_source (сохранённые до его появления)")
+    args = parser.parse_args()
+
+    rows = asyncio.run(_fetch_consultations(args.limit))
+    labeled = [row for row in rows if is_training_label(row, args.include_legacy)]
+    print(f"Консультаций загружено: {len(rows)}, с метками LLM: {len(labeled)}")
+
+    # Одинаковое разбиение в train и evaluate: по хэшу id
+    train_rows = [row for row in labeled if not is_holdout(row, args.holdout)]
+    test_rows = [row for row in labeled if is_holdout(row, args.holdout)]
+
+    if args.command == "train":
+        from bot.handlers.specialists import SPECIALISTS_DATA
+        from services.ai_service import SPECIALISTS
+
+        started = time.perf_counter()
+        classifier = train(train_rows, SPECIALISTS_DATA, SPECIALISTS)
+        print(f"Обучение на {len(train_rows)} консультациях: {time.perf_counter() - started:.1f} сек")
+        classifier.save(args.path)
+        print(f"Модель сохранена: {args.path} ({os.path.getsize(args.path) / 1024:.0f} КБ)")
+    else:
+        classifier = SpecialistClassifier.load(args.path)
+
+    report = evaluate(classifier, test_rows, args.threshold)
+    print(f"Оценка на {report['samples']} отложенных консультациях (метки LLM):")
+    print(f"  Точность (специалист): {report['accuracy']:.1%}")
+    print(f"  Точность (срочность): {report['urgency_accuracy']:.1%}")
+    print(f"  Покрытие при уверенности >= {args.threshold}: {report['coverage_at_threshold']:.1%}")
+    print(f"  Точность при уверенности >= {args.threshold}: {report['accuracy_at_threshold']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Спекулятивные фоновые задачи, привязанные к FSM-сессии пользователя
+
+Пока пользователь читает ответ и нажимает кнопки, бот заранее считает то,
+что понадобится на следующем шаге. Задача хранится по ключу сессии и имени,
+вместе с "отпечатком" входных данных: если данные изменились, результат
+не используется.
+
+Внутри спекулятивной задачи is_speculative() возвращает True: AIService
+выполняет такие запросы в отдельном бюджете и отказывается от них
+(SpeculationSkipped), а не ставит в очередь перед обычными.
+"""
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Hashable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+# Задачи старше этого возраста (сек) считаются брошенными
+MAX_TASK_AGE = 15 * 60
+
+_speculative: ContextVar[bool] = ContextVar("speculative", default=False)
+
+
+class SpeculationSkipped(Exception):
+    """Спекулятивная задача не выполнена: бюджет занят"""
+
+
+def is_speculative() -> bool:
+    """Выполняется ли текущий код в спекулятивной задаче"""
+    return _speculative.get()
+
+
+async def _run_speculative(coro: Awaitable) -> Any:
+    # У задачи своя копия контекста: флаг не виден вызвавшему обработчику
+    _speculative.set(True)
+    return await coro
+
+
+def _finished(task: asyncio.Task, coro: Awaitable):
+    # Задача, отменённая до первого шага, не запустила coro - закрываем,
+    # иначе при сборке мусора будет "coroutine was never awaited"
+    if task.cancelled():
+        close = getattr(coro, "close", None)
+        if close is not None:
+            close()
+        return
+    # Исключение фоновой задачи не должно попадать в лог как "never retrieved"
+    task.exception()
+
+
+class SpeculativeTasks:
+    """Реестр спекулятивных задач по сессиям"""
+
+    def __init__(self, max_age: float = MAX_TASK_AGE):
+        self.max_age = max_age
+        # session -> name -> (fingerprint, started_at, task)
+        self._sessions: dict[Hashable, dict[str, tuple[Any, float, asyncio.Task]]] = {}
+        self.started = 0
+        self.used = 0
+        self.cancelled = 0
+
+    def start(self, session: Hashable, name: str, coro: Awaitable, fingerprint: Any = None) -> asyncio.Task:
+        """Запускает задачу (предыдущая задача с тем же именем отменяется)"""
+        self.cancel(session, name)
+
+        task = asyncio.ensure_future(_run_speculative(coro))
+        task.add_done_callback(lambda t: _finished(t, coro))
+        self._sessions.setdefault(session, {})[name] = (fingerprint, time.monotonic(), task)
+        self.started += 1
+        return task
+
+    def get(self, session: Hashable, name: str, fingerprint: Any = None) -> Optional[asyncio.Task]:
+        """Возвращает задачу, если она есть и посчитана для тех же входных данных"""
+        entry = self._sessions.get(session, {}).get(name)
+        if entry is None:
+            return None
+
+        task_fingerprint, _, task = entry
+        if task_fingerprint != fingerprint or task.cancelled():
+            return None
+        return task
+
+    async def take(self, session: Hashable, name: str, fingerprint: Any = None) -> Any:
+        """
+        Забирает результат задачи (дожидаясь её, если она ещё идёт)
+
+        Returns:
+            Результат или None, если задачи нет или она завершилась ошибкой
+        """
+        task = self.get(session, name, fingerprint)
+        if task is None:
+            return None
+
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                return None
+            raise
+        except SpeculationSkipped:
+            return None
+        except Exception as e:
+            logger.warning("Speculation error (%s): %s", name, e)
+            return None
+
+        self.used += 1
+        return result
+
+    def cancel(self, session: Hashable, name: Optional[str] = None):
+        """Отменяет задачу по имени или все задачи сессии"""
+        tasks = self._sessions.get(session)
+        if not tasks:
+            return
+
+        names = [name] if name else list(tasks)
+        for task_name in names:
+            entry = tasks.pop(task_name, None)
+            if entry and not entry[2].done():
+                entry[2].cancel()
+                self.cancelled += 1
+
+        if not tasks:
+            self._sessions.pop(session, None)
+
+    def prune(self) -> int:
+        """
+        Удаляет задачи брошенных сессий; вызывается по таймеру (SessionManager),
+        а не на каждый start, чтобы стоимость сообщения не росла с числом сессий
+
+        Returns:
+            Сколько задач удалено
+        """
+        deadline = time.monotonic() - self.max_age
+        pruned = 0
+        for session in list(self._sessions):
+            tasks = self._sessions[session]
+            for name in [n for n, (_, started_at, _) in tasks.items() if started_at < deadline]:
+                self.cancel(session, name)
+                pruned += 1
+        return pruned
+
+    def stats(self) -> dict:
+        """Статистика спекулятивных задач"""
+        return {
+            'sessions': len(self._sessions),
+            'tasks': sum(len(tasks) for tasks in self._sessions.values()),
+            'started': self.started,
+            'used': self.used,
+            'cancelled': self.cancelled
+        }
+
+
+speculative_tasks = SpeculativeTasks()
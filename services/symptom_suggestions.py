@@ -0,0 +1,254 @@
+"""
+Подбор дополнительных симптомов по истории консультаций (без AI)
+
+Из сохранённых консультаций строится матрица совместной встречаемости
+"основа слова из основных жалоб" x "выбранный дополнительный симптом"
+в разреженном формате CSR на NumPy. Вес пары - положительная поточечная
+взаимная информация (PPMI) со сглаживанием редких пар. Для нового текста
+веса строк его основ суммируются, и лучшие симптомы возвращаются за доли
+миллисекунды. Если истории мало или текст непохож на известные - None,
+и симптомы генерирует LLM.
+"""
+import json
+import logging
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+
+from config import SUGGESTIONS_MIN_HISTORY
+from .red_flags import STOPWORDS, stem, tokenize
+
+
+logger = logging.getLogger(__name__)
+
+
+# Симптом должен быть выбран хотя бы столько раз, чтобы его предлагать
+MIN_SYMPTOM_SUPPORT = 3
+
+# Основа учитывается, если встречалась хотя бы в стольких консультациях
+MIN_TERM_SUPPORT = 5
+
+# Доля основ текста, которые должны быть известны модели
+MIN_TERM_COVERAGE = 0.6
+
+# Симптомы со счётом ниже этой доли от лучшего - случайные попутчики
+MIN_RELATIVE_SCORE = 0.25
+
+# Меньше стольких уверенных вариантов - отдаём запрос LLM
+MIN_SUGGESTIONS = 6
+MAX_SUGGESTIONS = 10
+
+# Новые пары копятся в словаре и вливаются в матрицу раз в столько консультаций
+COMPACT_EVERY = 100
+
+MAX_SYMPTOM_LENGTH = 50
+
+
+def _text_terms(text: str) -> frozenset[str]:
+    """Основы значимых слов текста"""
+    return frozenset(stem(word) for word in tokenize(text) if word not in STOPWORDS)
+
+
+def _normalize_symptom(symptom: str) -> str:
+    return ' '.join(symptom.strip().strip('"').strip("'").casefold().split())
+
+
+class SymptomSuggester:
+    """Инкрементальная матрица PPMI "основа жалобы -> дополнительный симптом" """
+
+    def __init__(self, min_history: int = SUGGESTIONS_MIN_HISTORY):
+        self.min_history = min_history
+        self.suggested = 0
+        self.cold_start = 0
+        self.low_confidence = 0
+        self._reset()
+
+    def _reset(self):
+        self._term_index: dict[str, int] = {}
+        self._term_counts: list[int] = []
+        self._symptom_index: dict[str, int] = {}
+        self._symptom_labels: list[str] = []
+        self._symptom_terms: list[frozenset[str]] = []
+        self._symptom_counts: list[int] = []
+        self._consultations = 0
+
+        # Пары, ещё не влитые в матрицу: (основа, симптом) -> число консультаций
+        self._pending: dict[tuple[int, int], int] = {}
+        self._pending_consultations = 0
+
+        # CSR: строки - основы, столбцы - симптомы
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._weights = np.zeros(0, dtype=np.float32)
+        self._n_symptoms = 0
+
+    # ============ ОБНОВЛЕНИЕ ============
+
+    def _term_id(self, term: str) -> int:
+        term_id = self._term_index.get(term)
+        if term_id is None:
+            term_id = self._term_index[term] = len(self._term_counts)
+            self._term_counts.append(0)
+        return term_id
+
+    def _symptom_id(self, key: str, label: str) -> int:
+        symptom_id = self._symptom_index.get(key)
+        if symptom_id is None:
+            symptom_id = self._symptom_index[key] = len(self._symptom_counts)
+            self._symptom_labels.append(label)
+            self._symptom_terms.append(_text_terms(label))
+            self._symptom_counts.append(0)
+        return symptom_id
+
+    def add(self, main_symptoms: str, additional_symptoms: list[str], compact: bool = True):
+        """Учитывает завершённую консультацию"""
+        term_ids = [self._term_id(term) for term in _text_terms(main_symptoms)]
+        if not term_ids:
+            return
+
+        symptom_ids = set()
+        for symptom in additional_symptoms:
+            key = _normalize_symptom(symptom)
+            if key and len(key) <= MAX_SYMPTOM_LENGTH:
+                symptom_ids.add(self._symptom_id(key, symptom.strip().strip('"').strip("'")))
+
+        self._consultations += 1
+        for term_id in term_ids:
+            self._term_counts[term_id] += 1
+        for symptom_id in symptom_ids:
+            self._symptom_counts[symptom_id] += 1
+            for term_id in term_ids:
+                pair = (term_id, symptom_id)
+                self._pending[pair] = self._pending.get(pair, 0) + 1
+
+        self._pending_consultations += 1
+        if compact and self._pending_consultations >= COMPACT_EVERY:
+            self._compact()
+
+    def _compact(self):
+        """Вливает накопленные пары в CSR и пересчитывает веса PPMI"""
+        n_terms = len(self._term_counts)
+        n_rows = len(self._indptr) - 1
+
+        # Ключ пары - номер строки в старших 32 битах, столбца - в младших
+        rows = np.repeat(np.arange(n_rows, dtype=np.int64), np.diff(self._indptr))
+        keys = (rows << 32) | self._indices
+        counts = self._counts
+        if self._pending:
+            pending_keys = np.fromiter(
+                ((term_id << 32) | symptom_id for term_id, symptom_id in self._pending),
+                dtype=np.int64, count=len(self._pending)
+            )
+            pending_counts = np.fromiter(self._pending.values(), dtype=np.int64, count=len(self._pending))
+            keys, inverse = np.unique(np.concatenate([keys, pending_keys]), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate([counts, pending_counts])).astype(np.int64)
+
+        rows = keys >> 32
+        columns = keys & 0xFFFFFFFF
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_terms), out=indptr[1:])
+
+        term_counts = np.array(self._term_counts, dtype=np.float64)
+        symptom_counts = np.array(self._symptom_counts, dtype=np.float64)
+        pmi = np.log(counts * self._consultations / (term_counts[rows] * symptom_counts[columns]))
+        # Редкие пары дают завышенную PMI - ослабляем их множителем c / (c + 1)
+        weights = np.maximum(pmi, 0) * counts / (counts + 1)
+        weights[symptom_counts[columns] < MIN_SYMPTOM_SUPPORT] = 0
+
+        self._indptr = indptr
+        self._indices = columns
+        self._counts = counts
+        self._weights = weights.astype(np.float32)
+        self._n_symptoms = len(self._symptom_counts)
+        self._pending = {}
+        self._pending_consultations = 0
+
+    def fit(self, rows: list[dict]):
+        """Строит матрицу заново по строкам таблицы consultations"""
+        self._reset()
+        for row in rows:
+            try:
+                symptoms = json.loads(row['symptoms']) if isinstance(row['symptoms'], str) else row['symptoms']
+                self.add(symptoms.get('main') or '', symptoms.get('additional') or [], compact=False)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+        self._compact()
+
+    async def load(self, fetch: Callable[[int], Awaitable[list[dict]]], limit: int):
+        """Загружает историю консультаций (например, consultations.list_recent)"""
+        try:
+            rows = await fetch(limit)
+        except Exception as e:
+            logger.error("Symptom suggestions load error: %s", e)
+            return
+        self.fit(rows)
+        logger.info(
+            "Symptom suggestions: %s consultations, %s pairs, %s symptoms",
+            self._consultations, len(self._weights), self._n_symptoms
+        )
+
+    # ============ ПОДБОР ============
+
+    def suggest(self, main_symptoms: str, limit: int = MAX_SUGGESTIONS) -> Optional[list[str]]:
+        """
+        Подбирает дополнительные симптомы по основным жалобам
+
+        Returns:
+            Список симптомов или None, если истории недостаточно для уверенного ответа
+        """
+        if self._consultations < self.min_history:
+            self.cold_start += 1
+            return None
+
+        terms = _text_terms(main_symptoms)
+        n_rows = len(self._indptr) - 1
+        rows = [
+            term_id for term_id in (self._term_index.get(term) for term in terms)
+            if term_id is not None and term_id < n_rows and self._term_counts[term_id] >= MIN_TERM_SUPPORT
+        ]
+        if not terms or len(rows) < len(terms) * MIN_TERM_COVERAGE:
+            self.low_confidence += 1
+            return None
+
+        slices = [slice(self._indptr[row], self._indptr[row + 1]) for row in rows]
+        columns = np.concatenate([self._indices[s] for s in slices])
+        weights = np.concatenate([self._weights[s] for s in slices])
+        scores = np.bincount(columns, weights=weights, minlength=self._n_symptoms)
+
+        candidates = np.flatnonzero(scores > max(scores.max(initial=0) * MIN_RELATIVE_SCORE, 0))
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+        suggestions = []
+        for symptom_id in candidates:
+            # Симптом, который уже назван в жалобах, не предлагаем
+            if self._symptom_terms[symptom_id] <= terms:
+                continue
+            suggestions.append(self._symptom_labels[symptom_id])
+            if len(suggestions) == limit:
+                break
+
+        if len(suggestions) < MIN_SUGGESTIONS:
+            self.low_confidence += 1
+            return None
+
+        self.suggested += 1
+        return suggestions
+
+    def stats(self) -> dict:
+        """Размер модели и доля ответов без LLM"""
+        total = self.suggested + self.cold_start + self.low_confidence
+        return {
+            'consultations': self._consultations,
+            'terms': len(self._term_counts),
+            'symptoms': len(self._symptom_counts),
+            'pairs': len(self._weights),
+            'pending_pairs': len(self._pending),
+            'suggested': self.suggested,
+            'cold_start': self.cold_start,
+            'low_confidence': self.low_confidence,
+            'local_ratio': self.suggested / total if total else 0.0
+        }
+
+
+symptom_suggester = SymptomSuggester()
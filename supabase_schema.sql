@@ -2,6 +2,9 @@
 CREATE TABLE IF NOT EXISTS user_profiles (
     user_id BIGINT PRIMARY KEY,
     username TEXT,
+    full_name TEXT,
+    phone TEXT,
+    birthdate DATE,
     age INTEGER,
     gender TEXT CHECK (gender IN ('male', 'female', 'other')),
     height INTEGER,
@@ -18,9 +21,18 @@ CREATE TABLE IF NOT EXISTS consultations (
     questions_answers TEXT NOT NULL,
     recommended_doctor TEXT NOT NULL,
     urgency_level TEXT CHECK (urgency_level IN ('low', 'medium', 'high', 'emergency')),
+    -- Способ проверки симптомов (A/B): combined, split или combined_fallback
+    symptoms_pipeline TEXT,
+    -- Кто определил специалиста: llm, classifier, classifier_fallback или default
+    -- (классификатор обучается только на llm)
+    label_source TEXT,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Миграция существующей базы:
+-- ALTER TABLE consultations ADD COLUMN IF NOT EXISTS symptoms_pipeline TEXT;
+-- ALTER TABLE consultations ADD COLUMN IF NOT EXISTS label_source TEXT;
+
 -- Таблица сообщений (история диалогов)
 CREATE TABLE IF NOT EXISTS messages (
     id SERIAL PRIMARY KEY,
@@ -0,0 +1,10 @@
+"""
+Общие настройки тестов: config.py требует ключи при импорте
+"""
+import os
+
+os.environ.setdefault("BOT_TOKEN", "123456:TESTTESTTESTTESTTESTTESTTESTTESTTEST")
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("DB_BACKEND", "memory")
+os.environ.setdefault("FSM_STORAGE", "memory")
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
@@ -0,0 +1,144 @@
+"""
+Красный флаг в обработчиках консультации: экстренный результат без AI,
+продолжение по кнопке и срочный итог
+
+Запуск (из корня проекта):
+    python -m pytest tests
+"""
+import asyncio
+import itertools
+import time
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, User
+
+from bot.handlers import consultation
+from bot.states import Consultation
+
+
+CHAT_ID = 42
+EMERGENCY_TEXT = "Сильная давящая боль в груди, отдаёт в левую руку"
+
+
+class RecordingSession(BaseSession):
+    """Сессия бота без сети: запоминает тексты отправленных сообщений"""
+
+    def __init__(self):
+        super().__init__()
+        self.sent: list[str] = []
+        self._message_ids = itertools.count(1000)
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            self.sent.append(method.text)
+            return Message(
+                message_id=next(self._message_ids),
+                date=int(time.time()),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=method.text
+            ).as_(bot)
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        return
+        yield b""
+
+
+class FakeAI:
+    """Ответы AIService без Groq; analyze_calls - сколько раз вызывался анализ"""
+
+    def __init__(self, urgency: str = "medium"):
+        self.urgency = urgency
+        self.analyze_calls = 0
+
+    async def analyze_symptoms(self, text, **kwargs):
+        self.analyze_calls += 1
+        return {'is_valid': True, 'reason': '', 'improved': text, 'pipeline': 'combined'}
+
+    async def generate_additional_symptoms(self, main_symptoms, duration=None):
+        return []
+
+    async def recommend_doctor(self, **kwargs):
+        return {'specialist': 'Терапевт', 'urgency': self.urgency, 'reasoning': 'Тест', 'source': 'llm'}
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """Бот с записывающей сессией, FSM в памяти и AI-заглушка"""
+    ai = FakeAI()
+    monkeypatch.setattr(consultation, "ai_service", ai)
+    session = RecordingSession()
+    bot = Bot("123456:TESTTESTTESTTESTTESTTESTTESTTESTTEST", session=session)
+    state = FSMContext(MemoryStorage(), StorageKey(bot_id=bot.id, chat_id=CHAT_ID, user_id=CHAT_ID))
+
+    def message(text: str) -> Message:
+        return Message(
+            message_id=1,
+            date=int(time.time()),
+            chat=Chat(id=CHAT_ID, type="private"),
+            from_user=User(id=CHAT_ID, is_bot=False, first_name="Test"),
+            text=text
+        ).as_(bot)
+
+    return ai, session, state, message
+
+
+def test_red_flag_stops_before_llm(chat):
+    ai, session, state, message = chat
+
+    async def scenario():
+        await state.set_state(Consultation.waiting_for_symptoms)
+        await consultation.process_symptoms_text(message(EMERGENCY_TEXT), state)
+        return await state.get_state(), await state.get_data()
+
+    current, data = asyncio.run(scenario())
+    assert ai.analyze_calls == 0
+    assert current == Consultation.red_flag_confirm.state
+    assert data['red_flag'][0] == "Признаки сердечного приступа"
+    assert "СРОЧНО" in session.sent[-1]
+
+
+def test_continue_after_red_flag_forces_emergency(chat):
+    ai, session, state, message = chat
+
+    async def scenario():
+        await state.set_state(Consultation.waiting_for_symptoms)
+        await consultation.process_symptoms_text(message(EMERGENCY_TEXT), state)
+        await consultation.continue_after_red_flag(message("▶️ Продолжить консультацию"), state)
+        after_continue = await state.get_state()
+
+        await state.update_data(duration="1-3 дня", selected_additional=set())
+        await state.set_state(Consultation.final_confirmation)
+        await consultation.final_confirm(message("✅ Подтвердить"), state)
+        return after_continue, await state.get_state()
+
+    after_continue, final = asyncio.run(scenario())
+    assert ai.analyze_calls == 1
+    assert after_continue == Consultation.confirming_symptoms.state
+    assert final is None
+    # LLM ответила «средняя», но итог после красного флага - срочный
+    assert "СРОЧНО! Требуется скорая помощь" in session.sent[-1]
+    assert "Средняя" not in session.sent[-1]
+
+
+def test_ordinary_symptoms_go_to_llm(chat):
+    ai, session, state, message = chat
+
+    async def scenario():
+        await state.set_state(Consultation.waiting_for_symptoms)
+        await consultation.process_symptoms_text(message("Болит голова уже третий день"), state)
+        return await state.get_state(), await state.get_data()
+
+    current, data = asyncio.run(scenario())
+    assert ai.analyze_calls == 1
+    assert current == Consultation.confirming_symptoms.state
+    assert 'red_flag' not in data
@@ -0,0 +1,63 @@
+"""
+Регрессионные тесты детектора красных флагов
+
+Запуск (из корня проекта):
+    python -m pytest tests
+"""
+import pytest
+
+from services.red_flags import RedFlagDetector
+
+
+@pytest.fixture(scope="module")
+def detector():
+    return RedFlagDetector()
+
+
+@pytest.mark.parametrize("text, category", [
+    ("Сильная давящая боль в груди, отдаёт в левую руку", "Признаки сердечного приступа"),
+    ("грудь болит уже час", "Признаки сердечного приступа"),
+    ("у мамы перекосило лицо", "Признаки инсульта"),
+    ("она не может говорить", "Признаки инсульта"),
+    ("не могу дышать", "Нарушение дыхания"),
+    ("муж не может дышать", "Нарушение дыхания"),
+    ("ребенок не дышит", "Нарушение дыхания"),
+    ("Задыхаюсь ночью, не хватает воздуха", "Нарушение дыхания"),
+    ("потерял сознание на улице", "Нарушение сознания"),
+    ("судороги по всему телу, не реагирует", "Нарушение сознания"),
+    ("у ребенка судороги при температуре", "Нарушение сознания"),
+    ("черный стул и слабость, кружится голова", "Признаки кровотечения"),
+    ("рвота кровью", "Признаки кровотечения"),
+    ("не могу наклонить голову, температура 39 и сыпь", "Признаки менингита"),
+    ("отекло горло после укуса осы", "Тяжёлая аллергическая реакция"),
+    ("мысли о самоубийстве", "Угроза жизни"),
+    ("сильное кравотечение", "Признаки кровотечения"),
+])
+def test_detects_red_flags(detector, text, category):
+    flag = detector.detect(text)
+    assert flag is not None
+    assert flag.category == category
+
+
+@pytest.mark.parametrize("text", [
+    # Неоднозначные фразы без уточняющего контекста
+    "судороги в ногах по ночам",
+    "не могу дышать носом, заложен нос",
+    "Насморк, не хватает воздуха носом",
+    "ребенок не может дышать носом",
+    "не могу наклонить голову из-за шеи",
+    "черный стул после активированного угля",
+    # Отрицание до и после симптома
+    "нет боли в груди, просто кашель по утрам",
+    "боли в груди нет",
+    "Боль в груди отсутствует",
+    "боли в груди не было",
+    "не было боли в груди",
+    # Обычные жалобы
+    "Болит голова уже третий день, особенно в висках",
+    "температура 38.5, кашель сухой, слабость и ломота в теле",
+    "Сыпь на руках и зуд, появилась после нового крема",
+    "Боль в пояснице, отдаёт в ногу, усиливается при наклоне",
+])
+def test_ignores_ordinary_complaints(detector, text):
+    assert detector.detect(text) is None
@@ -0,0 +1,48 @@
+"""
+Учёт FSM-сессий: живые сессии и их объём для MemoryStorage и RedisFSMStorage
+
+Запуск (из корня проекта):
+    python -m pytest tests
+"""
+import asyncio
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from bot.fsm_storage import InMemoryRedis, RedisFSMStorage
+from bot.sessions import SessionManager
+from bot.state_codec import encode
+
+
+STATE = "Consultation:final_confirmation"
+DATA = {"main_symptoms": "болит голова", "selected_additional": {"тошнота", "слабость"}}
+
+
+@pytest.mark.parametrize("make_storage", [MemoryStorage, lambda: RedisFSMStorage(InMemoryRedis())])
+def test_measure_counts_only_sessions_with_state(make_storage):
+    storage = make_storage()
+    manager = SessionManager(storage)
+
+    async def scenario():
+        for chat_id in range(3):
+            key = StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id)
+            manager.touch(key)
+            if chat_id < 2:
+                await storage.set_state(key, STATE)
+                await storage.set_data(key, DATA)
+            else:
+                # Чат без состояния (например, /start) - не сессия
+                await storage.get_state(key)
+        await manager.measure()
+
+    asyncio.run(scenario())
+    stats = manager.stats()
+    assert stats['live'] == 2
+    assert stats['bytes'] == 2 * (len(STATE) + len(encode(DATA)))
+
+
+def test_redis_sessions_are_not_tracked_for_eviction():
+    manager = SessionManager(RedisFSMStorage(InMemoryRedis()))
+    manager.touch(StorageKey(bot_id=1, chat_id=1, user_id=1))
+    assert manager.stats()['tracked'] == 0
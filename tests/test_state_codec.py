@@ -0,0 +1,127 @@
+"""
+Тесты двоичного кодека данных FSM
+
+Формат хранится в Redis между перезапусками, поэтому закреплён байт в байт:
+перестановка KNOWN_KEYS или смена тегов должна ломать эти тесты.
+
+Запуск (из корня проекта):
+    python -m pytest tests
+"""
+import pytest
+
+from bot.state_codec import KNOWN_KEYS, VERSION, StateCodecError, decode, encode
+
+
+@pytest.mark.parametrize("value", [
+    None,
+    True,
+    False,
+    0,
+    1,
+    -1,
+    63,
+    -64,
+    2 ** 63,
+    -(2 ** 63) - 1,
+    10 ** 30,
+    1.5,
+    -0.25,
+    "",
+    "Болит голова уже третий день",
+    b"\x00\xff",
+    [],
+    [1, "два", None],
+    (),
+    ("Терапевт", "high"),
+    set(),
+    {"Тошнота", "Слабость", "Головокружение"},
+    {},
+    {"nested": {"list": [1, (2, 3)], "set": {4}}},
+])
+def test_round_trip(value):
+    decoded = decode(encode(value))
+    assert decoded == value
+    assert type(decoded) is type(value)
+
+
+def test_round_trip_consultation_data():
+    data = {
+        "main_symptoms": "Головная боль, тошнота",
+        "duration": "1-3 дня",
+        "additional_symptoms_options": ["Тошнота", "Слабость"],
+        "selected_additional": {"Тошнота"},
+        "symptoms_pipeline": "combined",
+        "red_flag": ("Признаки инсульта", "перекосило лицо", "Невролог"),
+        "suggested_additional": None,
+        # Ключ не из KNOWN_KEYS кодируется строкой
+        "custom_key": -42,
+    }
+    assert decode(encode(data)) == data
+
+
+def test_frozenset_decodes_as_set():
+    assert decode(encode(frozenset({1, 2}))) == {1, 2}
+
+
+def test_pinned_encoding():
+    data = {
+        "main_symptoms": "жар",
+        "selected_additional": {"кашель"},
+        "duration": -3,
+        "custom": None,
+        "phone": [True, 1.5],
+    }
+    expected = bytes.fromhex(
+        "01"                          # версия
+        "0a05"                        # словарь из 5 пар
+        "0b00" "0506d0b6d0b0d180"     # main_symptoms: "жар"
+        "0b03" "0901" "050cd0bad0b0d188d0b5d0bbd18c"  # selected_additional: {"кашель"}
+        "0b01" "0305"                 # duration: -3 (zigzag 5)
+        "0506637573746f6d" "00"       # "custom": None
+        "0b05" "0702" "02" "04000000000000f83f"  # phone: [True, 1.5]
+    )
+    assert encode(data) == expected
+    assert decode(expected) == data
+
+
+def test_known_keys_are_append_only():
+    # Номер ключа - часть формата: новые ключи только в конец
+    assert KNOWN_KEYS[:12] == (
+        "main_symptoms", "duration", "additional_symptoms_options", "selected_additional",
+        "full_name", "phone", "birthdate", "gender", "height", "weight", "current_category",
+        "symptoms_pipeline",
+    )
+    assert len(set(KNOWN_KEYS)) == len(KNOWN_KEYS)
+    assert len(KNOWN_KEYS) <= 256
+
+
+def test_large_int_encoding():
+    assert encode(300) == bytes((VERSION, 3, 0xD8, 0x04))
+    assert encode(-1) == bytes((VERSION, 3, 1))
+
+
+@pytest.mark.parametrize("value", [
+    {1: "не строковый ключ"},
+    object(),
+    [1, object()],
+])
+def test_encode_rejects_unsupported(value):
+    with pytest.raises(StateCodecError):
+        encode(value)
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    bytes((VERSION + 1,)) + encode("x")[1:],  # другая версия формата
+    bytes((VERSION, 0x7F)),                   # неизвестный тег
+    bytes((VERSION, 5, 10, 0x61)),            # строка короче заявленной длины
+    bytes((VERSION, 5, 2, 0xFF, 0xFE)),       # не UTF-8
+    bytes((VERSION, 4, 0, 0)),                # обрезанный float
+    bytes((VERSION, 7, 2, 0)),                # список короче заявленного
+    bytes((VERSION, 10, 1, 0x0B, 0xFF, 0)),   # номер ключа вне KNOWN_KEYS
+    bytes((VERSION, 10, 1, 3, 2, 0)),         # ключ словаря - не строка
+    encode({"duration": 1}) + b"\x00",        # лишние байты в конце
+])
+def test_decode_rejects_corrupted(data):
+    with pytest.raises(StateCodecError):
+        decode(data)